@@ -0,0 +1,138 @@
+"""
+エンドポイント別の適応的並列数制御（AIMD）
+全モデルコンテナ（ast-api, superb-api, vibe-transcriber-v2, api-gpt-v1 等）が
+同じEC2ホストで動いているため、固定の並列数ではなく応答状況に応じて並列数を調整する
+
+- レイテンシが正常な間は並列数を加算的に増やす（成功1件ごとに +1/limit）
+- 429/503・タイムアウト・レイテンシ急増時は乗算的に減らす（limit * DECREASE_FACTOR）
+- 現在の並列数はスケジューラーAPI（/api/scheduler/concurrency）で参照できる
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+# 並列数を減らすHTTPステータス
+OVERLOAD_STATUS_CODES = (429, 503)
+# 乗算的減少の係数
+DECREASE_FACTOR = 0.5
+# ベースラインレイテンシの何倍で「急増」と判定するか
+LATENCY_SPIKE_RATIO = 3.0
+# 急増判定を始めるまでに必要なサンプル数
+MIN_LATENCY_SAMPLES = 5
+# ベースライン（正常時レイテンシ）の指数移動平均の係数
+BASELINE_ALPHA = 0.1
+
+
+class AdaptiveLimiter:
+    """1エンドポイント分のAIMD並列数制御"""
+
+    def __init__(self, name: str, initial_limit: int, min_limit: int = 1, max_limit: Optional[int] = None):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit or initial_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.baseline_latency = None
+        self.last_latency = None
+        self.samples = 0
+        self.increases = 0
+        self.decreases = 0
+        self.last_decrease_reason = None
+        self._last_decrease_at = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self):
+        """並列数に空きができるまで待機"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+
+    async def release(self, latency: Optional[float], overloaded: bool = False, reason: str = None):
+        """
+        リクエスト完了を記録し並列数を調整
+        overloaded: 429/503・タイムアウト等の過負荷シグナル
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            if latency is not None:
+                self.last_latency = latency
+
+            if not overloaded and latency is not None and self._is_latency_spike(latency):
+                overloaded = True
+                reason = f"latency spike ({latency:.1f}s > {self.baseline_latency:.1f}s x {LATENCY_SPIKE_RATIO})"
+
+            if overloaded:
+                self._decrease(reason or "overload")
+            elif latency is not None:
+                self._update_baseline(latency)
+                self._increase()
+
+            self._condition.notify_all()
+
+    def _is_latency_spike(self, latency: float) -> bool:
+        return (
+            self.baseline_latency is not None
+            and self.samples >= MIN_LATENCY_SAMPLES
+            and latency > self.baseline_latency * LATENCY_SPIKE_RATIO
+        )
+
+    def _update_baseline(self, latency: float):
+        self.samples += 1
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency += BASELINE_ALPHA * (latency - self.baseline_latency)
+
+    def _increase(self):
+        if self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.increases += 1
+
+    def _decrease(self, reason: str):
+        # 同じ過負荷の波で何度も減らさないよう、ベースラインレイテンシ分は間隔を空ける
+        now = time.monotonic()
+        cooldown = self.baseline_latency or 1.0
+        if now - self._last_decrease_at < cooldown:
+            return
+        self._last_decrease_at = now
+        self.limit = max(float(self.min_limit), self.limit * DECREASE_FACTOR)
+        self.decreases += 1
+        self.last_decrease_reason = f"{datetime.now().isoformat()} {reason}"
+
+    def snapshot(self) -> Dict:
+        return {
+            "limit": self.current_limit,
+            "minLimit": self.min_limit,
+            "maxLimit": self.max_limit,
+            "inFlight": self.in_flight,
+            "baselineLatency": round(self.baseline_latency, 3) if self.baseline_latency is not None else None,
+            "lastLatency": round(self.last_latency, 3) if self.last_latency is not None else None,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "lastDecreaseReason": self.last_decrease_reason
+        }
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, initial_limit: int, max_limit: Optional[int] = None) -> AdaptiveLimiter:
+    """エンドポイント（API名）ごとのリミッターを取得（プロセス内で共有）"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name, initial_limit, max_limit=max_limit)
+        return _limiters[name]
+
+
+def get_limits_snapshot() -> Dict[str, Dict]:
+    """全エンドポイントの現在の並列数"""
+    with _limiters_lock:
+        return {name: limiter.snapshot() for name, limiter in _limiters.items()}
@@ -0,0 +1,132 @@
+"""
+ファイルベースAPIのバッチサイズ・タイムアウトの自動調整
+call_apiで計測した処理時間から1ファイルあたりの処理時間を移動平均で推定し、
+目標バッチ処理時間（target_batch_seconds）に収まるバッチサイズとリクエストタイムアウトを決める
+
+- 推定値はJSONファイルに保存し、CLI実行・常駐エンジンの両方で引き継ぐ
+- 推定値がまだない場合はAPI_CONFIGSの batch_size / timeout をそのまま使う
+- 音声の長さ（秒）が分かる場合は、推定処理時間がタイムアウトを超えないようにバッチを詰める
+"""
+
+import logging
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from state_file import locked_json_state
+
+logger = logging.getLogger(__name__)
+
+# 推定値の保存先（scheduler-configボリューム）
+TUNER_STATE_FILE = os.environ.get('BATCH_TUNER_STATE_FILE', '/app/config/batch-tuner-state.json')
+
+# 移動平均の係数（新しい計測値の重み）
+EWMA_ALPHA = 0.3
+# タイムアウト = 推定処理時間 x 安全係数
+TIMEOUT_SAFETY_FACTOR = 2.0
+MIN_TIMEOUT = 60
+MAX_TIMEOUT = 1800
+# target_batch_seconds が未設定のAPIの目標バッチ処理時間（秒）
+DEFAULT_TARGET_BATCH_SECONDS = 240
+DEFAULT_MIN_BATCH_SIZE = 1
+DEFAULT_MAX_BATCH_SIZE = 50
+
+
+def _ewma(previous: Optional[float], sample: float) -> float:
+    if previous is None:
+        return sample
+    return previous + EWMA_ALPHA * (sample - previous)
+
+
+class BatchTuner:
+    """APIごとの1ファイルあたり処理時間の推定とバッチ計画"""
+
+    def __init__(self, state_file: str = TUNER_STATE_FILE):
+        self.state_file = state_file
+
+    def estimate(self, api_name: str) -> Optional[Dict]:
+        """現在の推定値（seconds_per_file, seconds_per_audio_second, samples）"""
+        try:
+            with locked_json_state(self.state_file) as state:
+                return state.get(api_name)
+        except OSError as e:
+            logger.warning(f"バッチ調整の推定値読み込みエラー: {e}")
+            return None
+
+    def record(self, api_name: str, file_count: int, elapsed: float,
+               audio_seconds: Optional[float] = None, lower_bound: bool = False):
+        """
+        バッチの処理時間を記録
+        lower_bound: タイムアウト時など、実際の処理時間が計測値以上であることだけが分かる場合
+                     （推定値を計測値まで引き上げるのみで、引き下げない）
+        """
+        if file_count <= 0 or elapsed <= 0:
+            return
+        per_file = elapsed / file_count
+        per_audio_second = elapsed / audio_seconds if audio_seconds else None
+
+        try:
+            with locked_json_state(self.state_file) as state:
+                entry = state.setdefault(api_name, {
+                    "seconds_per_file": None,
+                    "seconds_per_audio_second": None,
+                    "samples": 0
+                })
+                if lower_bound:
+                    entry["seconds_per_file"] = max(entry["seconds_per_file"] or 0, per_file)
+                    if per_audio_second is not None:
+                        entry["seconds_per_audio_second"] = max(entry["seconds_per_audio_second"] or 0, per_audio_second)
+                else:
+                    entry["seconds_per_file"] = _ewma(entry["seconds_per_file"], per_file)
+                    if per_audio_second is not None:
+                        entry["seconds_per_audio_second"] = _ewma(entry["seconds_per_audio_second"], per_audio_second)
+                entry["samples"] += 1
+        except OSError as e:
+            logger.warning(f"バッチ調整の推定値保存エラー: {e}")
+
+    def plan(self, api_name: str, config: Dict) -> Tuple[int, int]:
+        """
+        次のバッチサイズとリクエストタイムアウト（秒）を決める
+        戻り値: (batch_size, timeout)
+        """
+        default_batch_size = config.get('batch_size', 10)
+        default_timeout = config.get('timeout', 300)
+        estimate = self.estimate(api_name)
+        if not estimate or not estimate.get("seconds_per_file"):
+            return default_batch_size, default_timeout
+
+        seconds_per_file = estimate["seconds_per_file"]
+        target = config.get('target_batch_seconds', DEFAULT_TARGET_BATCH_SECONDS)
+        min_batch_size = config.get('min_batch_size', DEFAULT_MIN_BATCH_SIZE)
+        max_batch_size = config.get('max_batch_size', DEFAULT_MAX_BATCH_SIZE)
+
+        batch_size = int(target // seconds_per_file)
+        batch_size = max(min_batch_size, min(max_batch_size, batch_size))
+        timeout = math.ceil(batch_size * seconds_per_file * TIMEOUT_SAFETY_FACTOR)
+        timeout = max(MIN_TIMEOUT, min(MAX_TIMEOUT, timeout))
+        return batch_size, timeout
+
+    def pack_by_duration(self, api_name: str, rows: List[Dict], duration_key: str, timeout: int) -> List[List[Dict]]:
+        """
+        音声の長さで推定処理時間を積み上げ、タイムアウトに収まるバッチに分割する
+        （推定値がない場合は分割しない）
+        """
+        estimate = self.estimate(api_name) or {}
+        seconds_per_audio_second = estimate.get("seconds_per_audio_second")
+        seconds_per_file = estimate.get("seconds_per_file")
+        if not seconds_per_audio_second:
+            return [rows]
+
+        budget = timeout / TIMEOUT_SAFETY_FACTOR
+        batches, current, current_cost = [], [], 0.0
+        for row in rows:
+            duration = row.get(duration_key)
+            cost = duration * seconds_per_audio_second if duration else (seconds_per_file or 0)
+            if current and current_cost + cost > budget:
+                batches.append(current)
+                current, current_cost = [], 0.0
+            current.append(row)
+            current_cost += cost
+        if current:
+            batches.append(current)
+        return batches
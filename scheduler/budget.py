@@ -0,0 +1,144 @@
+"""
+ChatGPT利用ステージ（vibe-scorer, timeblock-analysis, dashboard-summary-analysis）の予算管理
+api-gpt-v1へ送るリクエスト数と推定プロンプトトークン数を1時間・1日単位で集計し、
+予算内のアイテムだけを実行許可する。残りは次の枠へ繰り越す（pendingのまま残る）
+
+- 使用量はJSONファイルに保存し、ファイルロックで同時実行中の複数プロセス間でも共有する
+- 実行許可は新しいタイムブロックを優先する
+- 実行許可したが送信しなかったアイテム（プロンプトなし・接続エラーなど）の使用量は refund で戻す
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import GPT_BUDGET_LIMITS
+from state_file import locked_json_state
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+# 使用量の保存先（scheduler-configボリューム）
+BUDGET_STATE_FILE = os.environ.get('GPT_BUDGET_STATE_FILE', '/app/config/gpt-budget-state.json')
+
+
+def estimate_tokens(total_chars: Optional[int], ascii_chars: Optional[int] = None) -> int:
+    """
+    プロンプトの文字数からトークン数を概算（一覧では本文を取得しないため、文字数だけで推定する）
+    ASCII文字は約4文字で1トークン、日本語などの非ASCII文字は1文字1トークンとして数える
+    ascii_charsが不明な場合は全て非ASCII文字とみなす（上限側）
+    """
+    if not total_chars:
+        return 0
+    ascii_chars = min(ascii_chars or 0, total_chars)
+    return ascii_chars // 4 + (total_chars - ascii_chars) + 1
+
+
+class BudgetGovernor:
+    """1時間・1日単位の予算に基づく実行許可"""
+
+    def __init__(self, limits: Dict = None, state_file: str = BUDGET_STATE_FILE):
+        self.limits = limits or GPT_BUDGET_LIMITS
+        self.state_file = state_file
+
+    @staticmethod
+    def _window_keys(now: datetime) -> Dict[str, str]:
+        return {
+            "hour": now.strftime("%Y-%m-%dT%H"),
+            "day": now.strftime("%Y-%m-%d")
+        }
+
+    def _reset_windows(self, state: Dict, now: datetime) -> Dict:
+        """枠が切り替わっていれば使用量をリセット"""
+        for window, key in self._window_keys(now).items():
+            if state.get(window, {}).get("key") != key:
+                state[window] = {"key": key, "requests": 0, "tokens": 0, "by_api": {}}
+        return state
+
+    def _fits(self, state: Dict, tokens: int) -> bool:
+        hour, day = state["hour"], state["day"]
+        return (
+            hour["requests"] + 1 <= self.limits['hourly_requests']
+            and day["requests"] + 1 <= self.limits['daily_requests']
+            and hour["tokens"] + tokens <= self.limits['hourly_tokens']
+            and day["tokens"] + tokens <= self.limits['daily_tokens']
+        )
+
+    def admit(
+        self,
+        api_name: str,
+        items: List[Any],
+        estimate: Callable[[Any], int],
+        freshness_key: Optional[Callable[[Any], Any]] = None,
+        api_logger=None
+    ) -> Tuple[List[Any], List[Any]]:
+        """
+        予算内のアイテムを実行許可し、使用量として計上する
+        freshness_keyが指定されている場合は値の大きい（新しい）アイテムから許可する
+        戻り値: (許可されたアイテム, 次の枠へ繰り越すアイテム)
+        """
+        log = api_logger or logger
+        candidates = sorted(items, key=freshness_key, reverse=True) if freshness_key else list(items)
+        admitted, deferred = [], []
+        now = datetime.now(JST)
+
+        with locked_json_state(self.state_file) as state:
+            self._reset_windows(state, now)
+            for item in candidates:
+                tokens = estimate(item)
+                if deferred or not self._fits(state, tokens):
+                    # 一度予算を超えたら以降は全て繰り越す（優先順位を崩さない）
+                    deferred.append(item)
+                    continue
+                admitted.append(item)
+                for window in ("hour", "day"):
+                    usage = state[window]
+                    usage["requests"] += 1
+                    usage["tokens"] += tokens
+                    api_usage = usage["by_api"].setdefault(api_name, {"requests": 0, "tokens": 0})
+                    api_usage["requests"] += 1
+                    api_usage["tokens"] += tokens
+
+        log.info(
+            f"{api_name}: 予算チェック - 許可 {len(admitted)}件, 繰り越し {len(deferred)}件 "
+            f"(1時間: {state['hour']['requests']}/{self.limits['hourly_requests']}件, "
+            f"{state['hour']['tokens']}/{self.limits['hourly_tokens']}トークン / "
+            f"1日: {state['day']['requests']}/{self.limits['daily_requests']}件, "
+            f"{state['day']['tokens']}/{self.limits['daily_tokens']}トークン)"
+        )
+        return admitted, deferred
+
+    def refund(self, api_name: str, requests: int, tokens: int, admitted_at: datetime, api_logger=None):
+        """
+        実行許可したが送信しなかったアイテムの使用量を戻す
+        admitted_at: admitを呼んだ時刻（枠が切り替わっている場合、その枠には戻さない）
+        """
+        log = api_logger or logger
+        if requests <= 0:
+            return
+        admitted_keys = self._window_keys(admitted_at)
+
+        with locked_json_state(self.state_file) as state:
+            self._reset_windows(state, datetime.now(JST))
+            for window, key in admitted_keys.items():
+                usage = state[window]
+                if usage["key"] != key:
+                    continue
+                api_usage = usage["by_api"].setdefault(api_name, {"requests": 0, "tokens": 0})
+                for target in (usage, api_usage):
+                    target["requests"] = max(0, target["requests"] - requests)
+                    target["tokens"] = max(0, target["tokens"] - tokens)
+
+        log.info(f"{api_name}: 送信しなかった{requests}件の予算（{tokens}トークン）を戻しました")
+
+    def usage(self) -> Dict:
+        """現在の枠の使用量と上限"""
+        with locked_json_state(self.state_file) as state:
+            self._reset_windows(state, datetime.now(JST))
+        return {
+            "limits": self.limits,
+            "hour": state["hour"],
+            "day": state["day"]
+        }
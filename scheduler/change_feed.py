@@ -0,0 +1,181 @@
+"""
+変更フィード（Postgres LISTEN/NOTIFY）による即時起動
+sql/scheduler_change_feed.sql のトリガーが audio_files / vibe_whisper / behavior_yamnet /
+emotion_opensmile / dashboard の行が pending になったときに scheduler_changes チャネルへ通知する。
+常駐スケジューラーエンジンはこの通知を購読し、該当ステージを数秒以内に起動する
+（スケジューラー自身が processing から pending に戻したファイルは通知されず、定期実行で再取得する）
+
+- 接続先は CHANGE_FEED_DATABASE_URL（Supabaseの直接接続文字列、またはローカルのPostgres）
+- psycopg2 が未インストール・接続先が未設定の場合は無効（時刻表による定期実行のみ）
+- 通知はDEBOUNCE_SECONDSだけまとめてから起動する（一括アップロード時に1件ずつ起動しない）
+- 切断時は再接続するまで時刻表による定期実行に戻る
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+except ImportError:  # psycopg2がない環境では変更フィードを使わない
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FEED_DATABASE_URL = os.environ.get('CHANGE_FEED_DATABASE_URL', '')
+CHANNEL = 'scheduler_changes'
+DEBOUNCE_SECONDS = 2
+RECONNECT_MIN_DELAY = 5
+RECONNECT_MAX_DELAY = 60
+
+# (device_id, date, time_block)
+StageKey = Tuple[str, str, str]
+
+
+def route_change(payload: Dict, api_configs: Dict) -> List[Tuple[str, Optional[StageKey]]]:
+    """
+    通知内容から起動するステージを決める
+    戻り値: [(API名, 対象キー)] 対象キーがNoneの場合は未処理データを検出する通常実行
+    """
+    table = payload.get('table')
+    key = None
+    if payload.get('device_id') and payload.get('date') and payload.get('time_block'):
+        key = (payload['device_id'], payload['date'], payload['time_block'])
+
+    routes = []
+    for api_name, config in api_configs.items():
+        api_type = config.get('type', 'file_based')
+        if table == 'audio_files' and api_type == 'file_based':
+            if config.get('status_column') in payload.get('pending_columns', []):
+                routes.append((api_name, None))
+        elif api_type == 'timeblock_based' and table in config.get('status_tables', []):
+            routes.append((api_name, key))
+        elif api_type == 'dashboard_based' and table == config.get('status_table'):
+            routes.append((api_name, key))
+    return routes
+
+
+def covered_stages(api_configs: Dict) -> Set[str]:
+    """変更フィードで起動できるステージ"""
+    return {
+        api_name for api_name, config in api_configs.items()
+        if config.get('status_column') or config.get('status_tables') or config.get('status_table')
+    }
+
+
+class ChangeFeedListener:
+    """LISTEN/NOTIFYの購読スレッド"""
+
+    def __init__(
+        self,
+        on_change: Callable[[Dict[str, Optional[Set[StageKey]]]], None],
+        api_configs: Callable[[], Dict],
+        dsn: str = CHANGE_FEED_DATABASE_URL,
+        channel: str = CHANNEL
+    ):
+        self._on_change = on_change
+        self._api_configs = api_configs
+        self._dsn = dsn
+        self._channel = channel
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._connected = False
+        self._notifications = 0
+        self._last_event_at = None
+
+    @staticmethod
+    def is_available(dsn: str = CHANGE_FEED_DATABASE_URL) -> bool:
+        return psycopg2 is not None and bool(dsn)
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def snapshot(self) -> Dict:
+        return {
+            "available": self.is_available(self._dsn),
+            "connected": self._connected,
+            "channel": self._channel,
+            "notifications": self._notifications,
+            "lastEventAt": self._last_event_at
+        }
+
+    def start(self):
+        if not self.is_available(self._dsn):
+            logger.info("変更フィードは無効です（psycopg2未インストール、またはCHANGE_FEED_DATABASE_URL未設定）")
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="scheduler-change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                delay = RECONNECT_MIN_DELAY
+            except Exception as e:
+                logger.warning(f"変更フィードの接続エラー（{delay}秒後に再接続、それまでは定期実行のみ）: {e}")
+            finally:
+                self._connected = False
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _listen(self):
+        conn = psycopg2.connect(self._dsn)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {self._channel};")
+            self._connected = True
+            logger.info(f"変更フィードの購読を開始しました (channel: {self._channel})")
+
+            pending: Dict[str, Optional[Set[StageKey]]] = {}
+            first_event_at = None
+            while not self._stop_event.is_set():
+                if select.select([conn], [], [], 1.0)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._collect(notify.payload, pending)
+                        first_event_at = first_event_at or time.monotonic()
+                if pending and time.monotonic() - first_event_at >= DEBOUNCE_SECONDS:
+                    events, pending, first_event_at = pending, {}, None
+                    self._dispatch(events)
+        finally:
+            conn.close()
+
+    def _collect(self, raw_payload: str, pending: Dict[str, Optional[Set[StageKey]]]):
+        """通知をステージごとにまとめる（キーなしの通常実行が含まれる場合は通常実行にまとめる）"""
+        self._notifications += 1
+        self._last_event_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        try:
+            payload = json.loads(raw_payload)
+        except ValueError:
+            logger.warning(f"変更フィードの通知を解釈できません: {raw_payload}")
+            return
+        for api_name, key in route_change(payload, self._api_configs()):
+            if key is None or (api_name in pending and pending[api_name] is None):
+                pending[api_name] = None
+            else:
+                pending.setdefault(api_name, set()).add(key)
+
+    def _dispatch(self, events: Dict[str, Optional[Set[StageKey]]]):
+        summary = ", ".join(f"{api_name}({len(keys) if keys else '全件'})" for api_name, keys in events.items())
+        logger.info(f"変更フィード: {summary}")
+        try:
+            self._on_change(events)
+        except Exception as e:
+            logger.error(f"変更フィードによる起動エラー: {e}")
@@ -0,0 +1,141 @@
+"""
+エンドポイント別のサーキットブレーカー
+コンテナが停止している間は、未処理データの取得（processingへの変更）や全デバイスへの呼び出しを行わない
+
+- closed: 通常状態。接続エラー・5xxが FAILURE_THRESHOLD 回連続すると open
+- open: リクエストを送らずに失敗させる。COOLDOWN_SECONDS 経過後に half-open
+- half-open: 1件だけ試行し、成功すれば closed、失敗すれば再び open
+- 同じコンテナ（ホスト:ポート）を使うAPIは1つのブレーカーを共有する
+  （例: vibe-scorer / timeblock-analysis / dashboard-summary-analysis は api-gpt-v1 を共有）
+- 現在の状態はスケジューラーAPI（/api/scheduler/breakers）で参照できる
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict
+
+# 連続失敗で open にする回数
+FAILURE_THRESHOLD = 5
+# open から half-open に移るまでの秒数
+COOLDOWN_SECONDS = 60
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """ブレーカーが open のためリクエストを送らなかった"""
+
+
+class CircuitBreaker:
+    """1エンドポイント分のサーキットブレーカー"""
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, cooldown: float = COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_failure_reason = None
+        self.last_state_change = None
+        self.observed = False  # このプロセスで結果を1件でも記録したか（未記録ならヘルスチェックで確認する）
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        if self.state != state:
+            self.state = state
+            self.last_state_change = datetime.now().isoformat()
+
+    def _refresh(self):
+        """open のままクールダウンが経過していれば half-open に移す"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self._set_state(HALF_OPEN)
+            self._probe_in_flight = False
+
+    def current_state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self.state
+
+    def allow_request(self) -> bool:
+        """リクエストを送ってよいか（half-open中は1件だけ許可）"""
+        with self._lock:
+            self._refresh()
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.observed = True
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            self._set_state(CLOSED)
+
+    def record_failure(self, reason: str):
+        with self._lock:
+            self.observed = True
+            self.consecutive_failures += 1
+            self.last_failure_reason = f"{datetime.now().isoformat()} {reason}"
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self._open()
+
+    def record_neutral(self):
+        """成否が判断できない結果（読み込みタイムアウト等）。half-openの試行枠だけ解放する"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def trip(self, reason: str):
+        """ヘルスチェック失敗などで即座に open にする"""
+        with self._lock:
+            self.observed = True
+            self.last_failure_reason = f"{datetime.now().isoformat()} {reason}"
+            self._probe_in_flight = False
+            self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._set_state(OPEN)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            self._refresh()
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(0, round(self.cooldown - (time.monotonic() - self.opened_at), 1))
+            return {
+                "state": self.state,
+                "consecutiveFailures": self.consecutive_failures,
+                "failureThreshold": self.failure_threshold,
+                "cooldownSeconds": self.cooldown,
+                "retryInSeconds": retry_in,
+                "lastFailureReason": self.last_failure_reason,
+                "lastStateChange": self.last_state_change
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """エンドポイント（ホスト:ポート）ごとのブレーカーを取得（プロセス内で共有）"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def get_breakers_snapshot() -> Dict[str, Dict]:
+    """全エンドポイントのブレーカーの状態"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
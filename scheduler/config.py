@@ -23,4 +23,52 @@ API_ENDPOINTS = {
     'behavior-aggregator': '/analysis/sed',
     'emotion-features': '/process/emotion-features',
     'emotion-aggregator': '/analyze/batch',
-}
\ No newline at end of file
+}
+
+# 常駐スケジューラーエンジンの時刻表（watchme-scheduler-cronの旧スケジュールと同じ）
+# minute: 毎時の実行分、interval: 実行間隔（時間）、enabled: デフォルトの有効/無効
+# config.jsonにAPIごとの設定（enabled/interval）がある場合はそちらが優先される
+# 時刻はJSTで判定する（旧cronはホストのタイムゾーン=UTC）。JSTは整数時間のずれのため minute は旧cronと同じ。
+# interval は JST の時（hour % interval == 0）で判定するため、3時間ごと（旧vibe-scorerの */3）はUTCと同じ時刻になるが、
+# 2時間ごとなど9で割り切れない間隔はUTC基準の旧cronから1時間ずれる
+SCHEDULE_DEFAULTS = {
+    # 毎時10分 - ファイルベース処理（第1グループ）
+    'azure-transcriber': {'minute': 10, 'interval': 1, 'enabled': True},
+    'behavior-features': {'minute': 10, 'interval': 1, 'enabled': True},
+    # 毎時20分 - デバイスベース処理と追加のファイルベース処理（第2グループ）
+    'vibe-aggregator': {'minute': 20, 'interval': 1, 'enabled': True},
+    'behavior-aggregator': {'minute': 20, 'interval': 1, 'enabled': True},
+    'emotion-features': {'minute': 20, 'interval': 1, 'enabled': True},
+    # 毎時30分 - デバイスベース処理（第3グループ）
+    'emotion-aggregator': {'minute': 30, 'interval': 1, 'enabled': True},
+    # 毎時30分 - ChatGPTの利用量はGPT_BUDGET_LIMITSで制御（旧: コスト削減のため3時間ごと）
+    'vibe-scorer': {'minute': 30, 'interval': 1, 'enabled': True},
+    # 毎時40分 - タイムブロック単位プロンプト生成
+    'timeblock-prompt': {'minute': 40, 'interval': 1, 'enabled': True},
+    # 毎時50分 - タイムブロック単位ChatGPT分析
+    'timeblock-analysis': {'minute': 50, 'interval': 1, 'enabled': True},
+    # 2025-09-24: イベント駆動型へ移行のため停止（config.jsonで有効化可能）
+    'dashboard-summary': {'minute': 50, 'interval': 1, 'enabled': False},
+    'dashboard-summary-analysis': {'minute': 0, 'interval': 1, 'enabled': False},
+}
+
+# 変更フィード（LISTEN/NOTIFY）の購読中は、対象ステージの定期実行を取りこぼし回収用としてこの間隔（時間）に落とす
+CHANGE_FEED_SAFETY_NET_INTERVAL = 6
+
+# パイプラインの依存関係（下流ステージ: 上流ステージのリスト）
+# 上流ステージが (device_id, date, time_block) の処理を終えると、常駐エンジンがその場で下流ステージを実行する
+# 上流が複数のファイルベースステージの場合は、全ステージの処理が終わった時点で実行する
+# 時刻表による定期実行は、取りこぼしの回収用としてそのまま残す
+PIPELINE_DEPENDENCIES = {
+    'timeblock-prompt': ['azure-transcriber', 'behavior-features', 'emotion-features'],
+    'timeblock-analysis': ['timeblock-prompt'],
+}
+
+# ChatGPT（api-gpt-v1）利用ステージの予算上限
+# 推定プロンプトトークン数とリクエスト数を1時間・1日単位で管理し、超過分は次の枠へ繰り越す
+GPT_BUDGET_LIMITS = {
+    'hourly_requests': 300,
+    'daily_requests': 3000,
+    'hourly_tokens': 600_000,
+    'daily_tokens': 6_000_000,
+}
@@ -0,0 +1,98 @@
+"""
+非同期ディスパッチエンジン
+device_based / timeblock_based / dashboard_based の各処理で共通利用する並列実行コア
+
+- プロセス全体で1つのイベントループをバックグラウンドスレッドで動かし、
+  CLI実行・常駐スケジューラーエンジンのどちらからも同じループへコルーチンを投入する
+- APIごとの並列数上限（セマフォ）と、同一キー（device_id等）内の逐次実行を保証する
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# APIごとに concurrency が設定されていない場合の並列数
+DEFAULT_CONCURRENCY = 4
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """プロセス共通のイベントループを取得（初回のみバックグラウンドスレッドで起動）"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="dispatch-loop", daemon=True)
+            thread.start()
+        return _loop
+
+
+def run_coroutine(coro: Awaitable) -> Any:
+    """コルーチンを共通イベントループで実行し、完了まで待って結果を返す"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+class DispatchResult:
+    """ディスパッチ結果の集計（log_executionに渡す成功・失敗件数）"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.success_count = 0
+        self.failed_count = 0
+
+    def record(self, success: bool):
+        if success:
+            self.success_count += 1
+        else:
+            self.failed_count += 1
+
+    @property
+    def status(self) -> str:
+        """log_executionと同じステータス表記（SUCCESS / PARTIAL / ERROR）"""
+        if self.failed_count == 0:
+            return "SUCCESS"
+        if self.success_count > 0:
+            return "PARTIAL"
+        return "ERROR"
+
+
+async def dispatch(
+    items: List[Any],
+    handler: Callable[[int, Any], Awaitable[bool]],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    order_key: Optional[Callable[[Any], Hashable]] = None,
+    api_logger=None
+) -> DispatchResult:
+    """
+    アイテムを並列数上限付きで処理する
+
+    handler: async def handler(idx, item) -> bool （idxは1始まりの通し番号）
+    order_key: 同じキーを返すアイテムは投入順に逐次処理する（Noneの場合は全て独立）
+    """
+    log = api_logger or logger
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    result = DispatchResult(len(items))
+
+    # キーごとにグループ化（dictは挿入順を保持するため投入順が維持される）
+    groups = {}
+    for idx, item in enumerate(items, 1):
+        key = order_key(item) if order_key else idx
+        groups.setdefault(key, []).append((idx, item))
+
+    async def run_group(group):
+        for idx, item in group:
+            async with semaphore:
+                try:
+                    success = await handler(idx, item)
+                except Exception as e:
+                    log.error(f"ディスパッチ処理エラー ({idx}/{len(items)}): {e}")
+                    success = False
+            result.record(success)
+
+    await asyncio.gather(*(run_group(group) for group in groups.values()))
+    return result
@@ -0,0 +1,109 @@
+"""
+スケジューラー共通のHTTPコネクションプール
+下流API（モデルコンテナ）への呼び出しはすべてプロセス共通の httpx.AsyncClient を使い、
+keep-aliveでコネクションを再利用する
+
+- 接続数の上限・keep-alive・接続/読み込みで別々のタイムアウトを設定
+- httpcoreのtrace拡張で新規接続数を数え、コネクション再利用の統計を出す
+"""
+
+import atexit
+import logging
+import threading
+from typing import Dict
+
+import httpx
+
+from dispatch import get_event_loop, run_coroutine
+
+logger = logging.getLogger(__name__)
+
+# コネクションプール設定
+MAX_CONNECTIONS = 50
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 60  # 秒
+# 接続タイムアウト（読み込みタイムアウトはAPIごとのtimeout設定を使用）
+CONNECT_TIMEOUT = 5
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class ConnectionStats:
+    """リクエスト数と新規接続数からコネクション再利用率を集計"""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+
+    async def trace(self, event_name: str, info: Dict):
+        """httpcoreのtraceコールバック（新規TCP接続の確立時のみ呼ばれるイベントを数える）"""
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+
+    def snapshot(self) -> Dict:
+        reused = max(0, self.requests - self.new_connections)
+        return {
+            "requests": self.requests,
+            "newConnections": self.new_connections,
+            "reusedConnections": reused,
+            "reuseRate": round(reused / self.requests, 3) if self.requests else None
+        }
+
+
+connection_stats = ConnectionStats()
+
+
+def http_timeout(read_timeout: float) -> httpx.Timeout:
+    """接続と読み込みで別々のタイムアウトを設定"""
+    return httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """プロセス共通のHTTPクライアントを取得（初回のみ作成）"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY
+                ),
+                timeout=http_timeout(300)
+            )
+        return _client
+
+
+def request_extensions() -> Dict:
+    """リクエストごとに付与するhttpx拡張（接続統計用のtrace）"""
+    connection_stats.requests += 1
+    return {"trace": connection_stats.trace}
+
+
+def log_connection_stats(before: Dict, log=None):
+    """実行開始時のスナップショットとの差分でコネクション再利用統計をログ出力"""
+    log = log or logger
+    after = connection_stats.snapshot()
+    requests_made = after["requests"] - before["requests"]
+    new_connections = after["newConnections"] - before["newConnections"]
+    if requests_made <= 0:
+        return
+    reused = max(0, requests_made - new_connections)
+    log.info(f"HTTP接続統計: リクエスト {requests_made}件, 新規接続 {new_connections}件, "
+             f"再利用 {reused}件 (再利用率 {reused / requests_made:.0%})")
+
+
+def close_http_client():
+    """プロセス終了時にコネクションを閉じる"""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None and get_event_loop().is_running():
+        try:
+            run_coroutine(client.aclose())
+        except Exception as e:
+            logger.warning(f"HTTPクライアントのクローズエラー: {e}")
+
+
+atexit.register(close_http_client)
@@ -0,0 +1,186 @@
+"""
+下流APIへのディスパッチジョブの完了追跡
+ランナーはリクエストごとにjob_idとcallback_urlを送り、処理の完了を待たずに次へ進む。
+完了結果はスケジューラーAPIへのコールバック、または下流APIのstatus_urlのポーリングで記録する
+
+- ジョブはSQLiteに保存し、ランナー（CLI・常駐エンジン）とAPIサーバーで共有する
+- 完了通知はジョブごとのトークンで認証する（保存するのはハッシュのみ。一覧・取得の結果には含めない）
+- ステータス: dispatched（完了待ち） / completed / failed / expired（期限内に完了通知なし）
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+JST = timezone(timedelta(hours=9))
+
+# ジョブの保存先（scheduler-configボリューム）
+JOB_STORE_FILE = os.environ.get('JOB_STORE_FILE', '/app/config/scheduler-jobs.db')
+
+FINAL_STATUSES = ('completed', 'failed', 'expired')
+
+_SCHEMA = """
+create table if not exists jobs (
+    job_id text primary key,
+    api_name text not null,
+    kind text not null,
+    payload text not null,
+    status text not null,
+    status_url text,
+    dispatched_at text not null,
+    deadline_at text not null,
+    completed_at text,
+    message text,
+    result text,
+    token_hash text
+);
+create index if not exists jobs_api_status_idx on jobs (api_name, status, dispatched_at);
+"""
+
+
+def _now() -> datetime:
+    return datetime.now(JST)
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict:
+    job = dict(row)
+    job.pop("token_hash", None)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+class JobStore:
+    """ディスパッチジョブの保存・完了記録"""
+
+    def __init__(self, path: str = JOB_STORE_FILE):
+        self.path = path
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        # スレッド・プロセスごとに接続を作る（WALで読み書きの同時実行に対応）
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("pragma journal_mode=wal")
+            if not self._initialized:
+                conn.executescript(_SCHEMA)
+                # トークン導入前に作成したファイルにはカラムを追加する
+                columns = {column["name"] for column in conn.execute("pragma table_info(jobs)")}
+                if "token_hash" not in columns:
+                    conn.execute("alter table jobs add column token_hash text")
+                self._initialized = True
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def create(self, api_name: str, kind: str, payload: Dict, deadline_seconds: int, token: str = None) -> str:
+        """ジョブを登録してjob_idを返す（token: 完了通知の認証に使うトークン）"""
+        job_id = uuid.uuid4().hex
+        now = _now()
+        with self._connect() as conn:
+            conn.execute(
+                "insert into jobs (job_id, api_name, kind, payload, status, dispatched_at, deadline_at, token_hash) "
+                "values (?, ?, ?, ?, 'dispatched', ?, ?, ?)",
+                (job_id, api_name, kind, json.dumps(payload, ensure_ascii=False),
+                 now.isoformat(), (now + timedelta(seconds=deadline_seconds)).isoformat(),
+                 _hash_token(token) if token else None)
+            )
+        return job_id
+
+    def verify_token(self, job_id: str, token: Optional[str]) -> bool:
+        """完了通知のトークンがジョブ登録時のトークンと一致するか（トークンのないジョブは常にFalse）"""
+        if not token:
+            return False
+        with self._connect() as conn:
+            row = conn.execute("select token_hash from jobs where job_id = ?", (job_id,)).fetchone()
+        if row is None or not row["token_hash"]:
+            return False
+        return hmac.compare_digest(row["token_hash"], _hash_token(token))
+
+    def set_status_url(self, job_id: str, status_url: str):
+        """下流APIが返したステータス確認URLを記録（ポーリング用）"""
+        with self._connect() as conn:
+            conn.execute("update jobs set status_url = ? where job_id = ?", (status_url, job_id))
+
+    def complete(self, job_id: str, status: str, message: str = None, result: Dict = None) -> Optional[Dict]:
+        """
+        完了結果を記録する
+        完了待ち（dispatched）のジョブのみ更新し、更新したジョブを返す（未登録・記録済みの場合はNone）
+        """
+        if status not in FINAL_STATUSES:
+            raise ValueError(f"未対応のステータス: {status}")
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "update jobs set status = ?, completed_at = ?, message = ?, result = ? "
+                "where job_id = ? and status = 'dispatched'",
+                (status, _now().isoformat(), message,
+                 json.dumps(result, ensure_ascii=False) if result is not None else None, job_id)
+            )
+            if cursor.rowcount == 0:
+                return None
+            row = conn.execute("select * from jobs where job_id = ?", (job_id,)).fetchone()
+        return _row_to_job(row)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("select * from jobs where job_id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def list(self, api_name: str = None, status: str = None, limit: int = 100) -> List[Dict]:
+        """ジョブ一覧（新しい順）"""
+        conditions, params = [], []
+        if api_name:
+            conditions.append("api_name = ?")
+            params.append(api_name)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        where = f"where {' and '.join(conditions)}" if conditions else ""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"select * from jobs {where} order by dispatched_at desc limit ?", (*params, limit)
+            ).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    def count_outstanding(self, api_name: str) -> int:
+        """完了待ち（dispatched）のジョブ数"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "select count(*) as jobs from jobs where api_name = ? and status = 'dispatched'", (api_name,)
+            ).fetchone()
+        return row["jobs"]
+
+    def pollable(self, api_name: str) -> List[Dict]:
+        """ステータス確認URLがあり完了待ちのジョブ"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "select * from jobs where api_name = ? and status = 'dispatched' and status_url is not null",
+                (api_name,)
+            ).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    def expire_overdue(self, api_name: str = None) -> int:
+        """期限を過ぎても完了通知のないジョブをexpiredにする"""
+        now = _now().isoformat()
+        query = "update jobs set status = 'expired', completed_at = ? where status = 'dispatched' and deadline_at < ?"
+        params = [now, now]
+        if api_name:
+            query += " and api_name = ?"
+            params.append(api_name)
+        with self._connect() as conn:
+            return conn.execute(query, params).rowcount
@@ -0,0 +1,167 @@
+"""
+スケジューラーログのローテーション（サイズ・経過時間）とgzip圧縮による保管
+/var/log/scheduler/scheduler-{api}.log は常駐エンジン・CLI実行など複数のプロセス・スレッドから追記されるため、
+ロックファイル（fcntl）で書き込みとローテーションを排他する
+
+- 現在のファイルが MAX_BYTES を超えるか、MAX_AGE_SECONDS を経過したら
+  scheduler-{api}.log.YYYYmmdd-HHMMSS-ffffff にリネームしてgzip圧縮する（.gz）
+- 保管するのは BACKUP_COUNT 個まで、RETENTION_DAYS 日以内（超えたものは削除）
+- 他のプロセスがローテーションした場合は、次の書き込み時に新しいファイルを開き直す
+- ホストのcronのリダイレクト（>>）で追記される cron.log はここでは扱わない
+  （ホスト側の logrotate で copytruncate する。設定例は AZURE_MIGRATION_GUIDE.md）
+- 読み込み側（ログ参照API）は iter_segments で現在のファイルと保管済みのファイルを新しい順に参照できる
+"""
+
+import fcntl
+import glob
+import gzip
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List
+
+MAX_BYTES = 20 * 1024 * 1024
+MAX_AGE_SECONDS = 24 * 3600
+BACKUP_COUNT = 14
+RETENTION_DAYS = 30
+
+ARCHIVE_TIME_FORMAT = "%Y%m%d-%H%M%S-%f"
+
+
+def lock_path(path: str) -> str:
+    """ログファイルごとのロックファイル（内容は現在のファイルの開始時刻）"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.lock")
+
+
+@contextmanager
+def locked(path: str):
+    """ログファイルの排他ロック（ロックファイルのファイルオブジェクトを返す）"""
+    with open(lock_path(path), 'a+') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield lock_file
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_segment_start(lock_file) -> float:
+    """現在のファイルの開始時刻（未記録の場合は現在時刻を記録して返す）"""
+    lock_file.seek(0)
+    try:
+        return float(lock_file.read().strip())
+    except ValueError:
+        return write_segment_start(lock_file, time.time())
+
+
+def write_segment_start(lock_file, started: float) -> float:
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(started))
+    lock_file.flush()
+    return started
+
+
+def archive_paths(path: str) -> List[str]:
+    """保管済みのファイル（新しい順）"""
+    return sorted(glob.glob(f"{glob.escape(path)}.*.gz"), reverse=True)
+
+
+def iter_segments(path: str) -> List[str]:
+    """現在のファイルと保管済みのファイル（新しい順）"""
+    return ([path] if os.path.exists(path) else []) + archive_paths(path)
+
+
+def compress(source: str):
+    """ファイルをgzip圧縮して元のファイルを削除"""
+    with open(source, 'rb') as src, gzip.open(f"{source}.gz", 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def prune(path: str, backup_count: int = BACKUP_COUNT, retention_days: int = RETENTION_DAYS):
+    """保管数・保管期間を超えたファイルを削除"""
+    cutoff = time.time() - retention_days * 86400
+    for idx, archive in enumerate(archive_paths(path)):
+        try:
+            if idx >= backup_count or os.path.getmtime(archive) < cutoff:
+                os.remove(archive)
+        except FileNotFoundError:
+            pass
+
+
+def rotated_name(path: str) -> str:
+    """保管ファイル名（時刻の固定長表記のため、名前の順序が新旧の順序と一致する）"""
+    while True:
+        name = f"{path}.{datetime.now().strftime(ARCHIVE_TIME_FORMAT)}"
+        if not os.path.exists(name) and not os.path.exists(f"{name}.gz"):
+            return name
+
+
+def needs_rotation(size: int, segment_start: float, max_bytes: int, max_age: float) -> bool:
+    return size > 0 and (size >= max_bytes or time.time() - segment_start >= max_age)
+
+
+class RotatingLogHandler(logging.Handler):
+    """
+    サイズ・経過時間でローテーションするファイルハンドラー（複数プロセスから同じファイルへ追記してよい）
+    書き込みはロック中に O_APPEND で行うため、行が混ざったりローテーション中のファイルに書き込まれたりしない
+    """
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES, max_age: float = MAX_AGE_SECONDS,
+                 backup_count: int = BACKUP_COUNT, retention_days: int = RETENTION_DAYS):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backup_count = backup_count
+        self.retention_days = retention_days
+        self._fd = None
+        self._inode = None
+        self._segment_start = None
+
+    def _open(self, lock_file):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+        self._segment_start = read_segment_start(lock_file)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            data = (self.format(record) + "\n").encode('utf-8')
+            rotated = None
+            with locked(self.path) as lock_file:
+                try:
+                    current = os.stat(self.path)
+                except FileNotFoundError:
+                    current = None
+                if self._fd is None or current is None or current.st_ino != self._inode:
+                    # 他のプロセスがローテーションした（または初回）
+                    self._open(lock_file)
+                    current = os.fstat(self._fd)
+                if needs_rotation(current.st_size, self._segment_start, self.max_bytes, self.max_age):
+                    rotated = rotated_name(self.path)
+                    os.rename(self.path, rotated)
+                    write_segment_start(lock_file, time.time())
+                    self._open(lock_file)
+                os.write(self._fd, data)
+            if rotated:
+                # 圧縮はロックの外で行う（リネーム後のファイルには誰も書き込まない）
+                compress(rotated)
+                prune(self.path, self.backup_count, self.retention_days)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self.release()
+            super().close()
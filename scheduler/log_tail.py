@@ -0,0 +1,223 @@
+"""
+ログの末尾からの読み込み（ページング・フィルタ・実行単位の移動）
+スケジューラーAPIのログ参照（/api/scheduler/logs/{api_name}）から使用する
+
+- ファイルの末尾（またはカーソルの位置）からブロック単位で逆向きに読むため、ファイル全体は読み込まない
+- カーソルはバイトオフセット（返した中で最も古い行の先頭）。次のページは before にカーソルを渡す
+- 1回のリクエストで走査するのは SCAN_BYTE_BUDGET まで（フィルタで一致が少ない場合もレイテンシは一定）
+- 現在のファイルの先頭まで読んだら、次に古い保管ファイル（log_rotation.py のgzip）をカーソルで案内する
+  （保管ファイルは1つあたり log_rotation.MAX_BYTES 以下のため、展開して同じ方法で読む）
+- run=True の場合は、カーソルより前で最も新しい実行（=== ... 自動処理開始 ===）の開始行から返す
+  実行が lines 行より長い場合は、続きの行を after に渡す前向きのカーソル（next）を返す
+"""
+
+import gzip
+import io
+import os
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from log_rotation import archive_paths
+
+# 逆向きに読むブロックサイズ
+CHUNK_SIZE = 64 * 1024
+# 1回のリクエストで走査する最大バイト数
+SCAN_BYTE_BUDGET = 16 * 1024 * 1024
+# 1回のリクエストで返す最大行数
+MAX_LINES = 2000
+
+LEVELS = ("INFO", "WARNING", "ERROR", "CRITICAL")
+# run-api-process-docker.py の run_api が出力する実行開始行
+RUN_START_PATTERN = re.compile(r"=== .+ 自動処理開始 ===")
+
+
+def iter_lines_backward(f, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """ファイルの end より前の行を新しい順に返す（戻り値: (行の先頭のオフセット, 行の内容)。空行は返さない）"""
+    pos = end
+    tail = b""
+    while pos > 0:
+        size = min(chunk_size, pos)
+        pos -= size
+        f.seek(pos)
+        data = f.read(size) + tail
+        parts = data.split(b"\n")
+        tail = parts[0]
+        line_end = pos + len(data)
+        for part in reversed(parts[1:]):
+            start = line_end - len(part)
+            if part:
+                yield start, part
+            line_end = start - 1
+    if tail:
+        yield 0, tail
+
+
+def iter_lines_forward(f, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """ファイルの start から end までの行を古い順に返す（戻り値: (行の先頭のオフセット, 行の内容)。空行は返さない）"""
+    pos = start
+    head = b""
+    head_start = start
+    while pos < end:
+        size = min(chunk_size, end - pos)
+        f.seek(pos)
+        data = head + f.read(size)
+        pos += size
+        parts = data.split(b"\n")
+        head = parts.pop()
+        line_start = head_start
+        for part in parts:
+            if part:
+                yield line_start, part
+            line_start += len(part) + 1
+        head_start = line_start
+    if head:
+        yield head_start, head
+
+
+def matches(text: str, level: Optional[str], contains: Optional[str]) -> bool:
+    """ログ形式（%(asctime)s - %(levelname)s - %(message)s）のレベルと部分文字列で絞り込む"""
+    if level and f" - {level} - " not in text:
+        return False
+    if contains and contains not in text:
+        return False
+    return True
+
+
+def open_segment(path: str, segment: Optional[str]):
+    """
+    読み込むファイルを開く（segment: 保管ファイル名。Noneの場合は現在のファイル）
+    戻り値: (ファイルオブジェクト, サイズ)
+    """
+    if segment is None:
+        f = open(path, 'rb')
+        f.seek(0, os.SEEK_END)
+        return f, f.tell()
+    archives = {os.path.basename(archive): archive for archive in archive_paths(path)}
+    if segment not in archives:
+        raise FileNotFoundError(segment)
+    with gzip.open(archives[segment], 'rb') as gz:
+        data = gz.read()
+    return io.BytesIO(data), len(data)
+
+
+def older_segment(path: str, segment: Optional[str]) -> Optional[str]:
+    """segmentの次に古い保管ファイル名（ない場合はNone）"""
+    names = [os.path.basename(archive) for archive in archive_paths(path)]
+    if segment is None:
+        return names[0] if names else None
+    if segment in names and names.index(segment) + 1 < len(names):
+        return names[names.index(segment) + 1]
+    return None
+
+
+def run_continuation(path: str, after: int, lines: int = 200, segment: Optional[str] = None,
+                     level: Optional[str] = None, contains: Optional[str] = None) -> Dict:
+    """
+    実行の続き（tail(run=True) が返した next.after の位置から、次の実行の開始行の手前まで）を古い順に返す
+    戻り値: {"segment", "lines": [{"offset", "text"}], "next": 続きの {"segment", "after"} またはNone, "scannedBytes"}
+    """
+    lines = max(1, min(lines, MAX_LINES))
+    f, size = open_segment(path, segment)
+    start = max(0, min(after, size))
+    collected: List[Tuple[int, str]] = []
+    next_after = None
+    scanned_to = start
+    try:
+        for offset, raw in iter_lines_forward(f, start, size):
+            text = raw.decode('utf-8', errors='replace')
+            if RUN_START_PATTERN.search(text):
+                # 次の実行が始まった（この実行はここまで）
+                break
+            if offset - start > SCAN_BYTE_BUDGET or len(collected) >= lines:
+                next_after = offset
+                break
+            scanned_to = offset + len(raw) + 1
+            if matches(text, level, contains):
+                collected.append((offset, text))
+    finally:
+        f.close()
+
+    return {
+        "segment": segment,
+        "lines": [{"offset": offset, "text": text} for offset, text in collected],
+        "next": {"segment": segment, "after": next_after} if next_after is not None else None,
+        "scannedBytes": scanned_to - start
+    }
+
+
+def tail(path: str, lines: int = 200, before: Optional[int] = None, segment: Optional[str] = None,
+         level: Optional[str] = None, contains: Optional[str] = None, run: bool = False) -> Dict:
+    """
+    ログの末尾（またはbeforeより前）の行を返す
+    戻り値: {"segment", "lines": [{"offset", "text"}]（古い順）, "cursor": 次のページ {"segment", "before"} またはNone,
+             "scannedBytes", "runFound" / "next"（run=Trueの場合。next: 実行の続き {"segment", "after"} またはNone）}
+    """
+    lines = max(1, min(lines, MAX_LINES))
+    if not os.path.exists(path) and segment is None:
+        result = {"segment": None, "lines": [], "cursor": None, "scannedBytes": 0}
+        if run:
+            result.update(runFound=False, next=None)
+        return result
+
+    f, size = open_segment(path, segment)
+    end = size if before is None else max(0, min(before, size))
+    collected: List[Tuple[int, str]] = []
+    cursor_before = None
+    run_found = False
+    scanned_from = end
+    try:
+        for offset, raw in iter_lines_backward(f, end):
+            if end - offset > SCAN_BYTE_BUDGET:
+                # 走査の上限に達した。この行から続きを読む
+                cursor_before = offset + len(raw) + 1
+                break
+            scanned_from = offset
+            text = raw.decode('utf-8', errors='replace')
+            if run:
+                collected.append((offset, text))
+                if RUN_START_PATTERN.search(text):
+                    run_found = True
+                    cursor_before = offset
+                    break
+                continue
+            if matches(text, level, contains):
+                collected.append((offset, text))
+                if len(collected) >= lines:
+                    cursor_before = offset
+                    break
+    finally:
+        f.close()
+
+    next_after = None
+    if run:
+        collected.reverse()
+        if run_found:
+            # 実行の開始行から古い順に返す（フィルタは実行内の行に適用）
+            collected = [(offset, text) for offset, text in collected
+                         if RUN_START_PATTERN.search(text) or matches(text, level, contains)]
+            if len(collected) > lines:
+                # 返しきれない残りは next.after から run_continuation で読む
+                next_after = collected[lines][0]
+                collected = collected[:lines]
+        else:
+            collected = [(offset, text) for offset, text in collected if matches(text, level, contains)][-lines:]
+    else:
+        collected.reverse()
+
+    if cursor_before is not None and cursor_before > 0:
+        cursor = {"segment": segment, "before": cursor_before}
+    else:
+        # このファイルの先頭まで読んだ。次は1つ古い保管ファイルの末尾から
+        older = older_segment(path, segment)
+        cursor = {"segment": older, "before": None} if older else None
+
+    result = {
+        "segment": segment,
+        "lines": [{"offset": offset, "text": text} for offset, text in collected],
+        "cursor": cursor,
+        "scannedBytes": end - scanned_from
+    }
+    if run:
+        result["runFound"] = run_found
+        result["next"] = {"segment": segment, "after": next_after} if next_after is not None else None
+    return result
@@ -0,0 +1,143 @@
+"""
+Prometheus形式のメトリクス
+スケジューラーAPIサーバーの /metrics で公開する。実行モジュール（run-api-process-docker.py）が直接記録し、ログは解析しない
+
+- scheduler_runs_total / scheduler_run_duration_seconds: APIごとの実行回数と実行時間
+- scheduler_items_total: 取得（fetched）・送信（dispatched）・成功（succeeded）・失敗（failed）した件数
+- scheduler_downstream_request_seconds: 下流APIへのリクエストのレイテンシ
+- scheduler_supabase_request_seconds: Supabase（PostgREST）へのリクエストのレイテンシ（テーブル・RPC別）
+- scheduler_pending_backlog: 実行終了時点の未処理件数
+- scheduler_in_flight_requests: 下流APIへの処理中リクエスト数
+- prometheus_client が未インストールの場合は記録せず、/metrics は503を返す
+- CLI実行（cron）のプロセスで記録した値はAPIサーバーには反映されない
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+except ImportError:  # prometheus_clientがない環境ではメトリクスを記録しない
+    Counter = Gauge = Histogram = None
+
+logger = logging.getLogger(__name__)
+
+# 実行時間（秒）: ドレインは最大で時間予算（45分）まで続く
+RUN_DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 2700, 3600)
+# 下流APIのレイテンシ（秒）: 文字起こしのバッチは数分かかる
+DOWNSTREAM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Supabaseのレイテンシ（秒）
+SUPABASE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+ITEM_STAGES = ("fetched", "dispatched", "succeeded", "failed")
+
+
+class _NoopMetric:
+    """prometheus_clientがない場合の代わり（何も記録しない）"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+def is_available() -> bool:
+    return Counter is not None
+
+
+if is_available():
+    RUNS = Counter('scheduler_runs_total', 'Scheduler runs per API', ['api', 'status'])
+    RUN_DURATION = Histogram('scheduler_run_duration_seconds', 'Scheduler run duration per API', ['api'],
+                             buckets=RUN_DURATION_BUCKETS)
+    ITEMS = Counter('scheduler_items_total', 'Work items per API and stage', ['api', 'stage'])
+    DOWNSTREAM_LATENCY = Histogram('scheduler_downstream_request_seconds', 'Downstream API request latency',
+                                   ['api', 'outcome'], buckets=DOWNSTREAM_BUCKETS)
+    SUPABASE_LATENCY = Histogram('scheduler_supabase_request_seconds', 'Supabase request latency',
+                                 ['target', 'method'], buckets=SUPABASE_BUCKETS)
+    PENDING_BACKLOG = Gauge('scheduler_pending_backlog', 'Pending items at the end of the last run', ['api'])
+    IN_FLIGHT = Gauge('scheduler_in_flight_requests', 'In-flight downstream requests', ['api'])
+else:
+    RUNS = RUN_DURATION = ITEMS = DOWNSTREAM_LATENCY = SUPABASE_LATENCY = PENDING_BACKLOG = IN_FLIGHT = _NoopMetric()
+
+
+def record_run(api_name: str, status: str, seconds: float):
+    """1回の実行を記録（status: SUCCESS / PARTIAL / ERROR）"""
+    RUNS.labels(api_name, status).inc()
+    RUN_DURATION.labels(api_name).observe(seconds)
+
+
+def record_items(api_name: str, stage: str, count: int = 1):
+    """取得・送信・成功・失敗した件数を記録"""
+    if count:
+        ITEMS.labels(api_name, stage).inc(count)
+
+
+def observe_downstream(api_name: str, outcome: str, seconds: float):
+    """下流APIへのリクエストのレイテンシ（outcome: 2xx / 4xx / 5xx / 例外名）"""
+    DOWNSTREAM_LATENCY.labels(api_name, outcome).observe(seconds)
+
+
+@contextmanager
+def track_in_flight(api_name: str):
+    """下流APIへの処理中リクエスト数"""
+    IN_FLIGHT.labels(api_name).inc()
+    try:
+        yield
+    finally:
+        IN_FLIGHT.labels(api_name).dec()
+
+
+def set_pending_backlog(api_name: str, count: Optional[int]):
+    if count is not None:
+        PENDING_BACKLOG.labels(api_name).set(count)
+
+
+def supabase_target(path: str) -> str:
+    """PostgRESTのパスからテーブル名・RPC名を取り出す（/rest/v1/rpc/claim_audio_files → rpc/claim_audio_files）"""
+    target = path.split('/rest/v1/', 1)[-1].strip('/')
+    return target or 'unknown'
+
+
+def instrument_supabase(client):
+    """
+    Supabaseクライアント（PostgREST）のHTTPセッションにレイテンシ計測のフックを付ける
+    （レスポンスヘッダーを受け取るまでの時間。クライアント作成時に1回だけ呼び出す）
+    """
+    if not is_available():
+        return
+
+    def on_request(request):
+        request.extensions['scheduler_started'] = time.monotonic()
+
+    def on_response(response):
+        started = response.request.extensions.get('scheduler_started')
+        if started is not None:
+            SUPABASE_LATENCY.labels(supabase_target(response.request.url.path),
+                                    response.request.method).observe(time.monotonic() - started)
+
+    try:
+        session = client.postgrest.session
+        hooks = session.event_hooks
+        session.event_hooks = {
+            'request': [*hooks.get('request', []), on_request],
+            'response': [*hooks.get('response', []), on_response]
+        }
+    except Exception as e:
+        logger.warning(f"Supabaseのレイテンシ計測を有効にできません: {e}")
+
+
+def render() -> Tuple[bytes, str]:
+    """/metrics のレスポンス本文とContent-Type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,65 @@
+"""
+パイプラインのステージ連鎖
+config.py の PIPELINE_DEPENDENCIES（下流ステージ -> 上流ステージ）に従い、
+上流ステージが (device_id, date, time_block) の処理を終えた時点で下流ステージを起動する
+
+- ランナー（run-api-process-docker.py）はステージの完了をpublishで通知する
+- 常駐スケジューラーエンジンがsubscribeし、下流ステージを対象キー付きで実行する
+- 購読者がいない場合（cronからのCLI実行）は何もしない。時刻表による定期実行は取りこぼしの回収用として残る
+"""
+
+import logging
+import threading
+from typing import Callable, Iterable, List, Tuple
+
+from config import PIPELINE_DEPENDENCIES
+
+logger = logging.getLogger(__name__)
+
+# (device_id, date, time_block)
+StageKey = Tuple[str, str, str]
+
+_listeners: List[Callable[[str, List[StageKey]], None]] = []
+_listeners_lock = threading.Lock()
+
+
+def dependents_of(api_name: str) -> List[str]:
+    """指定ステージの完了を待っている下流ステージ"""
+    return [stage for stage, upstream in PIPELINE_DEPENDENCIES.items() if api_name in upstream]
+
+
+def upstream_of(api_name: str) -> List[str]:
+    """指定ステージの上流ステージ"""
+    return list(PIPELINE_DEPENDENCIES.get(api_name, []))
+
+
+def subscribe(listener: Callable[[str, List[StageKey]], None]):
+    """ステージ完了の通知先を登録（同じ通知先は1回だけ登録される）"""
+    with _listeners_lock:
+        if listener not in _listeners:
+            _listeners.append(listener)
+
+
+def unsubscribe(listener: Callable[[str, List[StageKey]], None]):
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def has_listeners() -> bool:
+    with _listeners_lock:
+        return bool(_listeners)
+
+
+def publish(api_name: str, keys: Iterable[StageKey]):
+    """ステージの完了を通知（下流ステージがない・購読者がいない場合は何もしない）"""
+    keys = sorted(set(keys))
+    if not keys or not dependents_of(api_name):
+        return
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        try:
+            listener(api_name, keys)
+        except Exception as e:
+            logger.error(f"{api_name}: ステージ完了通知エラー: {e}")
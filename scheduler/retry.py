@@ -0,0 +1,72 @@
+"""
+一時的な失敗（接続エラー・5xx・429）の再試行
+指数バックオフ（フルジッター）で待ってから再試行し、1回の実行あたりの再試行回数に上限（再試行予算）を設ける
+
+- 再試行予算はAPIごとに実行開始時にリセットする（同じAPIの実行は重ならないため）
+- 予算を使い切った後の失敗は再試行せず、呼び出し側の失敗処理（試行回数の記録・デッドレター）に回す
+- 冪等でないPOSTは、下流に処理が届いていない失敗（接続エラーと NON_IDEMPOTENT_RETRY_STATUS_CODES）だけを再試行する
+"""
+
+import random
+import threading
+from typing import Dict
+
+# 再試行するHTTPステータス
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+# 冪等でないリクエスト（POST）で再試行するHTTPステータス
+# 429/503 は処理を受け付けずに返されるため再送しても処理は重複しないが、
+# 500/502/504 は下流で処理が進んでいる（または続いている）可能性があるため再送しない
+NON_IDEMPOTENT_RETRY_STATUS_CODES = (429, 503)
+# 1リクエストあたりの最大再試行回数
+MAX_REQUEST_RETRIES = 3
+# バックオフの基準秒数と上限
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 60.0
+# 1回の実行あたりの再試行予算（API_CONFIGSの retry_budget で上書き可能）
+DEFAULT_RUN_RETRY_BUDGET = 20
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_MAX_SECONDS) -> float:
+    """attempt回目（0始まり）の再試行前の待ち時間（フルジッター）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RetryBudget:
+    """1回の実行あたりの再試行回数の上限"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_spend(self) -> bool:
+        """予算が残っていれば1回分使ってTrue"""
+        with self._lock:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    @property
+    def remaining(self) -> int:
+        with self._lock:
+            return max(0, self.limit - self.used)
+
+
+_budgets: Dict[str, RetryBudget] = {}
+_budgets_lock = threading.Lock()
+
+
+def reset_retry_budget(api_name: str, limit: int = DEFAULT_RUN_RETRY_BUDGET) -> RetryBudget:
+    """実行開始時に再試行予算をリセット"""
+    with _budgets_lock:
+        _budgets[api_name] = RetryBudget(limit)
+        return _budgets[api_name]
+
+
+def get_retry_budget(api_name: str) -> RetryBudget:
+    """現在の実行の再試行予算（未設定の場合はデフォルト値で作成）"""
+    with _budgets_lock:
+        if api_name not in _budgets:
+            _budgets[api_name] = RetryBudget(DEFAULT_RUN_RETRY_BUDGET)
+        return _budgets[api_name]
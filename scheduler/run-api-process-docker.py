@@ -4,23 +4,40 @@ API自動処理実行スクリプト（Dockerコンテナ用）
 指定されたAPIの自動処理を実行
 """
 
+import asyncio
 import sys
-import requests
+import httpx
 import json
 import logging
+import secrets
+import socket
+import threading
+import time
 from datetime import datetime, date, timezone, timedelta
 from supabase import create_client, Client
 import os
+from urllib.parse import urlsplit
 
 # JSTタイムゾーン定義（このスケジューラーは日本向けテスト用）
 JST = timezone(timedelta(hours=9))
 
-# 設定をインポート
-try:
-    from config import DEFAULT_DEVICE_ID
-except ImportError:
-    # config.pyが存在しない場合のフォールバック
-    DEFAULT_DEVICE_ID = '9f7d6e27-98c3-4c19-bdfb-f7fda58b9a93'
+from dispatch import DEFAULT_CONCURRENCY, DispatchResult, dispatch, run_coroutine
+from adaptive_limiter import OVERLOAD_STATUS_CODES, get_limiter
+from circuit_breaker import HALF_OPEN, OPEN, CircuitOpenError, get_breaker
+from budget import BudgetGovernor, estimate_tokens
+from status_writer import StatusWriteBuffer, chunk_keys
+from batch_tuner import BatchTuner
+from log_rotation import RotatingLogHandler
+from http_pool import connection_stats, get_http_client, http_timeout, log_connection_stats, request_extensions
+from job_store import JobStore
+from run_history import RunHistory
+from scheduling import (CANDIDATE_WINDOW_FACTOR, FAIR_SHARE, FIFO, LIVE_FIRST, LIVE_WINDOW_SECONDS, PER_DEVICE_FACTOR,
+                        SHORTEST_JOB_FIRST, resolve_policy, select_batch)
+from retry import (DEFAULT_RUN_RETRY_BUDGET, MAX_REQUEST_RETRIES, NON_IDEMPOTENT_RETRY_STATUS_CODES, TRANSIENT_STATUS_CODES,
+                   backoff_delay, get_retry_budget, reset_retry_budget)
+from watermarks import WatermarkStore
+import metrics
+import pipeline
 
 # ログ設定
 LOG_DIR = "/var/log/scheduler"
@@ -28,16 +45,18 @@ os.makedirs(LOG_DIR, exist_ok=True)
 
 # APIごとのログファイルを設定
 def get_logger(api_name: str):
-    """API専用のロガーを取得"""
+    """API専用のロガーを取得（ログファイルはサイズ・経過時間でローテーションし、gzip圧縮して保管）"""
     logger = logging.getLogger(f"scheduler.{api_name}")
     logger.setLevel(logging.INFO)
     
-    # 既存のハンドラーをクリア
+    # 既存のハンドラーを閉じてクリア
+    for handler in logger.handlers:
+        handler.close()
     logger.handlers = []
     
-    # ファイルハンドラー
+    # ファイルハンドラー（複数プロセスからの追記・ローテーションに対応）
     log_file = f"{LOG_DIR}/scheduler-{api_name}.log"
-    file_handler = logging.FileHandler(log_file)
+    file_handler = RotatingLogHandler(log_file)
     file_handler.setLevel(logging.INFO)
     
     # コンソールハンドラー
@@ -87,7 +106,10 @@ API_CONFIGS = {
     "vibe-scorer": {
         "endpoint": "http://api-gpt-v1:8002/analyze-vibegraph-supabase",
         "display_name": "Vibe Scorer",
-        "type": "device_based"
+        "type": "device_based",
+        "concurrency": 2,  # ChatGPT API（api-gpt-v1）への同時リクエスト数
+        "gpt_budget": True,  # ChatGPT予算管理の対象
+        "estimated_prompt_tokens": 6000  # プロンプトはAPI側で生成されるため1デバイスあたりの推定値
     },
     "behavior-aggregator": {
         "endpoint": "http://api-sed-aggregator:8010/analysis/sed",
@@ -125,8 +147,11 @@ API_CONFIGS = {
         "model": "azure",  # Azureモデルを指定
         "display_name": "Azure Transcriber",
         "type": "file_based",
-        "batch_size": 10,  # 一度に処理する最大ファイル数を10に制限
-        "timeout": 600  # 10分のタイムアウト
+        "batch_size": 10,  # 処理時間の推定値がない場合のバッチサイズ
+        "timeout": 600,  # 処理時間の推定値がない場合のタイムアウト（10分）
+        "target_batch_seconds": 480,  # 1バッチの目標処理時間（推定値からバッチサイズ・タイムアウトを決定）
+        "async_completion": False,  # 下流APIがjob_id/callback_urlに対応したらTrue（完了を待たずに次のバッチへ）
+        "scheduling_policy": "fifo"  # 処理順序: fifo / fair_share / sjf / live_first（scheduling.py）
     },
     "timeblock-prompt": {
         # タイムブロック単位プロンプト生成API
@@ -135,6 +160,7 @@ API_CONFIGS = {
         "type": "timeblock_based",  # 新しいタイプ：未処理タイムブロック検出型
         "method": "GET",
         "timeout": 120,
+        "concurrency": 4,  # 同一デバイスのタイムブロックは順番に処理される
         "status_tables": [  # STATUS管理対象テーブル
             "vibe_whisper",
             "behavior_yamnet", 
@@ -149,7 +175,11 @@ API_CONFIGS = {
         "method": "POST",
         "timeout": 60,  # ChatGPT処理のため60秒
         "status_table": "dashboard",  # 対象テーブル
-        "batch_limit": 50  # 一度に処理する最大件数
+        "batch_limit": 50,  # 一度に処理する最大件数
+        "concurrency": 2,  # ChatGPT API（api-gpt-v1）への同時リクエスト数
+        "gpt_budget": True,  # ChatGPT予算管理の対象（promptの文字数からトークン数を推定）
+        "estimated_prompt_tokens": 4000,  # promptの文字数が取得できない場合の1件あたりの推定値
+        "server_side_prompt": False  # api-gpt-v1がキーからpromptを読み込めるようになったらTrue（promptを送らない）
     },
     "dashboard-summary": {
         # ダッシュボードサマリー生成API（vibe-aggregatorと同じパターン）
@@ -164,91 +194,867 @@ API_CONFIGS = {
         "display_name": "Dashboard Summary ChatGPT Analysis",
         "type": "device_based",  # dashboard-summaryと同じdevice_basedタイプ
         "method": "POST",  # POSTメソッドを使用
-        "timeout": 120  # ChatGPT処理のため120秒
+        "timeout": 120,  # ChatGPT処理のため120秒
+        "concurrency": 2,  # ChatGPT API（api-gpt-v1）への同時リクエスト数
+        "gpt_budget": True,  # ChatGPT予算管理の対象
+        "estimated_prompt_tokens": 8000  # プロンプトはAPI側で生成されるため1デバイスあたりの推定値
     }
 }
 
+# ファイルベースAPIのバッチサイズ・タイムアウトの自動調整（計測した1ファイルあたりの処理時間から決定）
+batch_tuner = BatchTuner()
+
+# ファイルベースAPIのドレインモード設定
+# 未処理ファイルがなくなるか時間予算に達するまでバッチを連続して処理する
+# （API_CONFIGSの drain: False で1バッチのみの従来動作、drain_time_budget で時間予算を上書き）
+DRAIN_TIME_BUDGET = 45 * 60  # 秒（次の時刻表スロットと重ならないように）
+MAX_CONSECUTIVE_FAILED_BATCHES = 3  # 連続して失敗した場合はエンドポイント障害とみなして中断
+
+# 未処理ファイル取得時のリース（複数のスケジューラーが同時に実行しても同じファイルを処理しない）
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_MARGIN_SECONDS = 60  # リース有効期限 = リクエストタイムアウト + この秒数
+
+# 一時的な失敗・リース期限切れがこの回数に達したファイルはdead_letterにする（API_CONFIGSの max_attempts で上書き可能）
+MAX_ATTEMPTS = 5
+DEAD_LETTER_STATUS = 'dead_letter'
+
+# ChatGPT利用ステージの予算管理
+budget_governor = BudgetGovernor()
+
+# デバイスベースステージの差分処理
+# 前回の実行以降に上流ステージの結果が変化した (device_id, date) だけを処理する（sql/get_dirty_device_dates.sql）
+# （API_CONFIGSの trailing_days / dirty_lookback_seconds で上書き可能）
+DIRTY_TRAILING_DAYS = 2  # 今日を含めずに遡る日数（日付をまたいだ遅延アップロードの再集計用）
+DIRTY_LOOKBACK_SECONDS = 300  # ウォーターマークより前に遡る秒数（前回の実行開始時点で書き込み中だった変更を拾い直す）
+watermark_store = WatermarkStore()
+
+# ステータス更新の書き込みバッファ（バッチの区切りとプロセス終了時に一括更新）
+# audio_filesは複数のファイルベースAPIが同時に更新するため、update_files_statusの呼び出しごとにバッファを作る
+# （共有すると他のAPI・バッチの更新までflushし、失敗件数を取り違える）
+dashboard_status_writer = StatusWriteBuffer(
+    lambda: get_supabase_client(), 'dashboard', ('device_id', 'date', 'time_block'),
+    stamp=lambda: {'processed_at': datetime.now(JST).isoformat()}
+)
+
+# 下流APIの非同期完了追跡（API_CONFIGSの async_completion: True のAPIが対象）
+# リクエストにjob_idとcallback_urlを付けて送り、受付（202）が返れば完了を待たずに次へ進む
+# 完了結果はスケジューラーAPIへのコールバック、または下流APIが返したstatus_urlのポーリングで記録する
+SCHEDULER_CALLBACK_URL = os.getenv('SCHEDULER_CALLBACK_URL', 'http://watchme-scheduler-prod:8015')
+ASYNC_ACCEPT_TIMEOUT = 30  # 受付レスポンスを待つ秒数
+STATUS_POLL_TIMEOUT = 10  # status_urlのポーリングのタイムアウト（秒）
+# 受付（202）で並列数の枠は空くため、完了待ちジョブ数の上限で取得・送信を止める（API_CONFIGSの max_outstanding_jobs で上書き可能）
+MAX_OUTSTANDING_JOBS = 4
+JOB_SLOT_POLL_SECONDS = 10  # 完了待ちジョブ数が上限の間、完了を確認する間隔（秒）
+job_store = JobStore()
+
+_supabase_client = None
+_supabase_lock = threading.Lock()
+
 def get_supabase_client() -> Client:
-    """Supabaseクライアント取得"""
+    """Supabaseクライアント取得（プロセス内で1つのクライアントを共有し、接続を再利用する）"""
+    global _supabase_client
     if not SUPABASE_URL or not SUPABASE_KEY:
         raise ValueError("Supabase設定が見つかりません")
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    with _supabase_lock:
+        if _supabase_client is None:
+            _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            metrics.instrument_supabase(_supabase_client)
+        return _supabase_client
 
-def get_pending_files(api_name: str, limit: int = 10, api_logger=None) -> list:
-    """未処理ファイル取得（バッチサイズ制限付き）"""
+def claim_pending_files(api_name: str, limit: int, lease_seconds: int, after: tuple = None, api_logger=None):
+    """
+    未処理ファイルをアトミックに取得してprocessingにする（リース付き）
+    RPC（sql/claim_pending_audio_files.sql）で、まだpendingの行だけをprocessingに変更し、
+    リースの所有者（LEASE_OWNER）と有効期限を記録する
+    RPCが使えない場合は、pendingの行だけを対象にした条件付き更新で取得する（リースは記録されない）
+    after: (created_at, file_path) のキーセットカーソル。これより後の行だけを対象にする
+    戻り値: (取得した行のリスト, 次のカーソル。対象行がなければNone)
+    """
     log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    status_column = config['status_column']
+    supabase = get_supabase_client()
+    
     try:
-        if api_name not in API_CONFIGS:
-            raise ValueError(f"未対応のAPI: {api_name}")
-        
-        config = API_CONFIGS[api_name]
-        # batch_sizeが設定されている場合はそれを使用
-        actual_limit = config.get('batch_size', limit)
-        supabase = get_supabase_client()
-        
+        response = supabase.rpc('claim_pending_audio_files', {
+            'p_status_column': status_column,
+            'p_limit': limit,
+            'p_lease_owner': LEASE_OWNER,
+            'p_lease_seconds': lease_seconds,
+            'p_after_created_at': after[0] if after else None,
+            'p_after_file_path': after[1] if after else None
+        }).execute()
+        rows = response.data or []
+        cursor = (rows[-1]['created_at'], rows[-1]['file_path']) if rows else None
+        return rows, cursor
+    except Exception as e:
+        log.warning(f"{api_name}: 取得RPCエラーのため条件付き更新で取得: {e}")
+    
+    # フォールバック：候補を読み込み、まだpendingの行だけをprocessingに更新
+    query = supabase.table('audio_files').select('*').eq(status_column, 'pending')
+    if after:
+        query = query.or_(keyset_after(*after))
+    candidates = query \
+        .order('created_at', desc=False) \
+        .order('file_path', desc=False) \
+        .limit(limit) \
+        .execute().data or []
+    if not candidates:
+        return [], None
+    
+    response = supabase.table('audio_files') \
+        .update({status_column: 'processing'}) \
+        .in_('file_path', [row['file_path'] for row in candidates]) \
+        .eq(status_column, 'pending') \
+        .execute()
+    claimed = {row['file_path'] for row in (response.data or [])}
+    if len(claimed) < len(candidates):
+        log.info(f"{api_name}: {len(candidates) - len(claimed)}件は他のスケジューラーが取得済み")
+    return [row for row in candidates if row['file_path'] in claimed], (candidates[-1]['created_at'], candidates[-1]['file_path'])
+
+def list_pending_candidates(api_name: str, policy: str, limit: int, api_logger=None) -> list:
+    """
+    スケジューリング方針（scheduling.py）で1バッチを選ぶための未処理ファイルの候補を取得
+    fifo以外の方針は古い順の先頭だけでは偏るため、方針ごとに必要な候補を追加で読み込む
+    - fair_share: デバイスごとの先頭（RPC: get_pending_audio_heads）
+    - sjf: 音声の短い順
+    - live_first: ライブ期間内の古い順
+    """
+    log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    status_column = config['status_column']
+    duration_column = config.get('duration_column')
+    columns = ', '.join(['file_path', 'device_id', 'created_at'] + ([duration_column] if duration_column else []))
+    window = limit * CANDIDATE_WINDOW_FACTOR
+    supabase = get_supabase_client()
+    
+    def pending_query():
+        return supabase.table('audio_files').select(columns).eq(status_column, 'pending')
+    
+    queries = [lambda: pending_query().order('created_at').order('file_path').limit(window).execute().data]
+    if policy == FAIR_SHARE:
+        per_device = max(1, limit * PER_DEVICE_FACTOR)
+        queries.append(lambda: supabase.rpc('get_pending_audio_heads', {
+            'p_status_column': status_column,
+            'p_per_device': per_device,
+            'p_limit': window
+        }).execute().data)
+    elif policy == SHORTEST_JOB_FIRST and duration_column:
+        queries.append(lambda: pending_query().order(duration_column, nullsfirst=False).order('created_at')
+                       .limit(window).execute().data)
+    elif policy == LIVE_FIRST:
+        live_since = datetime.now(timezone.utc) - timedelta(seconds=config.get('live_window_seconds', LIVE_WINDOW_SECONDS))
+        queries.append(lambda: pending_query().gte('created_at', live_since.isoformat())
+                       .order('created_at').order('file_path').limit(window).execute().data)
+    
+    candidates = {}
+    for query in queries:
+        try:
+            rows = query() or []
+        except Exception as e:
+            log.warning(f"{api_name}: 候補取得エラー（古い順の候補のみで選択）: {e}")
+            continue
+        for row in rows:
+            candidates.setdefault(row['file_path'], row)
+    return list(candidates.values())
+
+def claim_files_by_path(api_name: str, file_paths: list, lease_seconds: int, api_logger=None) -> list:
+    """
+    指定したファイルのうち、まだpendingの行だけをprocessingにして返す（リース付き、RPC: claim_audio_files）
+    RPCが使えない場合は条件付き更新で取得する（リースは記録されない）
+    """
+    log = api_logger or logger
+    status_column = API_CONFIGS[api_name]['status_column']
+    supabase = get_supabase_client()
+    try:
+        response = supabase.rpc('claim_audio_files', {
+            'p_status_column': status_column,
+            'p_file_paths': file_paths,
+            'p_lease_owner': LEASE_OWNER,
+            'p_lease_seconds': lease_seconds
+        }).execute()
+    except Exception as e:
+        log.warning(f"{api_name}: 取得RPCエラーのため条件付き更新で取得: {e}")
         response = supabase.table('audio_files') \
-            .select('file_path, created_at, device_id') \
-            .eq(config['status_column'], 'pending') \
-            .order('created_at', desc=False) \
-            .limit(actual_limit) \
+            .update({status_column: 'processing'}) \
+            .in_('file_path', file_paths) \
+            .eq(status_column, 'pending') \
             .execute()
-        
-        if response.data:
-            log.info(f"{api_name}: {len(response.data)}件の未処理ファイルを取得（最大{actual_limit}件）")
-            # 各ファイルパスをログに記録
-            for idx, item in enumerate(response.data, 1):
-                log.info(f"  [{idx}/{len(response.data)}] {item['file_path']} (device: {item['device_id']})")
-            return [item['file_path'] for item in response.data]
-        else:
-            log.info(f"{api_name}: 未処理ファイルなし")
-            return []
-            
+    claimed = {row['file_path']: row for row in (response.data or [])}
+    if len(claimed) < len(file_paths):
+        log.info(f"{api_name}: {len(file_paths) - len(claimed)}件は他のスケジューラーが取得済み")
+    return [claimed[path] for path in file_paths if path in claimed]
+
+def claim_scheduled_files(api_name: str, policy: str, limit: int, lease_seconds: int, seen: set, api_logger=None):
+    """
+    スケジューリング方針で選んだ1バッチ分のファイルを取得してprocessingにする
+    この実行で一度選んだファイル（seen）は、pendingに戻っていても選ばない
+    方針の判断内容は実行ログに記録する
+    戻り値: 取得した行のリスト（候補がなくなった場合はNone）
+    """
+    log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    candidates = [row for row in list_pending_candidates(api_name, policy, limit, log) if row['file_path'] not in seen]
+    if not candidates:
+        return None
+    
+    estimate = batch_tuner.estimate(api_name) or {}
+    rows, decision = select_batch(policy, candidates, limit, config, datetime.now(timezone.utc),
+                                  estimate.get('seconds_per_audio_second'))
+    log.info(f"{api_name}: スケジューリング方針 {policy} - {decision}（候補 {len(candidates)}件）")
+    file_paths = [row['file_path'] for row in rows]
+    seen.update(file_paths)
+    return claim_files_by_path(api_name, file_paths, lease_seconds, log)
+
+def extend_page_lease(api_name: str, batches: list, timeout: int, api_logger=None) -> list:
+    """
+    1ページを複数のバッチに分割した場合に、ページ全体のリースを全バッチの処理時間分に延長する
+    （取得時のリースは1バッチ分のため、後のバッチが送信待ちの間に期限切れになると、
+      リース回収でpendingに戻って二重に処理される。RPC: extend_audio_file_leases）
+    延長できなかった場合は最初のバッチだけを処理し、残りはpendingに戻す
+    戻り値: 処理するバッチのリスト
+    """
+    log = api_logger or logger
+    file_paths = [item['file_path'] for rows in batches for item in rows]
+    lease_seconds = len(batches) * (timeout + LEASE_MARGIN_SECONDS)
+    try:
+        response = get_supabase_client().rpc('extend_audio_file_leases', {
+            'p_status_column': API_CONFIGS[api_name]['status_column'],
+            'p_file_paths': file_paths,
+            'p_lease_owner': LEASE_OWNER,
+            'p_lease_seconds': lease_seconds
+        }).execute()
+        extended = len(response.data or [])
     except Exception as e:
-        log.error(f"{api_name}: 未処理ファイル取得エラー: {e}")
-        return []
+        log.warning(f"{api_name}: リース延長エラー: {e}")
+        extended = 0
+    
+    if extended == len(file_paths):
+        log.info(f"{api_name}: {len(batches)}バッチに分割したため{len(file_paths)}件のリースを{lease_seconds}秒に延長")
+        return batches
+    released = [item['file_path'] for rows in batches[1:] for item in rows]
+    log.warning(f"{api_name}: リースを延長できないため最初のバッチのみ処理し、{len(released)}件をpendingに戻します")
+    update_files_status(api_name, released, 'pending', log)
+    return batches[:1]
 
-# config.json関連の関数は削除（不要になったため）
+def reap_expired_leases(api_name: str, api_logger=None) -> int:
+    """
+    リース期限が切れてprocessingのまま残ったファイルをpendingに戻す（attemptsを1増やす）
+    タイムアウトや下流サービスの停止で完了しなかったファイルを処理対象に戻すためのステージ
+    リースのないprocessingのファイルには、APIのタイムアウトから決めたリースを付与して次回以降の回収対象にする
+    戻り値: 回収したファイル数
+    """
+    log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    _, timeout = batch_tuner.plan(api_name, config)
+    lease_seconds = max(timeout, config.get('timeout', 300)) + LEASE_MARGIN_SECONDS
+    
+    try:
+        supabase = get_supabase_client()
+        response = supabase.rpc('reap_expired_audio_leases', {
+            'p_status_column': config['status_column'],
+            'p_lease_seconds': lease_seconds,
+            'p_max_attempts': config.get('max_attempts', MAX_ATTEMPTS)
+        }).execute()
+    except Exception as e:
+        log.warning(f"{api_name}: リース回収エラー（スキップ）: {e}")
+        return 0
+    
+    reclaimed = response.data or []
+    if reclaimed:
+        log.warning(f"{api_name}: リース期限切れの{len(reclaimed)}件を回収しました（リース {lease_seconds}秒）")
+        for item in reclaimed:
+            log.warning(f"  - {item['file_path']} (試行回数: {item['attempts']}, → {item.get('status', 'pending')})")
+    else:
+        log.info(f"{api_name}: リース期限切れのファイルなし")
+    return len(reclaimed)
 
-def get_all_device_ids_for_date(process_date: str, api_logger=None) -> list:
-    """指定日付の全デバイスIDを取得"""
+def record_failed_attempts(api_name: str, file_paths: list, error: str, api_logger=None):
+    """
+    一時的な失敗（5xx・429）で終わったファイルの試行回数を1増やす
+    max_attempts に達したファイルはdead_letter、それ以外はpendingに戻す（次回以降に再取得される）
+    RPCが使えない場合は従来どおりfailedにする
+    """
     log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    max_attempts = config.get('max_attempts', MAX_ATTEMPTS)
     try:
         supabase = get_supabase_client()
-        
-        # process_dateが"today"の場合はJSTでの今日の日付に変換
-        if process_date == "today":
-            jst_now = datetime.now(JST)
-            process_date = jst_now.strftime("%Y-%m-%d")
-        
-        # audio_filesテーブルから指定日付のユニークなdevice_idを取得
-        # created_atフィールドを使用して日付でフィルタリング
-        start_date = f"{process_date}T00:00:00"
-        end_date = f"{process_date}T23:59:59"
-        
+        response = supabase.rpc('record_audio_file_failures', {
+            'p_status_column': config['status_column'],
+            'p_file_paths': file_paths,
+            'p_max_attempts': max_attempts,
+            'p_error': error[:500]
+        }).execute()
+    except Exception as e:
+        log.warning(f"{api_name}: 試行回数の記録エラー（failedに更新）: {e}")
+        update_files_status(api_name, file_paths, 'failed', log)
+        return
+    
+    rows = response.data or []
+    dead = [row for row in rows if row['status'] == DEAD_LETTER_STATUS]
+    log.info(f"{api_name}: {len(rows) - len(dead)}件をpendingに戻しました（次回再試行）")
+    if dead:
+        log.error(f"{api_name}: {len(dead)}件が{max_attempts}回失敗したためdead_letterに移動")
+        for row in dead:
+            log.error(f"  - {row['file_path']} (試行回数: {row['attempts']})")
+
+def list_dead_letters(api_name: str, limit: int = 100) -> list:
+    """dead_letterのファイル一覧（試行回数・最後のエラー付き）。スケジューラーAPIから呼び出される"""
+    config = API_CONFIGS[api_name]
+    supabase = get_supabase_client()
+    response = supabase.table('audio_files') \
+        .select('file_path, device_id, created_at') \
+        .eq(config['status_column'], DEAD_LETTER_STATUS) \
+        .order('created_at') \
+        .limit(limit) \
+        .execute()
+    files = response.data or []
+    
+    leases = {}
+    for chunk in chunk_keys([row['file_path'] for row in files]):
+        lease_response = supabase.table('scheduler_leases') \
+            .select('file_path, attempts, last_error, dead_lettered_at') \
+            .eq('status_column', config['status_column']) \
+            .in_('file_path', chunk) \
+            .execute()
+        leases.update({row['file_path']: row for row in lease_response.data or []})
+    
+    return [
+        {
+            **row,
+            "attempts": leases.get(row['file_path'], {}).get('attempts'),
+            "last_error": leases.get(row['file_path'], {}).get('last_error'),
+            "dead_lettered_at": leases.get(row['file_path'], {}).get('dead_lettered_at')
+        }
+        for row in files
+    ]
+
+def requeue_dead_letters(api_name: str, file_paths: list = None, api_logger=None) -> int:
+    """
+    dead_letterのファイルをpendingに戻し、試行回数をリセットする
+    file_paths未指定の場合はこのAPIのdead_letterを全て戻す
+    戻り値: pendingに戻したファイル数
+    """
+    log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    status_column = config['status_column']
+    supabase = get_supabase_client()
+    
+    if file_paths is None:
         response = supabase.table('audio_files') \
-            .select('device_id') \
-            .gte('created_at', start_date) \
-            .lte('created_at', end_date) \
+            .select('file_path') \
+            .eq(status_column, DEAD_LETTER_STATUS) \
             .execute()
+        file_paths = [row['file_path'] for row in response.data or []]
+    
+    requeued = 0
+    for chunk in chunk_keys(file_paths):
+        # 先に試行回数をリセットする（途中で失敗しても再投入直後にdead_letterに戻らないように）
+        supabase.table('scheduler_leases') \
+            .update({'attempts': 0, 'last_error': None, 'dead_lettered_at': None}) \
+            .eq('status_column', status_column) \
+            .in_('file_path', chunk) \
+            .execute()
+        response = supabase.table('audio_files') \
+            .update({status_column: 'pending'}) \
+            .eq(status_column, DEAD_LETTER_STATUS) \
+            .in_('file_path', chunk) \
+            .execute()
+        requeued += len(response.data or [])
+    
+    log.info(f"{api_name}: dead_letterの{requeued}件をpendingに戻しました")
+    return requeued
+
+def iter_pending_files(api_name: str, limit: int = 10, api_logger=None):
+    """
+    未処理ファイルをバッチ単位で取得（processingに変更）して返すジェネレーター
+    (created_at, file_path) のキーセットカーソルで次のバッチを必要になった時点で取得するため、
+    バックログの件数に関係なくメモリ使用量は1バッチ分で一定
+    バッチサイズ・タイムアウトはバッチ取得ごとに処理時間の推定値から決め直す
+    duration_columnが設定されている場合は、音声の長さで推定処理時間がタイムアウトに収まるように分割する
+    scheduling_policyがfifo以外の場合は、方針で選んだファイルを取得する（scheduling.py。キーセットカーソルは使わない）
+    戻り値（各バッチ）: {"file_paths": [...], "timeout": 秒, "audio_seconds": 音声の合計秒数またはNone}
+    """
+    log = api_logger or logger
+    config = {**API_CONFIGS[api_name]}
+    config.setdefault('batch_size', limit)
+    duration_column = config.get('duration_column')
+    policy = resolve_policy(config)
+    
+    cursor = None
+    seen = set()
+    batch_number = 0
+    batches = []
+    try:
+        while True:
+            batch_size, timeout = batch_tuner.plan(api_name, config)
+            if policy == FIFO:
+                page, cursor = claim_pending_files(api_name, batch_size, timeout + LEASE_MARGIN_SECONDS, cursor, log)
+                if cursor is None:
+                    return
+            else:
+                page = claim_scheduled_files(api_name, policy, batch_size, timeout + LEASE_MARGIN_SECONDS, seen, log)
+                if page is None:
+                    return
+            if not page:
+                continue
+            
+            if duration_column:
+                batches = batch_tuner.pack_by_duration(api_name, page, duration_column, timeout)
+                if len(batches) > 1:
+                    batches = extend_page_lease(api_name, batches, timeout, log)
+            else:
+                batches = [page]
+            
+            while batches:
+                rows = batches.pop(0)
+                batch_number += 1
+                log.info(f"{api_name}: バッチ{batch_number} - {len(rows)}件の未処理ファイルを取得"
+                         f"（最大{batch_size}件, タイムアウト{timeout}秒, リース所有者 {LEASE_OWNER}）")
+                for idx, item in enumerate(rows, 1):
+                    log.info(f"  [{idx}/{len(rows)}] {item['file_path']} (device: {item['device_id']})")
+                yield {
+                    "file_paths": [item['file_path'] for item in rows],
+                    "timeout": timeout,
+                    "audio_seconds": sum(item.get(duration_column) or 0 for item in rows) if duration_column else None
+                }
+    finally:
+        # 途中で処理を打ち切った場合、取得済みで未処理のファイルはpendingに戻す
+        remaining = [item['file_path'] for rows in batches for item in rows]
+        if remaining:
+            log.info(f"{api_name}: 未処理のまま取得した{len(remaining)}件をpendingに戻します")
+            update_files_status(api_name, remaining, 'pending', log)
+
+# config.json関連の関数は削除（不要になったため）
+
+def postgrest_quote(value) -> str:
+    """PostgRESTフィルタの値をダブルクォートで囲む（カンマ・括弧・ピリオドを含む値も1つの値として扱われる）"""
+    escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+def keyset_after(created_at: str, file_path: str) -> str:
+    """(created_at, file_path) のキーセットページング条件（or_フィルタ用）"""
+    created_at = postgrest_quote(created_at)
+    file_path = postgrest_quote(file_path)
+    return f'created_at.gt.{created_at},and(created_at.eq.{created_at},file_path.gt.{file_path})'
+
+# 変更のあった (device_id, date) のページング取得サイズ（PostgRESTの最大行数 1000 以下にする）
+DEVICE_CHANGES_PAGE_SIZE = 1000
+
+def device_change_keyset_after(local_date: str, device_id: str) -> str:
+    """(local_date, device_id) のキーセットページング条件（or_フィルタ用）"""
+    local_date = postgrest_quote(local_date)
+    device_id = postgrest_quote(device_id)
+    return f'local_date.gt.{local_date},and(local_date.eq.{local_date},device_id.gt.{device_id})'
+
+def get_dirty_device_dates(since: datetime, min_date: str, api_logger=None) -> list:
+    """
+    since以降に上流ステージの結果が変化した (device_id, local_date) を取得
+    変更はトリガー（sql/get_dirty_device_dates.sql）が scheduler_device_changes に記録する
+    （ファイルの追加だけでなく、ファイルベースステージの完了・結果テーブルの書き込みも含む）
+    RPCが使えない場合は scheduler_device_changes を (local_date, device_id) のキーセットページングで走査する
+    （空ページが返るまで読み続けるため、サーバー側の最大行数で1ページが短くなっても、走査中に行が変わっても取りこぼさない）
+    取得に失敗した場合は例外を送出する
+    """
+    log = api_logger or logger
+    supabase = get_supabase_client()
+    
+    try:
+        response = supabase.rpc('get_dirty_device_dates', {
+            'p_since': since.isoformat(),
+            'p_min_date': min_date
+        }).execute()
+        rows = response.data or []
+        log.info(f"{since.strftime('%Y-%m-%d %H:%M:%S')}以降の変更: {len(rows)}件のデバイス・日付 (RPC: {len(rows)}行)")
+        return [(row['device_id'], row['local_date']) for row in rows]
+    except Exception as e:
+        log.warning(f"変更デバイス取得RPCエラーのため変更記録テーブルから取得: {e}")
+    
+    pairs = []
+    rows_scanned = 0
+    pages_scanned = 0
+    after = None
+    while True:
+        query = supabase.table('scheduler_device_changes') \
+            .select('device_id, local_date') \
+            .gte('changed_at', since.isoformat()) \
+            .gte('local_date', min_date)
+        if after:
+            query = query.or_(device_change_keyset_after(*after))
+        response = query \
+            .order('local_date', desc=False) \
+            .order('device_id', desc=False) \
+            .limit(DEVICE_CHANGES_PAGE_SIZE) \
+            .execute()
+        rows = response.data or []
+        if not rows:
+            break
+        pages_scanned += 1
+        rows_scanned += len(rows)
+        pairs.extend((row['device_id'], row['local_date']) for row in rows)
+        after = (rows[-1]['local_date'], rows[-1]['device_id'])
+    log.info(f"{since.strftime('%Y-%m-%d %H:%M:%S')}以降の変更: {len(pairs)}件のデバイス・日付 "
+             f"(ページング走査: {rows_scanned}行, {pages_scanned}ページ)")
+    return pairs
+
+def plan_dirty_device_dates(api_name: str, now: datetime, api_logger=None) -> list:
+    """
+    デバイスベースステージで処理する (device_id, date) を決める
+    ステージのウォーターマーク（前回の実行開始時刻）以降に上流ステージの結果が変化した組み合わせと、
+    前回失敗・繰り越しになった組み合わせを返す（trailing_days日前より古い日付は対象外）
+    ウォーターマークがない場合は trailing_days日前から今日までの全データを対象にする
+    """
+    log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    trailing_days = config.get('trailing_days', DIRTY_TRAILING_DAYS)
+    lookback = config.get('dirty_lookback_seconds', DIRTY_LOOKBACK_SECONDS)
+    min_date = (now - timedelta(days=trailing_days)).strftime("%Y-%m-%d")
+    
+    watermark, retry = watermark_store.get(api_name)
+    if watermark:
+        since = datetime.fromisoformat(watermark) - timedelta(seconds=lookback)
+    else:
+        since = datetime.strptime(min_date, "%Y-%m-%d").replace(tzinfo=JST)
+        log.info(f"{api_name}: ウォーターマークがないため{min_date}以降の全データを対象にします")
+    
+    pairs = set(get_dirty_device_dates(since, min_date, log))
+    retry = {pair for pair in retry if pair[1] >= min_date}
+    if retry:
+        log.info(f"{api_name}: 前回失敗・繰り越しの{len(retry)}件を再実行対象に追加")
+    return sorted(pairs | retry, key=lambda pair: (pair[1], pair[0]))
+
+def get_api_limiter(api_name: str):
+    """
+    APIエンドポイントの適応的並列数リミッターを取得
+    concurrency: 初期並列数、max_concurrency: 上限（未指定時はconcurrencyの2倍）
+    """
+    config = API_CONFIGS[api_name]
+    concurrency = config.get('concurrency', DEFAULT_CONCURRENCY)
+    return get_limiter(api_name, concurrency, max_limit=config.get('max_concurrency', concurrency * 2))
+
+# エンドポイントのヘルスチェック（TCP接続）のタイムアウト（秒）
+HEALTH_PROBE_TIMEOUT = 3
+
+def get_endpoint_breaker(api_name: str):
+    """APIのエンドポイント（ホスト:ポート）のサーキットブレーカーを取得"""
+    return get_breaker(urlsplit(API_CONFIGS[api_name]['endpoint']).netloc)
+
+def check_endpoint(api_name: str, api_logger=None) -> bool:
+    """
+    未処理データを取得する前に、エンドポイントにリクエストを送れるか確認する
+    ブレーカーがopenの場合はFalse
+    half-open、またはこのプロセスでまだ結果を記録していない場合（CLI実行など）はTCP接続で確認し、
+    接続できなければブレーカーをopenにしてFalseを返す
+    """
+    log = api_logger or logger
+    breaker = get_endpoint_breaker(api_name)
+    state = breaker.current_state()
+    if state == OPEN:
+        snapshot = breaker.snapshot()
+        log.warning(f"{api_name}: {breaker.name} のサーキットブレーカーがopenのためスキップ"
+                    f"（{snapshot['retryInSeconds']}秒後に再試行, 直近の失敗: {snapshot['lastFailureReason']}）")
+        return False
+    if breaker.observed and state != HALF_OPEN:
+        return True
+    
+    parts = urlsplit(API_CONFIGS[api_name]['endpoint'])
+    try:
+        socket.create_connection((parts.hostname, parts.port or 80), timeout=HEALTH_PROBE_TIMEOUT).close()
+        return True
+    except OSError as e:
+        breaker.trip(f"health probe: {e}")
+        log.error(f"{api_name}: {breaker.name} に接続できないためスキップ（サーキットブレーカーをopen）: {e}")
+        return False
+
+async def request_endpoint(client: httpx.AsyncClient, api_name: str, method: str, **kwargs) -> httpx.Response:
+    """
+    APIエンドポイント呼び出し（一時的な失敗の再試行付き）
+    一時的な失敗は、実行ごとの再試行予算の範囲で指数バックオフ（ジッター付き）して再試行する
+    - 冪等なGET（timeblock-prompt・GETのデバイスベースAPI）: 接続エラー・接続タイムアウト・読み込みタイムアウト・5xx/429
+    - POST（api-gpt-v1・ファイルベースのバッチなど）: リクエストが届いていない接続エラー・接続タイムアウトと、
+      処理を受け付けずに返される429/503のみ（500/502/504・読み込みタイムアウトは下流で処理が続いている可能性があり、
+      再送すると処理が重複し、ChatGPT利用ステージでは予算に計上されない呼び出しになるため再試行しない）
+    再試行しきれなかった場合は最後のレスポンスを返すか、例外をそのまま送出する
+    """
+    log = logging.getLogger(f"scheduler.{api_name}")
+    budget = get_retry_budget(api_name)
+    retryable_errors = (httpx.ConnectError, httpx.ConnectTimeout)
+    retryable_statuses = NON_IDEMPOTENT_RETRY_STATUS_CODES
+    if method.upper() == 'GET':
+        retryable_errors += (httpx.ReadTimeout,)
+        retryable_statuses = TRANSIENT_STATUS_CODES
+    attempt = 0
+    while True:
+        try:
+            response = await request_endpoint_once(client, api_name, method, **kwargs)
+            if response.status_code not in retryable_statuses:
+                return response
+            failure = f"HTTP {response.status_code}"
+        except retryable_errors as e:
+            response = None
+            failure = type(e).__name__
+            error = e
         
-        if response.data:
-            # ユニークなdevice_idのリストを作成
-            device_ids = list(set([item['device_id'] for item in response.data if item.get('device_id')]))
-            log.info(f"日付 {process_date} で {len(device_ids)} 個のデバイスIDを取得")
-            return device_ids
+        if attempt >= MAX_REQUEST_RETRIES or not budget.try_spend():
+            if attempt:
+                log.warning(f"{api_name}: 再試行を打ち切り（{attempt}回再試行, 残り再試行予算: {budget.remaining}）: {failure}")
+            if response is not None:
+                return response
+            raise error
+        delay = backoff_delay(attempt)
+        attempt += 1
+        log.warning(f"{api_name}: 一時的な失敗（{failure}）- {delay:.1f}秒後に再試行 {attempt}/{MAX_REQUEST_RETRIES}")
+        await asyncio.sleep(delay)
+
+async def request_endpoint_once(client: httpx.AsyncClient, api_name: str, method: str, **kwargs) -> httpx.Response:
+    """
+    APIエンドポイント呼び出し1回分（サーキットブレーカー・適応的並列数制御付き）
+    ブレーカーがopenの場合はリクエストを送らずにCircuitOpenErrorを送出する
+    処理中リクエスト数とレイテンシを記録し、429/503・タイムアウト時は並列数を下げる
+    接続エラー・5xxはブレーカーの失敗として数える
+    """
+    config = API_CONFIGS[api_name]
+    breaker = get_endpoint_breaker(api_name)
+    if not breaker.allow_request():
+        raise CircuitOpenError(f"{breaker.name} のサーキットブレーカーがopenです")
+    # 接続と読み込みで別々のタイムアウトを使用
+    kwargs['timeout'] = http_timeout(kwargs.get('timeout', config.get('timeout', 300)))
+    limiter = get_api_limiter(api_name)
+    await limiter.acquire()
+    
+    started = time.monotonic()
+    latency = None
+    overloaded = False
+    reason = None
+    outcome = None
+    try:
+        with metrics.track_in_flight(api_name):
+            response = await client.request(method, config['endpoint'], extensions=request_extensions(), **kwargs)
+        latency = time.monotonic() - started
+        outcome = f"{response.status_code // 100}xx"
+        if response.status_code in OVERLOAD_STATUS_CODES:
+            overloaded = True
+            reason = f"HTTP {response.status_code}"
+        if response.status_code >= 500:
+            breaker.record_failure(f"HTTP {response.status_code}")
         else:
-            log.info(f"日付 {process_date} にはデータが存在しません")
-            return []
-            
+            breaker.record_success()
+        return response
+    except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+        overloaded = isinstance(e, httpx.TimeoutException)
+        reason = "connect timeout" if overloaded else None
+        outcome = type(e).__name__
+        breaker.record_failure(type(e).__name__)
+        raise
+    except httpx.TimeoutException as e:
+        overloaded = True
+        reason = "timeout"
+        outcome = type(e).__name__
+        breaker.record_neutral()
+        raise
+    except Exception as e:
+        outcome = type(e).__name__
+        breaker.record_neutral()
+        raise
+    finally:
+        metrics.observe_downstream(api_name, outcome, time.monotonic() - started)
+        await limiter.release(latency, overloaded, reason)
+
+def is_async_api(api_name: str) -> bool:
+    """完了を待たずにディスパッチするAPIかどうか（API_CONFIGSの async_completion）"""
+    return bool(API_CONFIGS[api_name].get('async_completion', False))
+
+def register_job(api_name: str, kind: str, payload: dict, deadline_seconds: int) -> dict:
+    """
+    ディスパッチジョブを登録し、リクエストに付けるjob_idとcallback_urlを返す
+    callback_urlにはジョブごとのトークンを付ける（完了通知の認証。トークンのない通知は受け付けない）
+    deadline_seconds以内に完了通知がなければexpiredになる
+    """
+    token = secrets.token_urlsafe(32)
+    job_id = job_store.create(api_name, kind, payload, deadline_seconds, token)
+    return {
+        "job_id": job_id,
+        "callback_url": f"{SCHEDULER_CALLBACK_URL}/api/scheduler/jobs/{job_id}/complete?token={token}"
+    }
+
+def wait_for_job_slot(api_name: str, deadline: float, api_logger=None) -> bool:
+    """
+    非同期APIの完了待ちジョブ数が max_outstanding_jobs 未満になるまで待つ
+    （待っている間も期限切れ・status_urlのポーリングで完了を確認する）
+    戻り値: 枠が空いた場合True、時間予算（deadline）に達した場合False
+    """
+    log = api_logger or logger
+    limit = API_CONFIGS[api_name].get('max_outstanding_jobs', MAX_OUTSTANDING_JOBS)
+    waiting = False
+    while True:
+        outstanding = job_store.count_outstanding(api_name)
+        if outstanding < limit:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        if not waiting:
+            log.info(f"{api_name}: 完了待ちジョブが{outstanding}件（上限 {limit}件）のため、完了まで次のバッチを取得しません")
+            waiting = True
+        time.sleep(JOB_SLOT_POLL_SECONDS)
+        poll_async_jobs(api_name, log)
+
+def complete_leased_files(api_name: str, file_paths: list, status: str, lease_owner: str,
+                          dispatched_at: str, api_logger=None) -> list:
+    """
+    非同期ジョブの完了通知でファイルステータスをcompleted/failedにする
+    送信時のリースをまだ持っている行（processingのまま、所有者が同じで、送信後に取得し直されていない）だけを更新する
+    （リース回収でpendingに戻った行・他のスケジューラーが取得し直した行は上書きしない。RPC: complete_leased_audio_files）
+    RPCが使えない場合はprocessingの行だけを条件付きで更新する（リースの所有者は確認できない）
+    戻り値: 更新したファイルのリスト
+    """
+    log = api_logger or logger
+    status_column = API_CONFIGS[api_name]['status_column']
+    supabase = get_supabase_client()
+    try:
+        response = supabase.rpc('complete_leased_audio_files', {
+            'p_status_column': status_column,
+            'p_file_paths': file_paths,
+            'p_lease_owner': lease_owner,
+            'p_dispatched_at': dispatched_at,
+            'p_status': status
+        }).execute()
+        updated = [row['file_path'] for row in response.data or []]
+    except Exception as e:
+        log.warning(f"{api_name}: 完了記録RPCエラーのためprocessingの行のみ条件付きで更新: {e}")
+        updated = []
+        for chunk in chunk_keys(file_paths):
+            response = supabase.table('audio_files') \
+                .update({status_column: status}) \
+                .in_('file_path', chunk) \
+                .eq(status_column, 'processing') \
+                .execute()
+            updated.extend(row['file_path'] for row in response.data or [])
+    
+    if len(updated) < len(file_paths):
+        log.warning(f"{api_name}: {len(file_paths) - len(updated)}件はリース回収・再取得済みのため'{status}'に更新しません")
+    log.info(f"{api_name}: {len(updated)}件のファイルステータスを'{status}'に更新完了")
+    return updated
+
+def finalize_job(job_id: str, status: str, message: str = None, result: dict = None, api_logger=None):
+    """
+    ジョブの完了結果を記録し、ステージごとの後処理を行う
+    （コールバック・ポーリング・同期完了レスポンスのいずれからも呼ばれる）
+    file_based: ファイルステータスをcompleted/failedに更新し、実際の処理時間をバッチ調整に記録
+    戻り値: 記録したジョブ（未登録・記録済みの場合はNone）
+    """
+    log = api_logger or logger
+    job = job_store.complete(job_id, status, message, result)
+    if job is None:
+        log.warning(f"ジョブ {job_id}: 完了待ちのジョブが見つからないため結果を破棄 (status: {status})")
+        return None
+
+    api_name = job['api_name']
+    payload = job['payload']
+    log.info(f"{api_name}: ジョブ {job_id} 完了通知 - {status} {message or ''}".rstrip())
+
+    if job['kind'] == 'file_based' and status in ('completed', 'failed'):
+        # 送信時のリースを持っている行だけを更新する（期限切れ後に届いた通知で再取得済みの行を上書きしない）
+        updated = complete_leased_files(api_name, payload['file_paths'], status,
+                                        payload.get('lease_owner', LEASE_OWNER), job['dispatched_at'], log)
+        if status == 'completed':
+            elapsed = (datetime.fromisoformat(job['completed_at']) - datetime.fromisoformat(job['dispatched_at'])).total_seconds()
+            batch_tuner.record(api_name, len(payload['file_paths']), elapsed, payload.get('audio_seconds'))
+        if updated:
+            publish_file_stage_completion(api_name, updated, log)
+    elif job['kind'] == 'timeblock_based' and status == 'completed':
+        pipeline.publish(api_name, [(payload['device_id'], payload['date'], payload['time_block'])])
+    return job
+
+def accept_async_response(api_name: str, job_id: str, response: httpx.Response, api_logger=None) -> bool:
+    """
+    非同期ジョブの受付レスポンスを処理
+    202: 受付済み（status_urlがあればポーリング用に記録し、完了通知を待つ）
+    200: 同期的に完了したのでその場で結果を記録
+    それ以外: 失敗として記録
+    """
+    log = api_logger or logger
+    if response.status_code == 202:
+        body = response.json() if response.content else {}
+        if body.get('status_url'):
+            job_store.set_status_url(job_id, body['status_url'])
+        log.info(f"{api_name}: ジョブ {job_id} 受付 - 完了通知を待たずに次へ進みます")
+        return True
+    if response.status_code == 200:
+        result = response.json()
+        finalize_job(job_id, 'completed', result.get('message', 'OK'), result, log)
+        return True
+    log.error(f"{api_name}: ジョブ {job_id} 受付失敗 - {response.status_code}: {response.text}")
+    finalize_job(job_id, 'failed', f"HTTP {response.status_code}", api_logger=log)
+    return False
+
+async def poll_job_status(client: httpx.AsyncClient, job: dict, api_logger=None):
+    """
+    下流APIのstatus_urlでジョブの状態を確認
+    戻り値: 完了していれば (status, message, レスポンス本文)、未完了・確認できない場合はNone
+    """
+    log = api_logger or logger
+    try:
+        response = await client.get(job['status_url'], timeout=http_timeout(STATUS_POLL_TIMEOUT))
+        if response.status_code != 200:
+            log.warning(f"{job['api_name']}: ジョブ {job['job_id']} のステータス確認失敗 - {response.status_code}")
+            return None
+        body = response.json()
+        if body.get('status') in ('completed', 'failed'):
+            return body['status'], body.get('message'), body
     except Exception as e:
-        log.error(f"デバイスID取得エラー: {e}")
-        # エラー時はフォールバック値を返す
-        log.warning(f"フォールバック: デフォルトデバイスIDを使用")
-        return [DEFAULT_DEVICE_ID]
+        log.warning(f"{job['api_name']}: ジョブ {job['job_id']} のステータス確認エラー: {e}")
+    return None
 
-def call_device_based_api(api_name: str, device_id: str, process_date: str, api_logger=None) -> bool:
-    """デバイスベースのAPI呼び出し（vibe-aggregator等）"""
+def poll_async_jobs(api_name: str, api_logger=None):
+    """
+    完了待ちジョブの後始末（非同期APIの実行開始時に呼ぶ）
+    期限切れのジョブをexpiredにし、status_urlのあるジョブはポーリングで結果を確認する
+    （file_basedの期限切れジョブのファイルはリース回収でpendingに戻る）
+    """
     log = api_logger or logger
+    try:
+        expired = job_store.expire_overdue(api_name)
+        if expired:
+            log.warning(f"{api_name}: 期限内に完了通知のなかった{expired}件のジョブをexpiredにしました")
+        jobs = job_store.pollable(api_name)
+    except Exception as e:
+        log.warning(f"{api_name}: 完了待ちジョブの確認エラー（スキップ）: {e}")
+        return
+    if not jobs:
+        return
+
+    log.info(f"{api_name}: 完了待ちジョブ{len(jobs)}件のステータスを確認")
+    client = get_http_client()
+
+    async def poll_all():
+        return await asyncio.gather(*(poll_job_status(client, job, log) for job in jobs))
+
+    # 結果の記録（Supabaseへの書き込み）はイベントループの外で行う
+    for job, outcome in zip(jobs, run_coroutine(poll_all())):
+        if outcome:
+            finalize_job(job['job_id'], *outcome, api_logger=log)
+
+def mark_unsent(unsent: list, item, requested: bool, error: Exception = None):
+    """
+    下流APIにリクエストが届かなかったアイテムを記録する（ChatGPT予算の計上を戻す対象）
+    requested: request_endpointを呼んだか。呼んだ場合も接続エラー・接続タイムアウト・サーキットブレーカーopenは届いていない
+    """
+    if unsent is None:
+        return
+    if not requested or isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, CircuitOpenError)):
+        unsent.append(item)
+
+async def call_device_based_api(client: httpx.AsyncClient, api_name: str, device_id: str, process_date: str,
+                                api_logger=None, unsent: list = None) -> bool:
+    """
+    デバイスベースのAPI呼び出し（vibe-aggregator等）
+    unsent: 指定した場合、リクエストが届かなかった (device_id, process_date) を追加する
+    """
+    log = api_logger or logger
+    job = None
+    pair = (device_id, process_date)
+    requested = False
     try:
         config = API_CONFIGS[api_name]
         
@@ -266,22 +1072,33 @@ def call_device_based_api(api_name: str, device_id: str, process_date: str, api_
         
         log.info(f"{api_name}: API呼び出し開始 (device: {device_id}, date: {process_date})")
         
+        # 非同期APIはjob_idとcallback_urlを付けて送り、受付だけを待つ
+        timeout = config.get('timeout', 300)
+        job = None
+        if is_async_api(api_name):
+            job = register_job(api_name, 'device_based', dict(request_data), timeout + LEASE_MARGIN_SECONDS)
+            request_data.update(job)
+            timeout = ASYNC_ACCEPT_TIMEOUT
+        
         # HTTPメソッドの選択（デフォルトはPOST）
         method = config.get('method', 'POST').upper()
         
+        requested = True
         if method == 'GET':
-            response = requests.get(
-                config['endpoint'],
+            response = await request_endpoint(
+                client, api_name, 'GET',
                 params=request_data,
-                timeout=config.get('timeout', 300)
+                timeout=timeout
             )
         else:
-            response = requests.post(
-                config['endpoint'],
+            response = await request_endpoint(
+                client, api_name, 'POST',
                 json=request_data,
-                timeout=config.get('timeout', 300)
+                timeout=timeout
             )
         
+        if job:
+            return accept_async_response(api_name, job['job_id'], response, log)
         if response.status_code == 200:
             result = response.json()
             log.info(f"{api_name}: API呼び出し成功 - {result.get('message', 'OK')}")
@@ -290,18 +1107,29 @@ def call_device_based_api(api_name: str, device_id: str, process_date: str, api_
             log.error(f"{api_name}: API呼び出し失敗 - {response.status_code}: {response.text}")
             return False
             
-    except requests.exceptions.Timeout:
-        log.warning(f"{api_name}: API呼び出しタイムアウト（バックグラウンド処理は継続中の可能性）")
-        return True
-    except requests.exceptions.ConnectionError as e:
+    except httpx.TimeoutException as e:
+        if job:
+            log.warning(f"{api_name}: ジョブ {job['job_id']} の受付確認タイムアウト（期限まで完了通知を待機）")
+            return True
+        # 完了を確認できないため失敗として扱い、次回に再実行する（async_completionのAPIは完了通知で確認する）
+        log.warning(f"{api_name}: API呼び出しタイムアウト（完了を確認できないため次回に再実行）")
+        mark_unsent(unsent, pair, requested, e)
+        return False
+    except httpx.ConnectError as e:
         log.error(f"{api_name}: API接続エラー - コンテナ名 '{config['endpoint']}' が解決できません。watchme-networkへの接続を確認してください。")
+        if job:
+            finalize_job(job['job_id'], 'failed', "接続エラー", api_logger=log)
+        mark_unsent(unsent, pair, requested, e)
         return False
     except Exception as e:
         log.error(f"{api_name}: API呼び出しエラー: {e}")
+        if job:
+            finalize_job(job['job_id'], 'failed', str(e), api_logger=log)
+        mark_unsent(unsent, pair, requested, e)
         return False
 
 def update_files_status(api_name: str, file_paths: list, status: str, api_logger=None) -> bool:
-    """ファイルのステータスを更新"""
+    """ファイルのステータスを一括更新（in_フィルタでまとめて更新し、失敗した行は個別に報告）"""
     log = api_logger or logger
     try:
         if api_name not in API_CONFIGS:
@@ -311,19 +1139,16 @@ def update_files_status(api_name: str, file_paths: list, status: str, api_logger
         if 'status_column' not in config:
             return True  # ステータス管理しないAPIの場合はスキップ
         
-        supabase = get_supabase_client()
-        
-        # ファイルパスごとにステータスを更新
+        # この呼び出しで積んだ行だけを書き込む（失敗件数はこの呼び出しのファイルのみ）
+        writer = StatusWriteBuffer(get_supabase_client, 'audio_files', ('file_path',), flush_at_exit=False)
         for file_path in file_paths:
-            try:
-                response = supabase.table('audio_files') \
-                    .update({config['status_column']: status}) \
-                    .eq('file_path', file_path) \
-                    .execute()
-                log.info(f"  - {file_path}: ステータスを'{status}'に更新")
-            except Exception as e:
-                log.error(f"  - {file_path}: ステータス更新エラー: {e}")
-                return False
+            writer.set({'file_path': file_path}, {config['status_column']: status})
+        
+        # バッチの区切りなのでここで書き込む
+        result = writer.flush(log)
+        if result['failed']:
+            log.error(f"{api_name}: {len(result['failed'])}/{len(file_paths)}件のファイルステータス更新に失敗")
+            return False
         
         log.info(f"{api_name}: {len(file_paths)}件のファイルステータスを'{status}'に更新完了")
         return True
@@ -332,20 +1157,68 @@ def update_files_status(api_name: str, file_paths: list, status: str, api_logger
         log.error(f"{api_name}: ステータス更新エラー: {e}")
         return False
 
-def call_api(api_name: str, file_paths: list, api_logger=None) -> bool:
-    """API呼び出し（ステータス管理付き）"""
+# 処理が終わっていないファイルステータス（パイプラインの上流が未完了とみなす）
+UNFINISHED_STATUSES = ('pending', 'processing')
+
+def publish_file_stage_completion(api_name: str, file_paths: list, api_logger=None):
+    """
+    ファイルベースステージの完了をパイプラインへ通知する
+    下流ステージの上流となるファイルベースステージが全て終わった (device_id, date, time_block) だけを通知する
+    （常駐エンジンが購読していない場合は何もしない）
+    """
+    log = api_logger or logger
+    if not pipeline.has_listeners() or not pipeline.dependents_of(api_name):
+        return
+    status_columns = sorted({
+        API_CONFIGS[upstream]['status_column']
+        for stage in pipeline.dependents_of(api_name)
+        for upstream in pipeline.upstream_of(stage)
+        if 'status_column' in API_CONFIGS.get(upstream, {})
+    })
+    try:
+        supabase = get_supabase_client()
+        rows = []
+        for chunk in chunk_keys(file_paths):
+            response = supabase.table('audio_files') \
+                .select(', '.join(['device_id', 'local_date', 'time_block', *status_columns])) \
+                .in_('file_path', chunk) \
+                .execute()
+            rows.extend(response.data or [])
+    except Exception as e:
+        log.warning(f"{api_name}: パイプライン通知用のステータス取得エラー（定期実行で回収）: {e}")
+        return
+
+    keys = [
+        (row['device_id'], row['local_date'], row['time_block'])
+        for row in rows
+        if row.get('local_date') and row.get('time_block')
+        and all(row.get(column) not in UNFINISHED_STATUSES for column in status_columns)
+    ]
+    if keys:
+        log.info(f"{api_name}: 上流ステージの処理が揃った{len(set(keys))}件のタイムブロックを下流ステージへ通知")
+        pipeline.publish(api_name, keys)
+
+def call_api(api_name: str, file_paths: list, api_logger=None, timeout: int = None, audio_seconds: float = None) -> bool:
+    """
+    API呼び出し（ステータス管理付き）
+    file_pathsはclaim_pending_filesで取得済み（processing）のファイル
+    timeout: リクエストタイムアウト（未指定の場合はAPI_CONFIGSのtimeout）
+    処理時間はバッチサイズ・タイムアウトの自動調整用に記録する
+    """
     log = api_logger or logger
     start_time = datetime.now()
+    job = None
     
     try:
         if api_name not in API_CONFIGS:
             raise ValueError(f"未対応のAPI: {api_name}")
         
         config = API_CONFIGS[api_name]
+        if timeout is None:
+            timeout = config.get('timeout', 300)
         
-        # 処理開始：ステータスをprocessingに更新
+        # 処理開始（ステータスは取得時にprocessingへ変更済み）
         log.info(f"{api_name}: 処理開始 - {len(file_paths)}件のファイル")
-        update_files_status(api_name, file_paths, 'processing', log)
         
         request_data = {
             "file_paths": file_paths
@@ -358,102 +1231,169 @@ def call_api(api_name: str, file_paths: list, api_logger=None) -> bool:
         log.info(f"{api_name}: API呼び出し開始")
         log.info(f"  エンドポイント: {config['endpoint']}")
         log.info(f"  ファイル数: {len(file_paths)}件")
-        log.info(f"  タイムアウト: {config.get('timeout', 300)}秒")
+        log.info(f"  タイムアウト: {timeout}秒")
+        
+        # 非同期APIはjob_idとcallback_urlを付けて送り、受付だけを待つ
+        # （ファイルはprocessingのまま完了通知を待ち、期限までに届かなければリース回収でpendingに戻る）
+        if is_async_api(api_name):
+            job = register_job(api_name, 'file_based',
+                               {"file_paths": file_paths, "audio_seconds": audio_seconds, "lease_owner": LEASE_OWNER},
+                               timeout + LEASE_MARGIN_SECONDS)
+            request_data.update(job)
         
-        response = requests.post(
-            config['endpoint'],
+        request_start = datetime.now()
+        count_items(api_name, "dispatched", len(file_paths))
+        response = run_coroutine(request_endpoint(
+            get_http_client(), api_name, 'POST',
             json=request_data,
-            timeout=config.get('timeout', 300)
-        )
+            timeout=ASYNC_ACCEPT_TIMEOUT if job else timeout
+        ))
         
         elapsed_time = (datetime.now() - start_time).total_seconds()
         
+        if job:
+            return accept_async_response(api_name, job['job_id'], response, log)
         if response.status_code == 200:
             result = response.json()
             log.info(f"{api_name}: API呼び出し成功 - {result.get('message', 'OK')} (処理時間: {elapsed_time:.2f}秒)")
-            # 成功時：ステータスをcompletedに更新
+            # 1ファイルあたりの処理時間の推定値を更新
+            batch_tuner.record(api_name, len(file_paths), (datetime.now() - request_start).total_seconds(), audio_seconds)
+            # 成功時：ステータスをcompletedに更新し、下流ステージへ通知
             update_files_status(api_name, file_paths, 'completed', log)
+            publish_file_stage_completion(api_name, file_paths, log)
             return True
         else:
             log.error(f"{api_name}: API呼び出し失敗 - {response.status_code}: {response.text} (処理時間: {elapsed_time:.2f}秒)")
-            # 失敗時：ステータスをfailedに更新
+            if response.status_code in TRANSIENT_STATUS_CODES:
+                # 一時的な失敗：試行回数を記録してpendingに戻す（上限に達したファイルはdead_letter）
+                record_failed_attempts(api_name, file_paths, f"HTTP {response.status_code}: {response.text}", log)
+                return False
+            # 失敗時：ステータスをfailedに更新（他の上流ステージが揃っていれば下流ステージは実行する）
             update_files_status(api_name, file_paths, 'failed', log)
+            publish_file_stage_completion(api_name, file_paths, log)
             return False
             
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         elapsed_time = (datetime.now() - start_time).total_seconds()
+        if job:
+            # 受付の応答が遅れただけで処理は始まっている可能性があるため、期限まで完了通知を待つ
+            log.warning(f"{api_name}: ジョブ {job['job_id']} の受付確認タイムアウト (処理時間: {elapsed_time:.2f}秒)")
+            return True
         log.warning(f"{api_name}: API呼び出しタイムアウト (処理時間: {elapsed_time:.2f}秒)")
         log.warning(f"  バックグラウンド処理は継続中の可能性があります")
-        # タイムアウトでも処理は継続されている可能性があるため成功扱い（既存の動作を維持）
-        return True
-    except requests.exceptions.ConnectionError as e:
+        # 実際の処理時間はタイムアウト以上なので、推定値を引き上げる
+        batch_tuner.record(api_name, len(file_paths), timeout, audio_seconds, lower_bound=True)
+        # ファイルはprocessingのまま残す（完了していなければリース回収で試行回数を数えてpendingまたはdead_letterに戻る）
+        return False
+    except httpx.ConnectError as e:
         elapsed_time = (datetime.now() - start_time).total_seconds()
         log.error(f"{api_name}: API接続エラー (処理時間: {elapsed_time:.2f}秒)")
         log.error(f"  コンテナ名 '{config['endpoint']}' が解決できません")
         log.error(f"  watchme-networkへの接続を確認してください")
+        if job:
+            job_store.complete(job['job_id'], 'failed', "接続エラー")
         # 接続エラー時：ステータスをpendingに戻す
         update_files_status(api_name, file_paths, 'pending', log)
         return False
+    except CircuitOpenError as e:
+        log.warning(f"{api_name}: {e} - 送信せずにpendingに戻します")
+        if job:
+            job_store.complete(job['job_id'], 'failed', str(e))
+        update_files_status(api_name, file_paths, 'pending', log)
+        return False
     except Exception as e:
         elapsed_time = (datetime.now() - start_time).total_seconds()
         log.error(f"{api_name}: API呼び出しエラー: {e} (処理時間: {elapsed_time:.2f}秒)")
+        if job:
+            job_store.complete(job['job_id'], 'failed', str(e))
         # その他のエラー時：ステータスをfailedに更新
         update_files_status(api_name, file_paths, 'failed', log)
         return False
 
-def get_pending_timeblocks(limit: int = 50, api_logger=None) -> list:
+def iter_pending_timeblock_pages(page_size: int = 50, api_logger=None):
+    """未処理タイムブロックをキーセットカーソルでページ単位に返すジェネレーター（バックログ全体を決まった順序で走査）"""
+    cursor = None
+    while True:
+        blocks, cursor = get_pending_timeblocks(page_size, cursor, api_logger)
+        if not blocks:
+            return
+        yield blocks
+
+def timeblock_keyset_after(date: str, time_block: str, device_id: str) -> str:
+    """(date, time_block, device_id) > カーソル のPostgRESTフィルタ（or_に渡す）"""
+    date, time_block, device_id = postgrest_quote(date), postgrest_quote(time_block), postgrest_quote(device_id)
+    return (f"date.gt.{date},"
+            f"and(date.eq.{date},time_block.gt.{time_block}),"
+            f"and(date.eq.{date},time_block.eq.{time_block},device_id.gt.{device_id})")
+
+def get_pending_timeblocks(limit: int = 50, after: tuple = None, api_logger=None):
     """
-    3つのテーブルから未処理（pending）のタイムブロックを検出
-    重複を除いてユニークなタイムブロックのリストを返す
+    3つのテーブルから未処理（pending）のタイムブロックを重複なしで検出
+    サーバー側のRPC（sql/get_pending_timeblocks.sql）で (date, time_block, device_id) 順に取得する
+    RPCが使えない場合は、テーブルごとに同じ順序・同じカーソルで取得してマージする
+    after: (date, time_block, device_id) のキーセットカーソル。これより後のタイムブロックだけを返す
+    戻り値: (タイムブロックのリスト, 次のカーソル。対象がなければNone)
     """
     log = api_logger or logger
     try:
         supabase = get_supabase_client()
-        
-        # 複数テーブルから未処理データを検出
-        pending_blocks = {}  # キーで重複を管理
-        tables = ['vibe_whisper', 'behavior_yamnet', 'emotion_opensmile']
-        
-        for table in tables:
+    except Exception as e:
+        log.error(f"未処理タイムブロック検出エラー: {e}")
+        return [], None
+    
+    try:
+        response = supabase.rpc('get_pending_timeblocks', {
+            'p_limit': limit,
+            'p_after_date': after[0] if after else None,
+            'p_after_time_block': after[1] if after else None,
+            'p_after_device_id': after[2] if after else None
+        }).execute()
+        blocks = response.data or []
+    except Exception as e:
+        log.warning(f"未処理タイムブロック取得RPCエラーのためテーブルごとに取得: {e}")
+        blocks = None
+    
+    if blocks is None:
+        # フォールバック：各テーブルから同じ順序でlimit件ずつ取得してマージ
+        # （各テーブルの先頭limit件をマージした先頭limit件は、全体の先頭limit件と一致する）
+        merged = set()
+        for table in API_CONFIGS['timeblock-prompt']['status_tables']:
             try:
-                response = supabase.table(table) \
+                query = supabase.table(table) \
                     .select('device_id, date, time_block') \
-                    .eq('status', 'pending') \
+                    .eq('status', 'pending')
+                if after:
+                    query = query.or_(timeblock_keyset_after(*after))
+                response = query \
                     .order('date', desc=False) \
                     .order('time_block', desc=False) \
+                    .order('device_id', desc=False) \
                     .limit(limit) \
                     .execute()
-                
-                if response.data:
-                    for item in response.data:
-                        # ユニークキーを生成
-                        block_key = f"{item['device_id']}_{item['date']}_{item['time_block']}"
-                        if block_key not in pending_blocks:
-                            pending_blocks[block_key] = {
-                                'device_id': item['device_id'],
-                                'date': item['date'],
-                                'time_block': item['time_block']
-                            }
-                    log.info(f"{table}: {len(response.data)}件の未処理データを検出")
+                merged.update((item['date'], item['time_block'], item['device_id']) for item in response.data or [])
+                log.info(f"{table}: {len(response.data or [])}件の未処理データを検出")
             except Exception as e:
-                log.warning(f"{table}テーブルからのデータ取得エラー: {e}")
-                continue
-        
-        # リストに変換して制限数まで返す
-        result = list(pending_blocks.values())[:limit]
-        log.info(f"timeblock-prompt: 合計{len(result)}件の未処理タイムブロックを検出")
-        return result
-        
-    except Exception as e:
-        log.error(f"未処理タイムブロック検出エラー: {e}")
-        return []
+                log.error(f"{table}テーブルからのデータ取得エラー: {e}")
+                return [], None
+        blocks = [
+            {'device_id': device_id, 'date': date, 'time_block': time_block}
+            for date, time_block, device_id in sorted(merged)[:limit]
+        ]
+    
+    if not blocks:
+        return [], None
+    last = blocks[-1]
+    log.info(f"timeblock-prompt: {len(blocks)}件の未処理タイムブロックを検出"
+             f"（{blocks[0]['date']} {blocks[0]['time_block']} 〜 {last['date']} {last['time_block']}）")
+    return blocks, (last['date'], last['time_block'], last['device_id'])
 
-def call_timeblock_api(device_id: str, date: str, time_block: str, api_logger=None) -> bool:
+async def call_timeblock_api(client: httpx.AsyncClient, device_id: str, date: str, time_block: str, api_logger=None) -> bool:
     """
     タイムブロック単位のAPI呼び出し
     GETメソッドでgenerate-timeblock-promptエンドポイントを呼び出す
     """
     log = api_logger or logger
+    job = None
     try:
         config = API_CONFIGS['timeblock-prompt']
         
@@ -466,12 +1406,21 @@ def call_timeblock_api(device_id: str, date: str, time_block: str, api_logger=No
         
         log.info(f"timeblock-prompt: API呼び出し開始 (device: {device_id}, date: {date}, block: {time_block})")
         
-        response = requests.get(
-            config['endpoint'],
+        # 非同期APIはjob_idとcallback_urlを付けて送り、受付だけを待つ
+        timeout = config.get('timeout', 120)
+        if is_async_api('timeblock-prompt'):
+            job = register_job('timeblock-prompt', 'timeblock_based', dict(params), timeout + LEASE_MARGIN_SECONDS)
+            params.update(job)
+            timeout = ASYNC_ACCEPT_TIMEOUT
+        
+        response = await request_endpoint(
+            client, 'timeblock-prompt', 'GET',
             params=params,
-            timeout=config.get('timeout', 120)
+            timeout=timeout
         )
         
+        if job:
+            return accept_async_response('timeblock-prompt', job['job_id'], response, log)
         if response.status_code == 200:
             result = response.json()
             # status_updatesフィールドをチェック
@@ -485,20 +1434,56 @@ def call_timeblock_api(device_id: str, date: str, time_block: str, api_logger=No
             log.error(f"timeblock-prompt: 処理失敗 - {response.status_code}: {response.text}")
             return False
             
-    except requests.exceptions.Timeout:
-        log.warning(f"timeblock-prompt: API呼び出しタイムアウト（処理は継続中の可能性）")
-        return True
-    except requests.exceptions.ConnectionError as e:
+    except httpx.TimeoutException:
+        if job:
+            log.warning(f"timeblock-prompt: ジョブ {job['job_id']} の受付確認タイムアウト（期限まで完了通知を待機）")
+            return True
+        # 完了を確認できないため失敗として扱う（pendingのまま次回に再実行される）
+        log.warning(f"timeblock-prompt: API呼び出しタイムアウト（完了を確認できないため次回に再実行）")
+        return False
+    except httpx.ConnectError as e:
         log.error(f"timeblock-prompt: API接続エラー - コンテナ名 '{config['endpoint']}' が解決できません。")
+        if job:
+            finalize_job(job['job_id'], 'failed', "接続エラー", api_logger=log)
         return False
     except Exception as e:
         log.error(f"timeblock-prompt: API呼び出しエラー: {e}")
+        if job:
+            finalize_job(job['job_id'], 'failed', str(e), api_logger=log)
         return False
 
-def get_pending_dashboard_items(limit: int = 50, api_logger=None) -> list:
+# dashboard未処理レコードの一覧で取得するカラム（プロンプト本文は処理直前に1件ずつ読み込む）
+DASHBOARD_KEY_COLUMNS = 'device_id, date, time_block'
+# prompt_chars / prompt_ascii_chars: プロンプトの文字数とそのうちのASCII文字数（sql/dashboard_prompt_chars.sql の計算カラム）
+DASHBOARD_LISTING_COLUMNS = f'{DASHBOARD_KEY_COLUMNS}, prompt_chars, prompt_ascii_chars'
+# 計算カラムが使えない場合に順に試すカラム（prompt_ascii_chars 追加前のデータベース、計算カラムなし）
+DASHBOARD_LISTING_FALLBACK_COLUMNS = (f'{DASHBOARD_KEY_COLUMNS}, prompt_chars', DASHBOARD_KEY_COLUMNS)
+
+def select_dashboard_listing(build_query, api_logger=None) -> list:
+    """
+    dashboardの一覧をキーとプロンプト文字数だけで取得
+    計算カラム（prompt_chars / prompt_ascii_chars）が使えない場合は使えるカラムだけ（最後はキーのみ）取得する
+    build_query: 取得カラムを受け取ってクエリを返す関数
+    """
+    log = api_logger or logger
+    try:
+        return build_query(DASHBOARD_LISTING_COLUMNS).execute().data or []
+    except Exception as e:
+        error = e
+    for columns in DASHBOARD_LISTING_FALLBACK_COLUMNS:
+        log.warning(f"dashboard: 計算カラムが使えないため {columns} のみ取得: {error}")
+        try:
+            return build_query(columns).execute().data or []
+        except Exception as e:
+            if columns == DASHBOARD_KEY_COLUMNS:
+                raise
+            error = e
+
+def get_pending_dashboard_items(limit: int = 50, newest_first: bool = False, api_logger=None) -> list:
     """
     dashboardテーブルから未処理（pending）のアイテムを取得
-    promptが存在し、statusがpendingのレコードを検出
+    promptが存在し、statusがpendingのレコードを検出（プロンプト本文は取得しない）
+    newest_first: 予算管理対象の場合、新しいタイムブロックから取得する
     """
     log = api_logger or logger
     try:
@@ -506,18 +1491,17 @@ def get_pending_dashboard_items(limit: int = 50, api_logger=None) -> list:
         
         # dashboardテーブルからpendingステータスのレコードを取得
         # promptが存在するもののみ対象
-        response = supabase.table('dashboard') \
-            .select('device_id, date, time_block, prompt') \
-            .eq('status', 'pending') \
-            .not_.is_('prompt', 'null') \
-            .order('date', desc=False) \
-            .order('time_block', desc=False) \
-            .limit(limit) \
-            .execute()
+        items = select_dashboard_listing(lambda columns: supabase.table('dashboard')
+                                         .select(columns)
+                                         .eq('status', 'pending')
+                                         .not_.is_('prompt', 'null')
+                                         .order('date', desc=newest_first)
+                                         .order('time_block', desc=newest_first)
+                                         .limit(limit), log)
         
-        if response.data:
-            log.info(f"dashboard: {len(response.data)}件の未処理レコードを検出")
-            return response.data
+        if items:
+            log.info(f"dashboard: {len(items)}件の未処理レコードを検出")
+            return items
         else:
             log.info(f"dashboard: 未処理レコードなし")
             return []
@@ -526,27 +1510,73 @@ def get_pending_dashboard_items(limit: int = 50, api_logger=None) -> list:
         log.error(f"dashboard未処理レコード取得エラー: {e}")
         return []
 
-def call_dashboard_analysis_api(item: dict, api_logger=None) -> bool:
+def get_dashboard_items_for_keys(keys: list, api_logger=None) -> list:
+    """
+    指定タイムブロック（device_id, date, time_block）のうち、dashboardテーブルで未処理（pending）のレコードを取得
+    上流ステージ（timeblock-prompt）の完了による連鎖実行で使用
+    """
+    log = api_logger or logger
+    try:
+        supabase = get_supabase_client()
+        filters = [f"and(device_id.eq.{postgrest_quote(device_id)},date.eq.{postgrest_quote(date)},"
+                   f"time_block.eq.{postgrest_quote(time_block)})"
+                   for device_id, date, time_block in keys]
+        items = []
+        for chunk in chunk_keys(filters):
+            items.extend(select_dashboard_listing(lambda columns: supabase.table('dashboard')
+                                                  .select(columns)
+                                                  .eq('status', 'pending')
+                                                  .not_.is_('prompt', 'null')
+                                                  .or_(','.join(chunk)), log))
+        log.info(f"dashboard: 通知された{len(keys)}件のうち{len(items)}件が未処理")
+        return items
+    except Exception as e:
+        log.error(f"dashboard未処理レコード取得エラー: {e}")
+        return []
+
+def load_dashboard_prompt(item: dict) -> str:
+    """処理直前に1件分のプロンプトを読み込む"""
+    response = get_supabase_client().table('dashboard') \
+        .select('prompt') \
+        .eq('device_id', item['device_id']) \
+        .eq('date', item['date']) \
+        .eq('time_block', item['time_block']) \
+        .limit(1) \
+        .execute()
+    rows = response.data or []
+    return rows[0].get('prompt') if rows else None
+
+async def call_dashboard_analysis_api(client: httpx.AsyncClient, item: dict, api_logger=None, unsent: list = None) -> bool:
     """
     dashboard分析APIを呼び出し、結果をdashboardテーブルに保存
     処理後にstatusをcompletedに更新
+    unsent: 指定した場合、リクエストが届かなかったアイテム（プロンプトなし・接続エラーなど）を追加する
     """
     log = api_logger or logger
+    requested = False
     try:
         config = API_CONFIGS['timeblock-analysis']
         
         # POSTリクエストでChatGPT分析を実行
         request_data = {
-            "prompt": item['prompt'],
             "device_id": item['device_id'],
             "date": item['date'],
             "time_block": item['time_block']
         }
+        if not config.get('server_side_prompt'):
+            # プロンプトは処理直前に読み込み、送信後は保持しない
+            prompt = await asyncio.to_thread(load_dashboard_prompt, item)
+            if not prompt:
+                log.warning(f"timeblock-analysis: プロンプトが見つからないためスキップ - {item['time_block']}")
+                mark_unsent(unsent, item, requested)
+                return False
+            request_data["prompt"] = prompt
         
         log.info(f"timeblock-analysis: API呼び出し開始 (device: {item['device_id']}, date: {item['date']}, block: {item['time_block']}）")
         
-        response = requests.post(
-            config['endpoint'],
+        requested = True
+        response = await request_endpoint(
+            client, 'timeblock-analysis', 'POST',
             json=request_data,
             timeout=config.get('timeout', 60)
         )
@@ -554,38 +1584,156 @@ def call_dashboard_analysis_api(item: dict, api_logger=None) -> bool:
         if response.status_code == 200:
             result = response.json()
             
-            # Supabaseでstatusをcompletedに更新
-            try:
-                supabase = get_supabase_client()
-                update_response = supabase.table('dashboard') \
-                    .update({'status': 'completed', 'processed_at': datetime.now(JST).isoformat()}) \
-                    .eq('device_id', item['device_id']) \
-                    .eq('date', item['date']) \
-                    .eq('time_block', item['time_block']) \
-                    .execute()
-                
-                log.info(f"timeblock-analysis: 処理成功 - {item['time_block']} (vibe_score: {result.get('vibe_score', 'N/A')})")
-                return True
-            except Exception as e:
-                log.error(f"timeblock-analysis: ステータス更新エラー - {e}")
-                return False
+            # statusのcompleted更新はバッファに積み、バッチ終了時にまとめて書き込む
+            dashboard_status_writer.set(item, {'status': 'completed'})
+            log.info(f"timeblock-analysis: 処理成功 - {item['time_block']} (vibe_score: {result.get('vibe_score', 'N/A')})")
+            return True
         else:
             log.error(f"timeblock-analysis: API呼び出し失敗 - {response.status_code}: {response.text}")
             return False
             
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException as e:
         log.warning(f"timeblock-analysis: API呼び出しタイムアウト")
+        mark_unsent(unsent, item, requested, e)
         return False
-    except requests.exceptions.ConnectionError as e:
+    except httpx.ConnectError as e:
         log.error(f"timeblock-analysis: API接続エラー - コンテナ名が解決できません。")
+        mark_unsent(unsent, item, requested, e)
         return False
     except Exception as e:
         log.error(f"timeblock-analysis: API呼び出しエラー: {e}")
+        mark_unsent(unsent, item, requested, e)
+        return False
+
+def dispatch_items(api_name: str, items: list, handler, order_key=None, api_logger=None) -> DispatchResult:
+    """
+    共通ディスパッチエンジンでアイテムを並列処理する
+    handler: async def handler(client, idx, item) -> bool
+    order_key: 同じキーのアイテムは順番に処理（例: 同一デバイスのタイムブロック）
+    """
+    log = api_logger or logger
+    # ワーカー数は上限値とし、実際の同時リクエスト数は適応的リミッターが制御する
+    limiter = get_api_limiter(api_name)
+    concurrency = limiter.max_limit
+    log.info(f"{api_name}: 並列数 {limiter.current_limit}（上限 {concurrency}）で {len(items)}件を処理")
+    
+    count_items(api_name, "fetched", len(items))
+    
+    async def counted_handler(idx, item):
+        count_items(api_name, "dispatched")
+        return await handler(client, idx, item)
+    
+    # プロセス共通のHTTPクライアント（keep-aliveで接続を再利用）
+    client = get_http_client()
+    result = run_coroutine(dispatch(
+        items,
+        counted_handler,
+        concurrency=concurrency,
+        order_key=order_key,
+        api_logger=log
+    ))
+    count_items(api_name, "succeeded", result.success_count)
+    count_items(api_name, "failed", result.failed_count)
+    return result
+
+def run_file_based_drain(api_name: str, api_logger=None, max_batches: int = None) -> bool:
+    """
+    ファイルベースAPIのドレインモード
+    キーセットページングで未処理ファイルをバッチ単位で取得し、キューが空になるか
+    時間予算（drain_time_budget）・最大バッチ数に達するまで連続して処理する
+    全バッチ失敗の場合はFalseを返す
+    """
+    log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    time_budget = config.get('drain_time_budget', DRAIN_TIME_BUDGET)
+    deadline = time.monotonic() + time_budget
+    
+    file_count = 0
+    success_batches = 0
+    failed_batches = 0
+    consecutive_failures = 0
+    stop_reason = "未処理ファイルなし"
+    
+    # リース期限切れでprocessingのまま残ったファイルを先に回収
+    reclaimed = reap_expired_leases(api_name, log)
+    reclaimed_note = f", リース回収: {reclaimed}件" if reclaimed else ""
+    
+    async_api = is_async_api(api_name)
+    pending_batches = iter_pending_files(api_name, api_logger=log)
+    try:
+        while True:
+            # 非同期APIは完了待ちジョブ数が上限未満の間だけ次のバッチを取得する
+            if async_api and not wait_for_job_slot(api_name, deadline, log):
+                stop_reason = f"時間予算（{time_budget}秒）内に完了待ちジョブが減らなかったため残りは次回に繰り越し"
+                log.info(f"{api_name}: {stop_reason}")
+                break
+            batch = next(pending_batches, None)
+            if batch is None:
+                break
+            file_count += len(batch['file_paths'])
+            count_items(api_name, "fetched", len(batch['file_paths']))
+            if call_api(api_name, batch['file_paths'], log,
+                        timeout=batch['timeout'], audio_seconds=batch['audio_seconds']):
+                success_batches += 1
+                consecutive_failures = 0
+                count_items(api_name, "succeeded", len(batch['file_paths']))
+            else:
+                failed_batches += 1
+                consecutive_failures += 1
+                count_items(api_name, "failed", len(batch['file_paths']))
+            
+            if max_batches is not None and success_batches + failed_batches >= max_batches:
+                stop_reason = f"最大バッチ数（{max_batches}）に達したため残りは次回に繰り越し"
+                break
+            if consecutive_failures >= MAX_CONSECUTIVE_FAILED_BATCHES:
+                stop_reason = f"{consecutive_failures}バッチ連続で失敗したため中断"
+                log.error(f"{api_name}: {stop_reason}")
+                break
+            if consecutive_failures and get_endpoint_breaker(api_name).current_state() == OPEN:
+                # これ以上ファイルをprocessingにしない
+                stop_reason = "サーキットブレーカーがopenになったため中断"
+                log.error(f"{api_name}: {stop_reason}")
+                break
+            if time.monotonic() >= deadline:
+                stop_reason = f"時間予算（{time_budget}秒）に達したため残りは次回に繰り越し"
+                log.info(f"{api_name}: {stop_reason}")
+                break
+    finally:
+        # 打ち切り時に取得済みの残りをpendingに戻す
+        pending_batches.close()
+    
+    batch_count = success_batches + failed_batches
+    if batch_count == 0:
+        log_execution(api_name, 0, "SUCCESS", f"未処理ファイルなし{reclaimed_note}", log)
+        return True
+    
+    log.info(f"=== ドレイン処理完了: {batch_count}バッチ, {file_count}件 ({stop_reason}{reclaimed_note}) ===")
+    if failed_batches == 0:
+        log_execution(api_name, file_count, "SUCCESS", f"処理完了 ({batch_count}バッチ{reclaimed_note})", log)
+    elif success_batches > 0:
+        log_execution(api_name, file_count, "PARTIAL",
+                      f"一部成功 (成功: {success_batches}バッチ, 失敗: {failed_batches}バッチ{reclaimed_note})", log)
+    else:
+        log_execution(api_name, file_count, "ERROR", f"処理失敗 ({failed_batches}バッチ{reclaimed_note})", log)
         return False
+    return True
+
+# 実行履歴（SQLite。スケジューラーAPIの状況取得で集計する）
+run_history = RunHistory()
+# 実行中の結果（log_executionで記録し、実行終了時に実行履歴・メトリクスへ書き込む。同じAPIの実行は重ならない）
+last_run_status = {}
+run_item_counts = {}
+
+def count_items(api_name: str, stage: str, count: int = 1):
+    """取得・送信・成功・失敗した件数を実行履歴用に数え、メトリクスにも記録する"""
+    counts = run_item_counts.setdefault(api_name, {})
+    counts[stage] = counts.get(stage, 0) + count
+    metrics.record_items(api_name, stage, count)
 
 def log_execution(api_name: str, file_count: int, status: str, message: str = "", api_logger=None):
     """実行ログ記録"""
     log = api_logger or logger
+    last_run_status[api_name] = {"status": status, "item_count": file_count, "message": message}
     timestamp = datetime.now().isoformat()
     log_entry = f"[{timestamp}] {status}: {api_name} - {file_count}件処理 {message}"
     
@@ -594,22 +1742,78 @@ def log_execution(api_name: str, file_count: int, status: str, message: str = ""
     else:
         log.error(log_entry)
 
-def main():
-    """メイン処理"""
-    if len(sys.argv) < 2:
-        logger.error("使用方法: python run-api-process.py <api_name>")
-        sys.exit(1)
-    
-    api_name = sys.argv[1]
-    
+def count_pending_backlog(api_name: str, api_logger=None):
+    """
+    未処理件数（メトリクスの scheduler_pending_backlog 用）
+    device_basedは再実行待ちの (device_id, date) の件数。取得できない場合はNone
+    """
+    log = api_logger or logger
+    config = API_CONFIGS[api_name]
+    api_type = config.get('type', 'file_based')
+    try:
+        if api_type == 'device_based':
+            return len(watermark_store.get(api_name)[1])
+        supabase = get_supabase_client()
+        if api_type == 'timeblock_based':
+            query = supabase.table('pending_timeblocks').select('device_id', count='exact')
+        elif api_type == 'dashboard_based':
+            query = supabase.table('dashboard').select('device_id', count='exact') \
+                .eq('status', 'pending').not_.is_('prompt', 'null')
+        else:
+            query = supabase.table('audio_files').select('file_path', count='exact') \
+                .eq(config['status_column'], 'pending')
+        return query.limit(1).execute().count
+    except Exception as e:
+        log.warning(f"{api_name}: 未処理件数の取得エラー（メトリクス更新をスキップ）: {e}")
+        return None
+
+def run_api(api_name: str, keys: list = None, mode: str = None) -> bool:
+    """
+    指定APIの自動処理を1回実行する
+    CLI（main）と常駐スケジューラーエンジンの両方から呼び出される
+    keys: 上流ステージの完了による連鎖実行の対象 [(device_id, date, time_block), ...]
+          （timeblock_based / dashboard_based のみ。未指定の場合は未処理データを検出して処理）
+    mode: 起動方法（scheduled / chained / change_feed / manual / cli）。実行履歴に記録する
+    全件失敗・予期しないエラーの場合はFalseを返す
+    実行結果は実行履歴に、実行回数・実行時間・終了時点の未処理件数はメトリクスに記録する
+    """
+    started = time.monotonic()
+    last_run_status.pop(api_name, None)
+    run_item_counts.pop(api_name, None)
+    try:
+        run_id = run_history.start(api_name, mode or ("chained" if keys else "scheduled"))
+    except Exception as e:
+        logger.warning(f"{api_name}: 実行履歴の記録エラー: {e}")
+        run_id = None
+    success = False
+    try:
+        success = execute_api(api_name, keys)
+        return success
+    finally:
+        summary = last_run_status.pop(api_name, None) or {}
+        status = summary.get("status") or ("SUCCESS" if success else "ERROR")
+        metrics.record_run(api_name, status, time.monotonic() - started)
+        if run_id is not None:
+            try:
+                run_history.finish(run_id, status, summary.get("item_count", 0), run_item_counts.pop(api_name, {}),
+                                   summary.get("message"), summary.get("message") if status == "ERROR" else None)
+            except Exception as e:
+                logger.warning(f"{api_name}: 実行履歴の記録エラー: {e}")
+        if api_name in API_CONFIGS and metrics.is_available():
+            metrics.set_pending_backlog(api_name, count_pending_backlog(api_name, logging.getLogger(f"scheduler.{api_name}")))
+
+def execute_api(api_name: str, keys: list = None) -> bool:
+    """run_apiの本体（引数・戻り値はrun_apiと同じ）"""
     # API専用のロガーを取得
     api_logger = get_logger(api_name)
+    # コネクション再利用統計（実行終了時に差分をログ出力）
+    stats_before = connection_stats.snapshot()
     
     try:
         # 設定チェック
         if api_name not in API_CONFIGS:
             log_execution(api_name, 0, "ERROR", f"未対応のAPI: {api_name}", api_logger)
-            sys.exit(1)
+            return False
         
         config = API_CONFIGS[api_name]
         display_name = config.get('display_name', api_name)
@@ -620,64 +1824,97 @@ def main():
         api_logger.info(f"実行時刻: {jst_now.strftime('%Y-%m-%d %H:%M:%S JST')}")
         
         api_type = config.get('type', 'file_based')
+        # 一時的な失敗の再試行回数の上限（この実行全体で共有）
+        reset_retry_budget(api_name, config.get('retry_budget', DEFAULT_RUN_RETRY_BUDGET))
+        
+        # 非同期APIは前回までに送ったジョブの完了状況を先に確認する
+        if is_async_api(api_name):
+            poll_async_jobs(api_name, api_logger)
+        
+        # エンドポイントが停止中の場合は未処理データを取得しない（processingへの変更や全デバイスへの呼び出しをしない）
+        if not check_endpoint(api_name, api_logger):
+            log_execution(api_name, 0, "ERROR", "エンドポイント停止中のためスキップ（サーキットブレーカー open）", api_logger)
+            return False
         
         if api_type == 'timeblock_based':
             # タイムブロックベースの処理（未処理データ自動検出）
             api_logger.info("=== タイムブロック未処理データ検出処理 ===")
             
-            # 固定値を使用（config.json不要）
+            # 1ページあたりの件数（固定値を使用、config.json不要）
             batch_limit = 50  # デフォルト値
             
-            # 未処理タイムブロックを取得
-            pending_blocks = get_pending_timeblocks(limit=batch_limit, api_logger=api_logger)
-            
-            if not pending_blocks:
-                api_logger.info("未処理タイムブロックなし")
-                log_execution(api_name, 0, "SUCCESS", "未処理データなし", api_logger)
-                return
-            
-            api_logger.info(f"処理対象: {len(pending_blocks)} タイムブロック")
+            if keys:
+                # 上流ステージの完了による連鎖実行：通知されたタイムブロックのみ処理
+                pages = [[{'device_id': d, 'date': dt, 'time_block': tb} for d, dt, tb in keys]]
+                api_logger.info(f"連鎖実行: 上流ステージの完了した{len(keys)}件のタイムブロック")
+            else:
+                # 未処理タイムブロックを (date, time_block, device_id) 順にページ単位で最後まで処理
+                pages = iter_pending_timeblock_pages(batch_limit, api_logger)
             
-            # 各タイムブロックを順次処理
+            deadline = time.monotonic() + config.get('drain_time_budget', DRAIN_TIME_BUDGET)
+            total_count = 0
             success_count = 0
             failed_count = 0
+            stop_note = ""
             
-            for idx, block in enumerate(pending_blocks, 1):
-                api_logger.info(f"")
-                api_logger.info(f"--- 処理中 {idx}/{len(pending_blocks)}: {block['device_id']}/{block['date']}/{block['time_block']} ---")
+            for page_number, pending_blocks in enumerate(pages, 1):
+                total_count += len(pending_blocks)
+                api_logger.info(f"処理対象: {len(pending_blocks)} タイムブロック（ページ{page_number}）")
                 
-                success = call_timeblock_api(
-                    block['device_id'],
-                    block['date'], 
-                    block['time_block'],
-                    api_logger
-                )
+                # 各タイムブロックを並列処理（同一デバイスのタイムブロックは順番に処理）
+                async def process_block(client, idx, block, pending_blocks=pending_blocks):
+                    api_logger.info(f"--- 処理中 {idx}/{len(pending_blocks)}: {block['device_id']}/{block['date']}/{block['time_block']} ---")
+                    
+                    success = await call_timeblock_api(
+                        client,
+                        block['device_id'],
+                        block['date'], 
+                        block['time_block'],
+                        api_logger
+                    )
+                    
+                    if success:
+                        api_logger.info(f"✅ タイムブロック {block['time_block']} の処理完了")
+                        # 非同期APIは完了通知（finalize_job）で下流ステージへ通知する
+                        if not is_async_api(api_name):
+                            pipeline.publish(api_name, [(block['device_id'], block['date'], block['time_block'])])
+                    else:
+                        api_logger.error(f"❌ タイムブロック {block['time_block']} の処理失敗")
+                    return success
                 
-                if success:
-                    success_count += 1
-                    api_logger.info(f"✅ タイムブロック {block['time_block']} の処理完了")
-                else:
-                    failed_count += 1
-                    api_logger.error(f"❌ タイムブロック {block['time_block']} の処理失敗")
+                result = dispatch_items(api_name, pending_blocks, process_block,
+                                        order_key=lambda block: block['device_id'], api_logger=api_logger)
+                success_count += result.success_count
+                failed_count += result.failed_count
+                
+                if time.monotonic() >= deadline:
+                    stop_note = "、時間予算に達したため残りは次回に繰り越し"
+                    api_logger.warning(f"{api_name}: 時間予算に達したため残りのタイムブロックは次回に繰り越します")
+                    break
+            
+            if total_count == 0:
+                api_logger.info("未処理タイムブロックなし")
+                log_execution(api_name, 0, "SUCCESS", "未処理データなし", api_logger)
+                return True
             
             # 全体の処理結果をログ出力
             api_logger.info(f"")
             api_logger.info(f"=== タイムブロック処理完了 ===")
-            api_logger.info(f"成功: {success_count}/{len(pending_blocks)} タイムブロック")
+            api_logger.info(f"成功: {success_count}/{total_count} タイムブロック")
             if failed_count > 0:
-                api_logger.warning(f"失敗: {failed_count}/{len(pending_blocks)} タイムブロック")
+                api_logger.warning(f"失敗: {failed_count}/{total_count} タイムブロック")
             
             # 実行ログ記録
             if failed_count == 0:
-                log_execution(api_name, len(pending_blocks), "SUCCESS", 
-                            f"全タイムブロック処理完了 ({success_count}件)", api_logger)
+                log_execution(api_name, total_count, "SUCCESS", 
+                            f"全タイムブロック処理完了 ({success_count}件{stop_note})", api_logger)
             elif success_count > 0:
-                log_execution(api_name, len(pending_blocks), "PARTIAL", 
-                            f"一部成功 (成功: {success_count}, 失敗: {failed_count})", api_logger)
+                log_execution(api_name, total_count, "PARTIAL", 
+                            f"一部成功 (成功: {success_count}, 失敗: {failed_count}{stop_note})", api_logger)
             else:
-                log_execution(api_name, len(pending_blocks), "ERROR", 
+                log_execution(api_name, total_count, "ERROR", 
                             f"全タイムブロック処理失敗 ({failed_count}件)", api_logger)
-                sys.exit(1)
+                return False
                 
         elif api_type == 'dashboard_based':
             # dashboardベースの処理（pendingステータスを処理）
@@ -686,32 +1923,71 @@ def main():
             # 固定値を使用（config.json不要）
             batch_limit = 50  # デフォルト値
             
-            # 未処理レコードを取得
-            pending_items = get_pending_dashboard_items(limit=batch_limit, api_logger=api_logger)
+            if keys:
+                # 上流ステージの完了による連鎖実行：通知されたタイムブロックのpendingレコードのみ処理
+                pending_items = get_dashboard_items_for_keys(keys, api_logger=api_logger)
+            else:
+                # 未処理レコードを取得
+                pending_items = get_pending_dashboard_items(limit=batch_limit, newest_first=config.get('gpt_budget', False),
+                                                            api_logger=api_logger)
             
             if not pending_items:
                 api_logger.info("未処理レコードなし")
                 log_execution(api_name, 0, "SUCCESS", "未処理データなし", api_logger)
-                return
+                return True
+            
+            # 一覧ではプロンプト本文を取得しないため、文字数（うちASCII文字数）からトークン数を概算する
+            estimate_item = lambda item: (
+                estimate_tokens(item['prompt_chars'], item.get('prompt_ascii_chars'))
+                if item.get('prompt_chars') else config.get('estimated_prompt_tokens', 0)
+            )
+            admitted_at = datetime.now(JST)
+            if config.get('gpt_budget'):
+                # 予算内のレコードのみ処理（新しいタイムブロック優先）、残りはpendingのまま次の枠へ
+                block_key = lambda item: (item['date'], item['time_block'])
+                admitted, deferred = budget_governor.admit(
+                    api_name, pending_items,
+                    estimate=estimate_item,
+                    freshness_key=block_key,
+                    api_logger=api_logger
+                )
+                if not admitted:
+                    log_execution(api_name, 0, "SUCCESS", f"予算上限のため次の枠へ繰り越し ({len(deferred)}件)", api_logger)
+                    return True
+                # デバイス内の処理順は従来通り古い順
+                pending_items = sorted(admitted, key=block_key)
             
             api_logger.info(f"処理対象: {len(pending_items)} レコード")
             
-            # 各レコードを順次処理
-            success_count = 0
-            failed_count = 0
+            # 各レコードを並列処理（同一デバイスのタイムブロックは順番に処理）
+            unsent_items = []
             
-            for idx, item in enumerate(pending_items, 1):
-                api_logger.info(f"")
+            async def process_item(client, idx, item):
                 api_logger.info(f"--- 処理中 {idx}/{len(pending_items)}: {item['device_id']}/{item['date']}/{item['time_block']} ---")
                 
-                success = call_dashboard_analysis_api(item, api_logger)
+                success = await call_dashboard_analysis_api(client, item, api_logger, unsent=unsent_items)
                 
                 if success:
-                    success_count += 1
                     api_logger.info(f"✅ タイムブロック {item['time_block']} の分析完了")
                 else:
-                    failed_count += 1
                     api_logger.error(f"❌ タイムブロック {item['time_block']} の分析失敗")
+                return success
+            
+            result = dispatch_items(api_name, pending_items, process_item,
+                                    order_key=lambda item: item['device_id'], api_logger=api_logger)
+            success_count = result.success_count
+            failed_count = result.failed_count
+            
+            # 送信しなかったレコードの予算を戻す
+            if config.get('gpt_budget') and unsent_items:
+                budget_governor.refund(api_name, len(unsent_items),
+                                       sum(estimate_item(item) for item in unsent_items), admitted_at, api_logger)
+            
+            # バッチ終了：completedステータスを一括更新（更新に失敗したレコードは失敗として数える）
+            write_result = dashboard_status_writer.flush(api_logger)
+            if write_result['failed']:
+                success_count -= len(write_result['failed'])
+                failed_count += len(write_result['failed'])
             
             # 全体の処理結果をログ出力
             api_logger.info(f"")
@@ -730,90 +2006,118 @@ def main():
             else:
                 log_execution(api_name, len(pending_items), "ERROR", 
                             f"全レコード分析失敗 ({failed_count}件)", api_logger)
-                sys.exit(1)
+                return False
                 
         elif api_type == 'device_based':
-            # デバイスベースのAPI処理（全デバイス対応）
-            # 固定値を使用（config.json不要）
-            process_date = 'today'  # 常に今日の日付を使用
-            
-            # process_dateが"today"の場合はJSTでの今日の日付に変換
-            if process_date == "today":
-                jst_now = datetime.now(JST)
-                process_date = jst_now.strftime("%Y-%m-%d")
+            # デバイスベースのAPI処理（差分処理）
+            # 前回の実行以降に上流データが変化した (device_id, date) のみ処理する（遅延アップロードの前日分も含む）
+            run_started = datetime.now(JST)
+            api_logger.info(f"=== 差分デバイス処理開始 ===")
             
-            api_logger.info(f"=== 全デバイス処理開始: date={process_date} ===")
+            pairs = plan_dirty_device_dates(api_name, run_started, api_logger)
             
-            # 指定日付の全デバイスIDを取得
-            device_ids = get_all_device_ids_for_date(process_date, api_logger)
+            if not pairs:
+                api_logger.info("前回の実行以降に変更のあるデバイスはありません")
+                watermark_store.advance(api_name, run_started.isoformat(), [])
+                log_execution(api_name, 0, "SUCCESS", "処理対象デバイスなし (変更なし)", api_logger)
+                return True
             
-            if not device_ids:
-                api_logger.warning(f"日付 {process_date} にはデータが存在するデバイスがありません")
-                log_execution(api_name, 0, "SUCCESS", f"処理対象デバイスなし (date: {process_date})", api_logger)
-                return
+            deferred = []
+            admitted_at = datetime.now(JST)
+            if config.get('gpt_budget'):
+                # 予算内の組み合わせのみ処理（新しい日付優先）、残りは次の枠へ繰り越し
+                pairs, deferred = budget_governor.admit(
+                    api_name, pairs,
+                    estimate=lambda pair: config.get('estimated_prompt_tokens', 0),
+                    freshness_key=lambda pair: pair[1],
+                    api_logger=api_logger
+                )
+                if not pairs:
+                    watermark_store.advance(api_name, run_started.isoformat(), deferred)
+                    log_execution(api_name, 0, "SUCCESS", f"予算上限のため次の枠へ繰り越し ({len(deferred)}件)", api_logger)
+                    return True
+                pairs = sorted(pairs, key=lambda pair: (pair[1], pair[0]))
             
-            api_logger.info(f"処理対象デバイス数: {len(device_ids)}")
-            api_logger.info(f"デバイスID一覧: {device_ids}")
+            dates = sorted({pair[1] for pair in pairs})
+            api_logger.info(f"処理対象: {len(pairs)}件のデバイス・日付 (日付: {', '.join(dates)})")
             
-            # 各デバイスを順次処理
-            success_count = 0
-            failed_count = 0
+            # 各 (device_id, date) を並列処理（同一デバイスは日付順に処理）
+            failed_pairs = []
+            unsent_pairs = []
             
-            for idx, device_id in enumerate(device_ids, 1):
-                api_logger.info(f"")
-                api_logger.info(f"--- デバイス {idx}/{len(device_ids)}: {device_id} ---")
+            async def process_device(client, idx, pair):
+                device_id, process_date = pair
+                api_logger.info(f"--- {idx}/{len(pairs)}: {device_id} (date: {process_date}) ---")
                 
                 # API実行
-                success = call_device_based_api(api_name, device_id, process_date, api_logger)
+                success = await call_device_based_api(client, api_name, device_id, process_date, api_logger,
+                                                      unsent=unsent_pairs)
                 
                 if success:
-                    success_count += 1
-                    api_logger.info(f"✅ デバイス {device_id} の処理完了")
+                    api_logger.info(f"✅ デバイス {device_id} ({process_date}) の処理完了")
                 else:
-                    failed_count += 1
-                    api_logger.error(f"❌ デバイス {device_id} の処理失敗")
+                    api_logger.error(f"❌ デバイス {device_id} ({process_date}) の処理失敗")
+                    failed_pairs.append(pair)
+                return success
+            
+            result = dispatch_items(api_name, pairs, process_device,
+                                    order_key=lambda pair: pair[0], api_logger=api_logger)
+            success_count = result.success_count
+            failed_count = result.failed_count
+            
+            # 送信しなかった組み合わせの予算を戻す（プロンプトはAPI側で生成するため推定値は固定）
+            if config.get('gpt_budget') and unsent_pairs:
+                budget_governor.refund(api_name, len(unsent_pairs),
+                                       len(unsent_pairs) * config.get('estimated_prompt_tokens', 0), admitted_at, api_logger)
+            
+            # ウォーターマークを実行開始時刻まで進める（失敗・繰り越し分は次回に再実行）
+            watermark_store.advance(api_name, run_started.isoformat(), failed_pairs + deferred)
             
             # 全体の処理結果をログ出力
             api_logger.info(f"")
-            api_logger.info(f"=== 全デバイス処理完了 ===")
-            api_logger.info(f"成功: {success_count}/{len(device_ids)} デバイス")
+            api_logger.info(f"=== 差分デバイス処理完了 ===")
+            api_logger.info(f"成功: {success_count}/{len(pairs)} 件")
             if failed_count > 0:
-                api_logger.warning(f"失敗: {failed_count}/{len(device_ids)} デバイス")
+                api_logger.warning(f"失敗: {failed_count}/{len(pairs)} 件（次回に再実行）")
             
             # 実行ログ記録
             if failed_count == 0:
-                log_execution(api_name, len(device_ids), "SUCCESS", 
-                            f"全デバイス処理完了 ({success_count}デバイス, date: {process_date})", api_logger)
+                log_execution(api_name, len(pairs), "SUCCESS", 
+                            f"変更のあるデバイス処理完了 ({success_count}件, date: {', '.join(dates)})", api_logger)
             elif success_count > 0:
-                log_execution(api_name, len(device_ids), "PARTIAL", 
-                            f"一部成功 (成功: {success_count}, 失敗: {failed_count}, date: {process_date})", api_logger)
+                log_execution(api_name, len(pairs), "PARTIAL", 
+                            f"一部成功 (成功: {success_count}, 失敗: {failed_count}, date: {', '.join(dates)})", api_logger)
             else:
-                log_execution(api_name, len(device_ids), "ERROR", 
-                            f"全デバイス処理失敗 ({failed_count}デバイス, date: {process_date})", api_logger)
-                sys.exit(1)
+                log_execution(api_name, len(pairs), "ERROR", 
+                            f"全デバイス処理失敗 ({failed_count}件, date: {', '.join(dates)})", api_logger)
+                return False
         else:
-            # ファイルベースのAPI処理（既存の処理）
-            # 未処理ファイル取得
-            pending_files = get_pending_files(api_name, api_logger=api_logger)
-            
-            if not pending_files:
-                log_execution(api_name, 0, "SUCCESS", "未処理ファイルなし", api_logger)
-                return
-            
-            # API実行
-            success = call_api(api_name, pending_files, api_logger)
-            
-            if success:
-                log_execution(api_name, len(pending_files), "SUCCESS", "処理完了", api_logger)
-            else:
-                log_execution(api_name, len(pending_files), "ERROR", "処理失敗", api_logger)
-                sys.exit(1)
+            # ファイルベースのAPI処理
+            # ドレインモード：未処理ファイルがなくなるか時間予算に達するまで連続処理
+            # （drain: False の場合は1バッチのみ処理する従来の動作）
+            max_batches = None if config.get('drain', True) else 1
+            if not run_file_based_drain(api_name, api_logger, max_batches=max_batches):
+                return False
         
         api_logger.info(f"=== {display_name} 自動処理完了 ===")
+        return True
         
     except Exception as e:
         log_execution(api_name, 0, "ERROR", f"予期しないエラー: {e}", api_logger)
         api_logger.exception("詳細エラー:")
+        return False
+    finally:
+        log_connection_stats(stats_before, api_logger)
+
+def main():
+    """メイン処理"""
+    if len(sys.argv) < 2:
+        logger.error("使用方法: python run-api-process.py <api_name>")
+        sys.exit(1)
+    
+    api_name = sys.argv[1]
+    
+    if not run_api(api_name, mode="cli"):
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+"""
+実行履歴の保存と集計
+ランナーは実行ごとに開始・終了時刻、起動方法、件数、ステータス、エラーを1行記録する。
+スケジューラーAPIの状況取得（最終実行時刻・成功率・時間別の処理件数）はログファイルを読まずにここから集計する
+
+- 履歴はSQLiteに保存し、ランナー（CLI・常駐エンジン）とAPIサーバーで共有する
+- 集計は (api_name, started_at) のインデックスで期間を絞って行い、累計は run_totals に保持する
+  （履歴の件数に関係なく、最新1件・累計の取得は一定時間）
+- ステータス: running（実行中） / SUCCESS / PARTIAL / ERROR（log_executionと同じ表記）
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+JST = timezone(timedelta(hours=9))
+
+# 実行履歴の保存先（scheduler-configボリューム）
+RUN_HISTORY_FILE = os.environ.get('RUN_HISTORY_FILE', '/app/config/scheduler-runs.db')
+
+_SCHEMA = """
+create table if not exists runs (
+    run_id integer primary key autoincrement,
+    api_name text not null,
+    mode text not null,
+    started_at text not null,
+    finished_at text,
+    duration_seconds real,
+    status text not null,
+    item_count integer not null default 0,
+    fetched_count integer not null default 0,
+    dispatched_count integer not null default 0,
+    succeeded_count integer not null default 0,
+    failed_count integer not null default 0,
+    message text,
+    error text
+);
+create index if not exists runs_api_started_idx on runs (api_name, started_at);
+create table if not exists run_totals (
+    api_name text not null,
+    status text not null,
+    run_count integer not null default 0,
+    item_count integer not null default 0,
+    primary key (api_name, status)
+);
+"""
+
+
+def _now() -> datetime:
+    return datetime.now(JST)
+
+
+class RunHistory:
+    """実行履歴の記録・集計"""
+
+    def __init__(self, path: str = RUN_HISTORY_FILE):
+        self.path = path
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        # スレッド・プロセスごとに接続を作る（WALで読み書きの同時実行に対応）
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("pragma journal_mode=wal")
+            if not self._initialized:
+                conn.executescript(_SCHEMA)
+                self._initialized = True
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def start(self, api_name: str, mode: str) -> int:
+        """実行開始を記録してrun_idを返す（mode: scheduled / chained / change_feed / manual / cli）"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "insert into runs (api_name, mode, started_at, status) values (?, ?, ?, 'running')",
+                (api_name, mode, _now().isoformat())
+            )
+            return cursor.lastrowid
+
+    def finish(self, run_id: int, status: str, item_count: int = 0, counts: Dict[str, int] = None,
+               message: str = None, error: str = None):
+        """
+        実行終了を記録し、累計（run_totals）に加算する
+        counts: {"fetched": 件数, "dispatched": 件数, "succeeded": 件数, "failed": 件数}
+        """
+        counts = counts or {}
+        finished_at = _now()
+        with self._connect() as conn:
+            row = conn.execute("select api_name, started_at from runs where run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return
+            duration = (finished_at - datetime.fromisoformat(row["started_at"])).total_seconds()
+            conn.execute(
+                "update runs set finished_at = ?, duration_seconds = ?, status = ?, item_count = ?, "
+                "fetched_count = ?, dispatched_count = ?, succeeded_count = ?, failed_count = ?, "
+                "message = ?, error = ? where run_id = ?",
+                (finished_at.isoformat(), duration, status, item_count,
+                 counts.get("fetched", 0), counts.get("dispatched", 0),
+                 counts.get("succeeded", 0), counts.get("failed", 0),
+                 message, error, run_id)
+            )
+            conn.execute(
+                "insert into run_totals (api_name, status, run_count, item_count) values (?, ?, 1, ?) "
+                "on conflict (api_name, status) do update set "
+                "run_count = run_count + 1, item_count = run_totals.item_count + excluded.item_count",
+                (row["api_name"], status, item_count)
+            )
+
+    def last_run(self, api_name: str, finished_only: bool = True) -> Optional[Dict]:
+        """最新の実行（finished_only: 実行中のものを除く）"""
+        query = "select * from runs where api_name = ?"
+        if finished_only:
+            query += " and status != 'running'"
+        with self._connect() as conn:
+            row = conn.execute(query + " order by started_at desc limit 1", (api_name,)).fetchone()
+        return dict(row) if row else None
+
+    def totals(self, api_name: str) -> Dict[str, Dict[str, int]]:
+        """ステータス別の累計 {status: {"runs": 回数, "items": 件数}}"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "select status, run_count, item_count from run_totals where api_name = ?", (api_name,)
+            ).fetchall()
+        return {row["status"]: {"runs": row["run_count"], "items": row["item_count"]} for row in rows}
+
+    def success_rate(self, api_name: str, hours: int = 24) -> Dict:
+        """直近hours時間の実行のステータス別回数と成功率（PARTIALは成功に含めない）"""
+        since = (_now() - timedelta(hours=hours)).isoformat()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "select status, count(*) as runs from runs "
+                "where api_name = ? and started_at >= ? and status != 'running' group by status",
+                (api_name, since)
+            ).fetchall()
+        by_status = {row["status"]: row["runs"] for row in rows}
+        total = sum(by_status.values())
+        return {
+            "windowHours": hours,
+            "runs": total,
+            "byStatus": by_status,
+            "successRate": round(by_status.get("SUCCESS", 0) / total, 4) if total else None
+        }
+
+    def hourly_throughput(self, api_name: str, hours: int = 24) -> List[Dict]:
+        """直近hours時間の1時間ごとの実行回数・処理件数（開始時刻のJSTの時で集計）"""
+        since = (_now() - timedelta(hours=hours)).isoformat()
+        with self._connect() as conn:
+            rows = conn.execute(
+                "select substr(started_at, 1, 13) as hour, count(*) as runs, "
+                "sum(item_count) as items, sum(succeeded_count) as succeeded, sum(failed_count) as failed "
+                "from runs where api_name = ? and started_at >= ? and status != 'running' "
+                "group by hour order by hour",
+                (api_name, since)
+            ).fetchall()
+        return [
+            {"hour": f"{row['hour']}:00:00+09:00", "runs": row["runs"], "items": row["items"] or 0,
+             "succeeded": row["succeeded"] or 0, "failed": row["failed"] or 0}
+            for row in rows
+        ]
+
+    def list(self, api_name: str = None, limit: int = 100) -> List[Dict]:
+        """実行履歴（新しい順）"""
+        with self._connect() as conn:
+            if api_name:
+                rows = conn.execute(
+                    "select * from runs where api_name = ? order by started_at desc limit ?", (api_name, limit)
+                ).fetchall()
+            else:
+                rows = conn.execute("select * from runs order by run_id desc limit ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
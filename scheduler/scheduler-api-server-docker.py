@@ -4,17 +4,27 @@ WatchMe Scheduler API Server (Docker版)
 APIマネージャーのスケジューラー機能を提供するサーバー
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Dict, Optional
-import json
+from typing import Any, Dict, List, Optional
 import os
 import subprocess
 import logging
 from datetime import datetime, timedelta
 import uvicorn
 
+from scheduler_engine import SchedulerEngine
+from adaptive_limiter import get_limits_snapshot
+from circuit_breaker import get_breakers_snapshot
+from budget import BudgetGovernor
+from job_store import JobStore
+from state_file import AtomicJsonFile
+from run_history import RunHistory
+import metrics
+import log_tail
+import pipeline
+
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -39,6 +49,8 @@ app.add_middleware(
 CONFIG_FILE = os.environ.get('CONFIG_FILE_PATH', '/home/ubuntu/scheduler/config.json')
 LOG_DIR = "/var/log/scheduler"
 CRON_FILE = "/etc/cron.d/watchme-scheduler"
+# 常駐スケジューラーエンジンの有効/無効（cronから実行する場合はfalseにする）
+SCHEDULER_ENGINE_ENABLED = os.environ.get('SCHEDULER_ENGINE_ENABLED', 'true').lower() != 'false'
 
 # リクエストモデル
 class SchedulerConfig(BaseModel):
@@ -49,17 +61,19 @@ class SchedulerConfig(BaseModel):
     deviceId: Optional[str] = None
     processDate: Optional[str] = None
 
+class JobCompletion(BaseModel):
+    """下流APIからのジョブ完了通知"""
+    status: str  # completed / failed
+    message: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+
+class DeadLetterRequeue(BaseModel):
+    """dead_letterの再投入対象（未指定の場合は全件）"""
+    file_paths: Optional[List[str]] = None
+
 # 設定管理
-def load_config() -> Dict:
-    """設定ファイル読み込み"""
-    try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-    except Exception as e:
-        logger.error(f"設定読み込みエラー: {e}")
-    
-    # デフォルト設定
+def default_config() -> Dict:
+    """デフォルト設定"""
     return {
         "apis": {},
         "global": {
@@ -68,13 +82,24 @@ def load_config() -> Dict:
         }
     }
 
-def save_config(config: Dict):
-    """設定ファイル保存"""
+# config.json（ファイルが変更されたときだけ読み直し、書き込みはロック付きでアトミックに置き換える）
+config_store = AtomicJsonFile(CONFIG_FILE, default_config)
+
+def load_config() -> Dict:
+    """設定ファイル読み込み（キャッシュ。ファイルが変更されていなければ解析しない）"""
     try:
-        os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        return config_store.read()
+    except Exception as e:
+        logger.error(f"設定読み込みエラー: {e}")
+    return default_config()
+
+def update_api_config(api_name: str, api_settings: Dict) -> Dict:
+    """1API分の設定を更新して保存し、保存後の設定全体を返す"""
+    try:
+        with config_store.update() as config:
+            config.setdefault("apis", {})[api_name] = api_settings
         logger.info("設定を保存しました")
+        return config
     except Exception as e:
         logger.error(f"設定保存エラー: {e}")
         raise HTTPException(status_code=500, detail="設定の保存に失敗しました")
@@ -85,27 +110,24 @@ def get_api_log_file(api_name: str) -> str:
     return f"{LOG_DIR}/scheduler-{api_name}.log"
 
 def get_last_execution_info(api_name: str) -> Dict:
-    """最終実行情報を取得"""
-    log_file = get_api_log_file(api_name)
-    
+    """最終実行情報を取得（実行履歴のインデックスから取得し、ログファイルは読まない）"""
     try:
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                lines = f.readlines()
-                if lines:
-                    last_line = lines[-1].strip()
-                    # ログから成功・エラー回数を集計
-                    success_count = sum(1 for line in lines if 'SUCCESS' in line)
-                    error_count = sum(1 for line in lines if 'ERROR' in line)
-                    
-                    return {
-                        "lastRun": datetime.now().isoformat() if success_count > 0 else None,
-                        "successCount": success_count,
-                        "errorCount": error_count,
-                        "isRunning": False  # 簡易実装
-                    }
+        last_run = run_history.last_run(api_name)
+        totals = run_history.totals(api_name)
+        return {
+            "lastRun": last_run["started_at"] if last_run else None,
+            "lastFinishedAt": last_run["finished_at"] if last_run else None,
+            "lastStatus": last_run["status"] if last_run else None,
+            "lastDurationSeconds": last_run["duration_seconds"] if last_run else None,
+            "lastItemCount": last_run["item_count"] if last_run else None,
+            "successCount": totals.get("SUCCESS", {}).get("runs", 0),
+            "partialCount": totals.get("PARTIAL", {}).get("runs", 0),
+            "errorCount": totals.get("ERROR", {}).get("runs", 0),
+            "successRate24h": run_history.success_rate(api_name, 24)["successRate"],
+            "isRunning": False
+        }
     except Exception as e:
-        logger.error(f"ログ読み込みエラー: {e}")
+        logger.error(f"実行履歴の読み込みエラー: {e}")
     
     return {
         "lastRun": None,
@@ -114,19 +136,25 @@ def get_last_execution_info(api_name: str) -> Dict:
         "isRunning": False
     }
 
-def calculate_next_run(interval_hours: int) -> str:
+def calculate_next_run(api_name: str, interval_hours: int) -> str:
     """次回実行時刻計算"""
+    if engine.is_alive:
+        return engine.next_run(api_name)
     next_run = datetime.now() + timedelta(hours=interval_hours)
     return next_run.isoformat()
 
 def update_cron_jobs(config: Dict):
     """
     cron設定を更新する代わりに、設定が更新されたことをログに記録する。
-    実際のcronジョブはホストOS側で静的に管理される。
+    常駐スケジューラーエンジンは毎分config.jsonから時刻表を読み直すため、
+    enabled/intervalの変更は次のスロットから反映される。
     """
     try:
         # 設定更新のログを出力
-        logger.info("設定ファイルが更新されました。cronジョブはホストOS側で固定スケジュールにて管理されます。")
+        if engine.is_alive:
+            logger.info("設定ファイルが更新されました。スケジューラーエンジンの時刻表に次のスロットから反映されます。")
+        else:
+            logger.info("設定ファイルが更新されました。cronジョブはホストOS側で固定スケジュールにて管理されます。")
         
         # 有効なAPIの一覧をログに出力
         enabled_apis = []
@@ -152,6 +180,27 @@ def update_cron_jobs(config: Dict):
         logger.warning("設定の更新中にエラーが発生しましたが、処理を継続します。")
         return True
 
+# 常駐スケジューラーエンジン
+engine = SchedulerEngine(load_config)
+# 下流APIへのディスパッチジョブ（完了通知の記録・一覧）
+job_store = JobStore()
+# 実行履歴（ランナーが実行ごとに記録）
+run_history = RunHistory()
+
+@app.on_event("startup")
+async def start_scheduler_engine():
+    """APIサーバー起動時にスケジューラーエンジンを開始"""
+    if SCHEDULER_ENGINE_ENABLED:
+        engine.start()
+    else:
+        logger.info("スケジューラーエンジンは無効です（SCHEDULER_ENGINE_ENABLED=false）")
+
+@app.on_event("shutdown")
+async def stop_scheduler_engine():
+    """APIサーバー停止時にスケジューラーエンジンを停止"""
+    if engine.is_alive:
+        engine.stop()
+
 # API エンドポイント
 @app.get("/")
 async def health_check():
@@ -163,10 +212,16 @@ async def health_check():
         "environment": "docker"
     }
 
-@app.get("/api/scheduler/status/{api_name}")
-async def get_api_status(api_name: str):
-    """個別API自動処理状況取得"""
-    config = load_config()
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus形式のメトリクス（実行回数・件数・レイテンシ・未処理件数・処理中リクエスト数）"""
+    if not metrics.is_available():
+        raise HTTPException(status_code=503, detail="prometheus_clientがインストールされていません")
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+def build_api_status(api_name: str, config: Dict) -> Dict:
+    """個別APIの状況（設定は呼び出し側で読み込んだものを使う）"""
     api_config = config["apis"].get(api_name, {
         "enabled": False,
         "interval": 3,
@@ -185,15 +240,20 @@ async def get_api_status(api_name: str):
         "max_files": api_config.get("max_files", 100),
         "deviceId": api_config.get("deviceId"),
         "processDate": api_config.get("processDate"),
-        "nextRun": calculate_next_run(api_config.get("interval", 3)) if api_config.get("enabled") else None,
-        **execution_info
+        "nextRun": calculate_next_run(api_name, api_config.get("interval", 3)) if api_config.get("enabled") else None,
+        **execution_info,
+        "isRunning": engine.is_running(api_name),
+        "lastResult": engine.last_result(api_name)
     }
 
+@app.get("/api/scheduler/status/{api_name}")
+async def get_api_status(api_name: str):
+    """個別API自動処理状況取得"""
+    return build_api_status(api_name, load_config())
+
 @app.post("/api/scheduler/toggle/{api_name}")
 async def toggle_api_scheduler(api_name: str, scheduler_config: SchedulerConfig):
     """自動処理ON/OFF切り替え"""
-    config = load_config()
-    
     # API設定更新
     api_settings = {
         "enabled": scheduler_config.enabled,
@@ -220,10 +280,8 @@ async def toggle_api_scheduler(api_name: str, scheduler_config: SchedulerConfig)
                 pass
         api_settings["processDate"] = process_date
     
-    config["apis"][api_name] = api_settings
-    
-    # 設定保存
-    save_config(config)
+    # 設定保存（ロック中に最新の設定へ反映するため、同時に別のAPIを切り替えても変更が失われない）
+    config = update_api_config(api_name, api_settings)
     
     # cron設定更新
     update_cron_jobs(config)
@@ -238,12 +296,12 @@ async def toggle_api_scheduler(api_name: str, scheduler_config: SchedulerConfig)
 
 @app.get("/api/scheduler/global")
 async def get_global_status():
-    """全体状況取得"""
+    """全体状況取得（1回読み込んだ設定から全APIの状況を作る）"""
     config = load_config()
     
     api_statuses = {}
     for api_name in config["apis"].keys():
-        api_statuses[api_name] = await get_api_status(api_name)
+        api_statuses[api_name] = build_api_status(api_name, config)
     
     return {
         "global": config.get("global", {}),
@@ -252,6 +310,170 @@ async def get_global_status():
         "enabled_apis": sum(1 for api in config["apis"].values() if api.get("enabled", False))
     }
 
+@app.get("/api/scheduler/engine")
+async def get_engine_status():
+    """スケジューラーエンジンの状態と時刻表を取得"""
+    timetable = engine.load_timetable()
+    return {
+        "enabled": SCHEDULER_ENGINE_ENABLED,
+        "alive": engine.is_alive,
+        "changeFeed": engine.change_feed_status(),
+        "timetable": {
+            api_name: {
+                **entry,
+                "nextRun": engine.next_run(api_name),
+                "isRunning": engine.is_running(api_name),
+                "lastResult": engine.last_result(api_name),
+                "upstream": pipeline.upstream_of(api_name),
+                "pendingChained": engine.pending_chained(api_name)
+            }
+            for api_name, entry in timetable.items()
+        }
+    }
+
+@app.get("/api/scheduler/concurrency")
+async def get_concurrency_limits():
+    """エンドポイント別の現在の並列数（AIMD制御）を取得"""
+    return {
+        "endpoints": get_limits_snapshot()
+    }
+
+@app.get("/api/scheduler/breakers")
+async def get_circuit_breakers():
+    """エンドポイント（ホスト:ポート）別のサーキットブレーカーの状態（closed / open / half-open）を取得"""
+    return {
+        "endpoints": get_breakers_snapshot()
+    }
+
+@app.get("/api/scheduler/budget")
+async def get_gpt_budget():
+    """ChatGPT利用ステージの予算使用量（1時間・1日）を取得"""
+    try:
+        return BudgetGovernor().usage()
+    except Exception as e:
+        logger.error(f"予算使用量の取得エラー: {e}")
+        raise HTTPException(status_code=500, detail="予算使用量の取得に失敗しました")
+
+@app.post("/api/scheduler/run/{api_name}")
+async def run_api_now(api_name: str):
+    """APIジョブを即時実行（スケジューラーエンジン経由）"""
+    if api_name not in engine.load_timetable():
+        raise HTTPException(status_code=404, detail=f"未対応のAPI: {api_name}")
+    if not engine.trigger(api_name, "manual"):
+        raise HTTPException(status_code=409, detail=f"{api_name}は実行中です")
+    return {"status": "started", "api_name": api_name}
+
+@app.get("/api/scheduler/history/{api_name}")
+def get_run_history(api_name: str, hours: int = 24, limit: int = 50):
+    """実行履歴（直近hours時間の成功率・1時間ごとの処理件数・最近の実行）"""
+    hours = max(1, min(hours, 24 * 30))
+    try:
+        return {
+            "api_name": api_name,
+            "successRate": run_history.success_rate(api_name, hours),
+            "hourlyThroughput": run_history.hourly_throughput(api_name, hours),
+            "totals": run_history.totals(api_name),
+            "runs": run_history.list(api_name, limit)
+        }
+    except Exception as e:
+        logger.error(f"実行履歴の取得エラー: {e}")
+        raise HTTPException(status_code=500, detail="実行履歴の取得に失敗しました")
+
+@app.post("/api/scheduler/jobs/{job_id}/complete")
+def complete_job(job_id: str, completion: JobCompletion, token: Optional[str] = None,
+                 x_scheduler_job_token: Optional[str] = Header(None)):
+    """
+    下流APIからのジョブ完了通知を受け取り、結果を記録
+    ジョブ登録時のトークン（callback_urlのtokenクエリ、またはX-Scheduler-Job-Tokenヘッダー）が必要
+    """
+    if completion.status not in ("completed", "failed"):
+        raise HTTPException(status_code=400, detail=f"未対応のステータス: {completion.status}")
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"ジョブが見つかりません: {job_id}")
+    if not job_store.verify_token(job_id, token or x_scheduler_job_token):
+        logger.warning(f"ジョブ {job_id}: トークンが一致しない完了通知を拒否しました")
+        raise HTTPException(status_code=401, detail="ジョブのトークンが一致しません")
+    if job["status"] != "dispatched":
+        # 期限切れ後の通知や重複通知は記録済みの結果を返す
+        return {"status": "ignored", "job": job}
+    try:
+        recorded = engine.runner.finalize_job(job_id, completion.status, completion.message, completion.result)
+    except Exception as e:
+        logger.error(f"ジョブ完了通知の記録エラー: {e}")
+        raise HTTPException(status_code=500, detail="ジョブ完了通知の記録に失敗しました")
+    return {"status": "recorded" if recorded else "ignored", "job": recorded or job_store.get(job_id)}
+
+@app.get("/api/scheduler/jobs")
+def list_jobs(api_name: Optional[str] = None, status: Optional[str] = None, limit: int = 100):
+    """ディスパッチジョブ一覧（新しい順）"""
+    return {"jobs": job_store.list(api_name, status, limit)}
+
+@app.get("/api/scheduler/jobs/{job_id}")
+def get_job(job_id: str):
+    """ディスパッチジョブの状態を取得"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"ジョブが見つかりません: {job_id}")
+    return job
+
+def get_file_based_runner(api_name: str):
+    """dead_letterを扱えるAPI（ステータス列で管理するファイルベースAPI）の実行モジュールを取得"""
+    runner = engine.runner
+    if 'status_column' not in runner.API_CONFIGS.get(api_name, {}):
+        raise HTTPException(status_code=400, detail=f"dead_letterに対応していないAPI: {api_name}")
+    return runner
+
+@app.get("/api/scheduler/dead-letters/{api_name}")
+def list_dead_letters(api_name: str, limit: int = 100):
+    """試行回数の上限に達してdead_letterになったファイル一覧"""
+    runner = get_file_based_runner(api_name)
+    try:
+        return {"api_name": api_name, "items": runner.list_dead_letters(api_name, limit)}
+    except Exception as e:
+        logger.error(f"dead_letter一覧の取得エラー: {e}")
+        raise HTTPException(status_code=500, detail="dead_letter一覧の取得に失敗しました")
+
+@app.post("/api/scheduler/dead-letters/{api_name}/requeue")
+def requeue_dead_letters(api_name: str, request: DeadLetterRequeue):
+    """dead_letterのファイルをpendingに戻す（試行回数はリセット）"""
+    runner = get_file_based_runner(api_name)
+    try:
+        requeued = runner.requeue_dead_letters(api_name, request.file_paths)
+    except Exception as e:
+        logger.error(f"dead_letterの再投入エラー: {e}")
+        raise HTTPException(status_code=500, detail="dead_letterの再投入に失敗しました")
+    return {"status": "success", "requeued": requeued}
+
+@app.get("/api/scheduler/logs/{api_name}")
+def get_api_logs(api_name: str, lines: int = 200, before: Optional[int] = None, segment: Optional[str] = None,
+                 level: Optional[str] = None, contains: Optional[str] = None, run: bool = False,
+                 after: Optional[int] = None):
+    """
+    APIのログを末尾から取得（ファイル全体は読み込まない）
+    before: 前のページのcursor.before（この位置より前の行を返す）、segment: 保管済み（ローテーション済み）のファイル名
+    level / contains: ログレベル・部分文字列で絞り込み
+    run: カーソルより前で最も新しい実行（=== ... 自動処理開始 ===）の開始行から返す
+    after: run=Trueで返したnext.after（実行の続きをこの位置から古い順に返す）
+    """
+    if api_name not in engine.load_timetable():
+        raise HTTPException(status_code=404, detail=f"未対応のAPI: {api_name}")
+    if level is not None and level.upper() not in log_tail.LEVELS:
+        raise HTTPException(status_code=400, detail=f"未対応のログレベル: {level}")
+    try:
+        if after is not None:
+            result = log_tail.run_continuation(get_api_log_file(api_name), after, lines, segment,
+                                               level.upper() if level else None, contains)
+        else:
+            result = log_tail.tail(get_api_log_file(api_name), lines, before, segment,
+                                   level.upper() if level else None, contains, run)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"ログファイルが見つかりません: {segment}")
+    except Exception as e:
+        logger.error(f"ログ読み込みエラー: {e}")
+        raise HTTPException(status_code=500, detail="ログの読み込みに失敗しました")
+    return {"api_name": api_name, **result}
+
 @app.get("/api/scheduler/cron")
 async def get_cron_config():
     """現在のcron設定を取得"""
@@ -0,0 +1,283 @@
+"""
+常駐スケジューラーエンジン
+cronから毎回 docker exec で起動していた run-api-process-docker.py のジョブを、
+scheduler-api-server-docker.py と同じプロセス内で時刻表に従って実行する
+
+- Pythonインタプリタの起動・supabase/requestsのimportはプロセス起動時の1回のみ
+- 時刻表は config.py の SCHEDULE_DEFAULTS をベースに、config.json の
+  enabled/interval（toggle_api_scheduler で保存される値）で上書きする
+- 上流ステージの完了通知（pipeline.py）を受けると、下流ステージを対象キー付きでその場で実行する
+- 変更フィード（change_feed.py）の購読中は、pendingになった行のステージをその場で実行し、
+  時刻表による定期実行は取りこぼし回収用の低頻度（CHANGE_FEED_SAFETY_NET_INTERVAL）に落とす
+"""
+
+import importlib.util
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import pipeline
+from change_feed import ChangeFeedListener, covered_stages
+from config import CHANGE_FEED_SAFETY_NET_INTERVAL, SCHEDULE_DEFAULTS
+
+logger = logging.getLogger(__name__)
+
+# JSTタイムゾーン定義（run-api-process-docker.pyと同じ）
+JST = timezone(timedelta(hours=9))
+
+# ジョブ本体（ファイル名にハイフンを含むためimportlibで読み込む）
+RUNNER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run-api-process-docker.py')
+
+
+def load_runner_module(path: str = RUNNER_SCRIPT):
+    """run-api-process-docker.py をモジュールとして読み込む"""
+    spec = importlib.util.spec_from_file_location("run_api_process_docker", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SchedulerEngine:
+    """時刻表に従ってAPIジョブをプロセス内で実行する常駐エンジン"""
+
+    def __init__(self, config_loader: Callable[[], Dict], runner_path: str = RUNNER_SCRIPT):
+        self._config_loader = config_loader
+        self._runner_path = runner_path
+        self._runner = None
+        self._lock = threading.Lock()
+        self._running = set()  # 実行中のAPI名
+        self._last_slots = {}  # API名 -> 最後に起動した時刻スロット（重複起動防止）
+        self._last_results = {}  # API名 -> 最終実行結果
+        self._chained = {}  # API名 -> 上流ステージの完了で実行待ちのキー（device_id, date, time_block）
+        self._rerun = set()  # 実行中に変更フィードで新しいpendingが届いたAPI名（終了後にもう一度実行）
+        self._change_feed = ChangeFeedListener(self.on_change_feed, lambda: self.runner.API_CONFIGS)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # ---- 時刻表 ----
+
+    def load_timetable(self) -> Dict[str, Dict]:
+        """デフォルト時刻表にconfig.jsonの設定を反映した時刻表を返す"""
+        config = self._config_loader()
+        global_enabled = config.get("global", {}).get("enabled", True)
+        api_settings_map = config.get("apis", {})
+
+        timetable = {}
+        for api_name, defaults in SCHEDULE_DEFAULTS.items():
+            entry = dict(defaults)
+            api_settings = api_settings_map.get(api_name)
+            if api_settings:
+                if "enabled" in api_settings:
+                    entry["enabled"] = bool(api_settings["enabled"])
+                interval = api_settings.get("interval")
+                if isinstance(interval, int) and interval > 0:
+                    entry["interval"] = interval
+            if not global_enabled:
+                entry["enabled"] = False
+            timetable[api_name] = entry
+
+        # 変更フィードの購読中は、対象ステージの定期実行を取りこぼし回収用の低頻度に落とす
+        if self._change_feed.is_connected:
+            for api_name in covered_stages(self.runner.API_CONFIGS):
+                entry = timetable.get(api_name)
+                if entry:
+                    entry["interval"] = max(entry["interval"], CHANGE_FEED_SAFETY_NET_INTERVAL)
+                    entry["trigger"] = "change_feed"
+        return timetable
+
+    @staticmethod
+    def is_due(entry: Dict, slot: datetime) -> bool:
+        """指定スロット（分単位）が実行タイミングかどうか"""
+        return slot.minute == entry["minute"] and slot.hour % entry["interval"] == 0
+
+    def next_run(self, api_name: str, now: Optional[datetime] = None) -> Optional[str]:
+        """次回実行時刻（JST, ISO形式）を返す。無効なAPIはNone"""
+        entry = self.load_timetable().get(api_name)
+        if not entry or not entry["enabled"]:
+            return None
+
+        now = now or datetime.now(JST)
+        candidate = now.replace(minute=entry["minute"], second=0, microsecond=0)
+        if candidate <= now:
+            candidate += timedelta(hours=1)
+        while candidate.hour % entry["interval"] != 0:
+            candidate += timedelta(hours=1)
+        return candidate.isoformat()
+
+    # ---- 実行 ----
+
+    def _get_runner(self):
+        """ジョブ本体を初回のみ読み込む"""
+        with self._lock:
+            if self._runner is None:
+                self._runner = load_runner_module(self._runner_path)
+            return self._runner
+
+    @property
+    def runner(self):
+        """ジョブ本体のモジュール（ジョブ完了通知の記録などAPIサーバーからも利用する）"""
+        return self._get_runner()
+
+    def is_running(self, api_name: str) -> bool:
+        with self._lock:
+            return api_name in self._running
+
+    def last_result(self, api_name: str) -> Optional[Dict]:
+        with self._lock:
+            return self._last_results.get(api_name)
+
+    def trigger(self, api_name: str, mode: str = "scheduled") -> bool:
+        """
+        ジョブを別スレッドで起動する。同じAPIが実行中の場合は起動しない
+        mode: 起動方法（scheduled / change_feed / manual）。実行履歴に記録する
+        """
+        with self._lock:
+            if api_name in self._running:
+                logger.warning(f"{api_name}: 前回の実行が継続中のためスキップ")
+                return False
+            self._running.add(api_name)
+
+        self._start_job(api_name, None, mode)
+        return True
+
+    def _trigger_chained(self, api_name: str) -> bool:
+        """
+        実行待ちのキーがあれば対象キー付きでジョブを起動する
+        同じAPIが実行中の場合はキーを溜めておき、実行終了時に起動する
+        """
+        with self._lock:
+            if api_name in self._running or not self._chained.get(api_name):
+                return False
+            keys = sorted(self._chained.pop(api_name))
+            self._running.add(api_name)
+
+        logger.info(f"{api_name}: 上流ステージの完了により{len(keys)}件を連鎖実行")
+        self._start_job(api_name, keys, "chained")
+        return True
+
+    def _start_job(self, api_name: str, keys: Optional[List], mode: str):
+        thread = threading.Thread(
+            target=self._execute,
+            args=(api_name, keys, mode),
+            name=f"scheduler-job-{api_name}",
+            daemon=True
+        )
+        thread.start()
+
+    def on_stage_completed(self, api_name: str, keys: List):
+        """上流ステージの完了通知（pipeline.publish）を受けて下流ステージを実行する"""
+        timetable = self.load_timetable()
+        for stage in pipeline.dependents_of(api_name):
+            if not timetable.get(stage, {}).get("enabled"):
+                continue
+            with self._lock:
+                self._chained.setdefault(stage, set()).update(tuple(key) for key in keys)
+            self._trigger_chained(stage)
+
+    def on_change_feed(self, events: Dict):
+        """
+        変更フィードの通知を受けてステージを実行する
+        events: API名 -> 対象キーのset（Noneの場合は未処理データを検出する通常実行）
+        """
+        timetable = self.load_timetable()
+        for api_name, keys in events.items():
+            if not timetable.get(api_name, {}).get("enabled"):
+                continue
+            if keys:
+                with self._lock:
+                    self._chained.setdefault(api_name, set()).update(keys)
+                self._trigger_chained(api_name)
+                continue
+            with self._lock:
+                if api_name in self._running:
+                    self._rerun.add(api_name)
+                    continue
+            self.trigger(api_name, "change_feed")
+
+    def change_feed_status(self) -> Dict:
+        return self._change_feed.snapshot()
+
+    def pending_chained(self, api_name: str) -> int:
+        """上流ステージの完了で実行待ちのキー数"""
+        with self._lock:
+            return len(self._chained.get(api_name, ()))
+
+    def _execute(self, api_name: str, keys: Optional[List] = None, mode: str = "scheduled"):
+        started_at = datetime.now(JST)
+        success = False
+        try:
+            logger.info(f"{api_name}: ジョブ開始" + (f"（連鎖実行: {len(keys)}件）" if keys else ""))
+            success = self._get_runner().run_api(api_name, keys=keys, mode=mode)
+        except Exception as e:
+            logger.error(f"{api_name}: ジョブ実行エラー: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(api_name)
+                self._last_results[api_name] = {
+                    "startedAt": started_at.isoformat(),
+                    "finishedAt": datetime.now(JST).isoformat(),
+                    "success": success,
+                    "chained": bool(keys)
+                }
+            logger.info(f"{api_name}: ジョブ終了 (success: {success})")
+            # 実行中に届いた上流ステージの完了通知・変更フィードの通知を処理
+            with self._lock:
+                rerun = api_name in self._rerun
+                self._rerun.discard(api_name)
+            if rerun:
+                self.trigger(api_name, "change_feed")
+            else:
+                self._trigger_chained(api_name)
+
+    # ---- 常駐ループ ----
+
+    def start(self):
+        """常駐ループを開始"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        pipeline.subscribe(self.on_stage_completed)
+        self._thread = threading.Thread(target=self._loop, name="scheduler-engine", daemon=True)
+        self._thread.start()
+        self._change_feed.start()
+        logger.info("スケジューラーエンジンを開始しました")
+
+    def stop(self):
+        """常駐ループを停止（実行中のジョブは完了まで継続）"""
+        self._stop_event.set()
+        pipeline.unsubscribe(self.on_stage_completed)
+        self._change_feed.stop()
+        if self._thread:
+            self._thread.join(timeout=5)
+        logger.info("スケジューラーエンジンを停止しました")
+
+    @property
+    def is_alive(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _loop(self):
+        # ジョブ本体は起動時に読み込んでおく（import・クライアント初期化を1回で済ませる）
+        try:
+            self._get_runner()
+        except Exception as e:
+            logger.error(f"ジョブ本体の読み込みエラー: {e}")
+
+        while not self._stop_event.is_set():
+            now = datetime.now(JST)
+            slot = now.replace(second=0, microsecond=0)
+            try:
+                for api_name, entry in self.load_timetable().items():
+                    if not entry["enabled"] or not self.is_due(entry, slot):
+                        continue
+                    if self._last_slots.get(api_name) == slot:
+                        continue
+                    self._last_slots[api_name] = slot
+                    self.trigger(api_name)
+            except Exception as e:
+                logger.error(f"時刻表の評価エラー: {e}")
+
+            # 次の分の境界まで待機
+            wait_seconds = 60 - now.second - now.microsecond / 1_000_000
+            self._stop_event.wait(max(wait_seconds, 1))
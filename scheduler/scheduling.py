@@ -0,0 +1,144 @@
+"""
+ファイルベースAPIの未処理ファイルの処理順序（スケジューリング方針）
+API_CONFIGSの scheduling_policy でAPIごとに選択する
+
+- fifo: created_atの古い順（従来の動作）
+- fair_share: device_idごとに重み付きラウンドロビン（1デバイスの大量アップロードで他のデバイスが待たされない）
+- sjf: 推定処理時間の短い順（duration_columnが必要。一定時間以上待ったファイルは優先）
+- live_first: 直近にアップロードされたファイル（ライブ）を先に、古いバックログは残りの枠で処理
+  （バックログが止まらないように backlog_min_share の枠は確保する）
+
+候補の取得と取得（processingへの変更）は run-api-process-docker.py 側で行い、
+ここでは候補から1バッチ分を選んで並べる
+"""
+
+import math
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+FIFO = "fifo"
+FAIR_SHARE = "fair_share"
+SHORTEST_JOB_FIRST = "sjf"
+LIVE_FIRST = "live_first"
+POLICIES = (FIFO, FAIR_SHARE, SHORTEST_JOB_FIRST, LIVE_FIRST)
+DEFAULT_POLICY = FIFO
+
+# 1バッチを選ぶために読み込む候補数（バッチサイズの倍数）
+CANDIDATE_WINDOW_FACTOR = 5
+# fair_share: デバイスごとに読み込む候補数（バッチサイズの倍数、最低1件）
+PER_DEVICE_FACTOR = 1
+# live_first: ライブとみなす経過時間
+LIVE_WINDOW_SECONDS = 2 * 3600
+# live_first: バックログに確保する枠の割合
+BACKLOG_MIN_SHARE = 0.25
+# sjf: これ以上待ったファイルは推定処理時間に関係なく先に処理する
+SJF_MAX_WAIT_SECONDS = 6 * 3600
+
+
+def resolve_policy(config: Dict) -> str:
+    """APIの設定からスケジューリング方針を決める（未知の値はfifo）"""
+    policy = config.get('scheduling_policy', DEFAULT_POLICY)
+    return policy if policy in POLICIES else DEFAULT_POLICY
+
+
+def parse_created_at(value) -> datetime:
+    """Supabaseのcreated_at（ISO形式）をdatetimeに変換"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+
+def fifo_key(row: Dict) -> Tuple:
+    return (str(row['created_at']), row['file_path'])
+
+
+def select_fifo(candidates: List[Dict], limit: int) -> Tuple[List[Dict], str]:
+    rows = sorted(candidates, key=fifo_key)[:limit]
+    return rows, f"古い順に{len(rows)}件"
+
+
+def select_fair_share(candidates: List[Dict], limit: int, weights: Optional[Dict[str, float]] = None) -> Tuple[List[Dict], str]:
+    """
+    デバイスごとのキュー（古い順）から、(処理済み件数 + 1) / 重み が最小のデバイスを順に選ぶ
+    同じ値の場合は先頭ファイルの古いデバイスを優先する
+    """
+    weights = weights or {}
+    queues = defaultdict(list)
+    for row in sorted(candidates, key=fifo_key):
+        queues[row.get('device_id')].append(row)
+
+    served = Counter()
+    rows = []
+    while len(rows) < limit and queues:
+        device_id = min(
+            queues,
+            key=lambda d: ((served[d] + 1) / max(weights.get(d, 1.0), 0.001), fifo_key(queues[d][0]))
+        )
+        rows.append(queues[device_id].pop(0))
+        served[device_id] += 1
+        if not queues[device_id]:
+            del queues[device_id]
+
+    shares = ", ".join(f"{device_id}: {count}件" for device_id, count in served.most_common())
+    return rows, f"{len(served)}デバイスに配分（{shares}）"
+
+
+def select_shortest_job_first(candidates: List[Dict], limit: int, duration_key: Optional[str],
+                              seconds_per_unit: Optional[float], now: datetime) -> Tuple[List[Dict], str]:
+    """
+    推定処理時間（音声の長さ × 1秒あたりの処理時間）の短い順
+    SJF_MAX_WAIT_SECONDS 以上待ったファイルは先に古い順で処理する（長いファイルが処理されなくなるのを防ぐ）
+    長さが不明なファイルは最後に古い順で処理する
+    """
+    if not duration_key:
+        rows, _ = select_fifo(candidates, limit)
+        return rows, f"duration_column未設定のため古い順に{len(rows)}件"
+
+    cutoff = now - timedelta(seconds=SJF_MAX_WAIT_SECONDS)
+    aged = sorted((row for row in candidates if parse_created_at(row['created_at']) < cutoff), key=fifo_key)
+    aged_paths = {row['file_path'] for row in aged}
+    rest = [row for row in candidates if row['file_path'] not in aged_paths]
+    known = sorted((row for row in rest if row.get(duration_key)), key=lambda row: (row[duration_key], fifo_key(row)))
+    unknown = sorted((row for row in rest if not row.get(duration_key)), key=fifo_key)
+
+    rows = (aged + known + unknown)[:limit]
+    aged_count = len([row for row in rows if row['file_path'] in aged_paths])
+    total = sum(row.get(duration_key) or 0 for row in rows)
+    estimate = f", 推定処理時間 {total * seconds_per_unit:.0f}秒" if seconds_per_unit else ""
+    return rows, f"短い順に{len(rows)}件（待ち時間超過 {aged_count}件, 音声合計 {total:.0f}秒{estimate}）"
+
+
+def select_live_first(candidates: List[Dict], limit: int, now: datetime,
+                      live_window: float = LIVE_WINDOW_SECONDS,
+                      backlog_share: float = BACKLOG_MIN_SHARE) -> Tuple[List[Dict], str]:
+    """
+    ライブ（live_window秒以内）を古い順に先に選び、残りの枠をバックログ（古い順）で埋める
+    バックログがある場合は backlog_share の枠を確保する
+    """
+    cutoff = now - timedelta(seconds=live_window)
+    live = sorted((row for row in candidates if parse_created_at(row['created_at']) >= cutoff), key=fifo_key)
+    backlog = sorted((row for row in candidates if parse_created_at(row['created_at']) < cutoff), key=fifo_key)
+
+    reserved = min(len(backlog), math.ceil(limit * backlog_share)) if backlog else 0
+    live_rows = live[:limit - reserved]
+    backlog_rows = backlog[:limit - len(live_rows)]
+    rows = live_rows + backlog_rows
+    return rows, f"ライブ {len(live_rows)}件 / バックログ {len(backlog_rows)}件（ライブ待ち {len(live)}件）"
+
+
+def select_batch(policy: str, candidates: List[Dict], limit: int, config: Dict,
+                 now: datetime, seconds_per_unit: Optional[float] = None) -> Tuple[List[Dict], str]:
+    """
+    方針に従って候補から1バッチ分（最大limit件）を選ぶ
+    戻り値: (処理順に並べた行, 実行ログ用の説明)
+    """
+    if policy == FAIR_SHARE:
+        return select_fair_share(candidates, limit, config.get('device_weights'))
+    if policy == SHORTEST_JOB_FIRST:
+        return select_shortest_job_first(candidates, limit, config.get('duration_column'), seconds_per_unit, now)
+    if policy == LIVE_FIRST:
+        return select_live_first(candidates, limit, now,
+                                 config.get('live_window_seconds', LIVE_WINDOW_SECONDS),
+                                 config.get('backlog_min_share', BACKLOG_MIN_SHARE))
+    return select_fifo(candidates, limit)
@@ -0,0 +1,92 @@
+-- スケジューラー: 未処理ファイルのリース付きアトミック取得
+-- run-api-process-docker.py の claim_pending_files から RPC で呼び出される
+-- pending の行だけを processing に変更し、リースの所有者と有効期限を記録する
+-- （FOR UPDATE SKIP LOCKED により、複数のスケジューラーが同時に実行しても同じファイルを取得しない）
+
+create table if not exists public.scheduler_leases (
+    file_path text not null,
+    status_column text not null,
+    lease_owner text,
+    lease_expires_at timestamptz,
+    claimed_at timestamptz,
+    attempts integer not null default 0,
+    primary key (file_path, status_column)
+);
+
+create index if not exists scheduler_leases_expires_idx
+    on public.scheduler_leases (status_column, lease_expires_at);
+
+create or replace function public.claim_pending_audio_files(
+    p_status_column text,
+    p_limit integer,
+    p_lease_owner text,
+    p_lease_seconds integer,
+    p_after_created_at timestamptz default null,
+    p_after_file_path text default null
+)
+returns setof public.audio_files
+language plpgsql
+as $$
+begin
+    -- 動的SQLで使うカラム名の検証（audio_filesの *_status カラムのみ許可）
+    if not exists (
+        select 1 from information_schema.columns
+        where table_schema = 'public'
+          and table_name = 'audio_files'
+          and column_name = p_status_column
+          and column_name like '%\_status'
+    ) then
+        raise exception 'unsupported status column: %', p_status_column;
+    end if;
+
+    return query execute format($q$
+        with candidates as (
+            select a.file_path
+            from public.audio_files a
+            where a.%1$I = 'pending'
+              and ($3::timestamptz is null or (a.created_at, a.file_path) > ($3, $4))
+            order by a.created_at, a.file_path
+            limit $1
+            for update skip locked
+        ), claimed as (
+            update public.audio_files a
+            set %1$I = 'processing'
+            from candidates c
+            where a.file_path = c.file_path
+            returning a.*
+        ), leased as (
+            insert into public.scheduler_leases (file_path, status_column, lease_owner, lease_expires_at, claimed_at)
+            select file_path, %2$L, $2, now() + make_interval(secs => $5), now()
+            from claimed
+            on conflict (file_path, status_column) do update
+                set lease_owner = excluded.lease_owner,
+                    lease_expires_at = excluded.lease_expires_at,
+                    claimed_at = excluded.claimed_at
+        )
+        select * from claimed order by created_at, file_path
+    $q$, p_status_column, p_status_column)
+    using p_limit, p_lease_owner, p_after_created_at, p_after_file_path, p_lease_seconds;
+end;
+$$;
+
+-- 取得済みファイルのリース延長
+-- run-api-process-docker.py の extend_page_lease から RPC で呼び出される
+-- 1ページを音声の長さで複数のバッチに分割した場合、後のバッチが送信待ちの間にリースが切れないように
+-- ページ全体のリースを全バッチ分に延長する（リースの所有者が一致する行のみ）
+
+create or replace function public.extend_audio_file_leases(
+    p_status_column text,
+    p_file_paths text[],
+    p_lease_owner text,
+    p_lease_seconds integer
+)
+returns table (file_path text)
+language sql
+as $$
+    update public.scheduler_leases l
+    set lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    where l.status_column = p_status_column
+      and l.file_path = any(p_file_paths)
+      and l.lease_owner = p_lease_owner
+    returning l.file_path;
+$$;
@@ -0,0 +1,65 @@
+-- スケジューラー: 非同期ジョブの完了通知によるファイルステータスの更新（リースを持つ行のみ）
+-- run-api-process-docker.py の complete_leased_files から RPC で呼び出される
+-- （claim_pending_audio_files.sql の scheduler_leases テーブルが必要）
+--
+-- 完了通知は送信から時間が経って届くため、その間にリース回収で pending に戻った行や、
+-- 他のスケジューラー（または同じスケジューラーの後の実行）が取得し直した行は上書きしない
+--   - まだ processing で、リースの所有者が送信時の所有者と一致し、
+--     リースの取得時刻が送信時刻（p_dispatched_at）以前の行だけを p_status にする
+--   - 更新した行のリースは解放する
+
+create or replace function public.complete_leased_audio_files(
+    p_status_column text,
+    p_file_paths text[],
+    p_lease_owner text,
+    p_dispatched_at timestamptz,
+    p_status text
+)
+returns table (file_path text)
+language plpgsql
+as $$
+begin
+    if not exists (
+        select 1 from information_schema.columns
+        where table_schema = 'public'
+          and table_name = 'audio_files'
+          and column_name = p_status_column
+          and column_name like '%\_status'
+    ) then
+        raise exception 'unsupported status column: %', p_status_column;
+    end if;
+    if p_status not in ('completed', 'failed') then
+        raise exception 'unsupported status: %', p_status;
+    end if;
+
+    return query execute format($q$
+        with owned as (
+            select a.file_path
+            from public.audio_files a
+            join public.scheduler_leases l
+              on l.file_path = a.file_path
+             and l.status_column = %2$L
+            where a.file_path = any($1)
+              and a.%1$I = 'processing'
+              and l.lease_owner = $2
+              and l.claimed_at <= $3
+            for update of a
+        ), updated as (
+            update public.audio_files a
+            set %1$I = $4
+            from owned o
+            where a.file_path = o.file_path
+            returning a.file_path
+        ), released as (
+            update public.scheduler_leases l
+            set lease_owner = null,
+                lease_expires_at = null
+            from updated u
+            where l.file_path = u.file_path
+              and l.status_column = %2$L
+        )
+        select u.file_path from updated u
+    $q$, p_status_column, p_status_column)
+    using p_file_paths, p_lease_owner, p_dispatched_at, p_status;
+end;
+$$;
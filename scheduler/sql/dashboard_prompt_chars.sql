@@ -0,0 +1,19 @@
+-- スケジューラー: dashboard.prompt の文字数とそのうちのASCII文字数（PostgRESTの計算カラム）
+-- run-api-process-docker.py の未処理レコード一覧で select('..., prompt_chars, prompt_ascii_chars') として取得する
+-- （一覧ではプロンプト本文を転送せず、予算管理のトークン数推定（budget.estimate_tokens）に文字数だけを使う）
+
+create or replace function public.prompt_chars(public.dashboard)
+returns integer
+language sql
+stable
+as $$
+    select coalesce(length($1.prompt), 0);
+$$;
+
+create or replace function public.prompt_ascii_chars(public.dashboard)
+returns integer
+language sql
+stable
+as $$
+    select coalesce(length(regexp_replace($1.prompt, '[^\x01-\x7F]', '', 'g')), 0);
+$$;
@@ -0,0 +1,65 @@
+-- スケジューラー: 一時的な失敗の試行回数の記録とデッドレター
+-- run-api-process-docker.py の record_failed_attempts から RPC で呼び出される
+-- （claim_pending_audio_files.sql の scheduler_leases テーブルが必要）
+--
+-- 一時的な失敗（5xx・429）で終わったファイルの attempts を1増やし、
+-- p_max_attempts に達したファイルは dead_letter、それ以外は pending に戻す
+-- dead_letter のファイルは自動では再取得されず、スケジューラーAPIから一覧・再投入する
+
+alter table public.scheduler_leases
+    add column if not exists last_error text,
+    add column if not exists dead_lettered_at timestamptz;
+
+create or replace function public.record_audio_file_failures(
+    p_status_column text,
+    p_file_paths text[],
+    p_max_attempts integer,
+    p_error text default null
+)
+returns table (file_path text, attempts integer, status text)
+language plpgsql
+as $$
+begin
+    if not exists (
+        select 1 from information_schema.columns
+        where table_schema = 'public'
+          and table_name = 'audio_files'
+          and column_name = p_status_column
+          and column_name like '%\_status'
+    ) then
+        raise exception 'unsupported status column: %', p_status_column;
+    end if;
+
+    return query execute format($q$
+        with counted as (
+            insert into public.scheduler_leases (file_path, status_column, attempts, last_error)
+            select f, %2$L, 1, $3
+            from unnest($1::text[]) as f
+            on conflict (file_path, status_column) do update
+                set attempts = public.scheduler_leases.attempts + 1,
+                    last_error = excluded.last_error,
+                    lease_owner = null,
+                    lease_expires_at = null
+            returning public.scheduler_leases.file_path, public.scheduler_leases.attempts
+        ), updated as (
+            update public.audio_files a
+            set %1$I = case when c.attempts >= $2 then 'dead_letter' else 'pending' end
+            from counted c
+            where a.file_path = c.file_path
+              and a.%1$I = 'processing'
+            returning a.file_path, a.%1$I as status
+        ), marked as (
+            update public.scheduler_leases l
+            set dead_lettered_at = now()
+            from updated u
+            where l.file_path = u.file_path
+              and l.status_column = %2$L
+              and u.status = 'dead_letter'
+        )
+        select c.file_path, c.attempts, u.status
+        from counted c
+        join updated u on u.file_path = c.file_path
+    $q$, p_status_column, p_status_column)
+    using p_file_paths, p_max_attempts, p_error;
+end;
+$$;
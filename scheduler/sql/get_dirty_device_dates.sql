@@ -0,0 +1,100 @@
+-- スケジューラー: 上流ステージの結果が変化した (device_id, local_date) の記録と取得
+-- run-api-process-docker.py の get_dirty_device_dates から RPC で呼び出される
+-- デバイスベースステージ（集計・スコアリング）は、ここで返された組み合わせだけを再集計する
+--
+-- 集計が読むのはファイルそのものではなく上流ステージの結果のため、次の変更を scheduler_device_changes に記録する
+--   audio_files: 追加時と、いずれかの *_status カラムが completed / failed に変わったとき（ファイルベースステージの完了）
+--   vibe_whisper / behavior_yamnet / emotion_opensmile: 結果の行の追加・更新（status だけの変更は除く）
+-- バックログで結果がファイルの追加から数時間後に届いても、届いた時刻（changed_at）で再集計の対象になる
+-- （日付をまたいで遅れてアップロードされたファイルも local_date で前日分として記録される）
+
+create table if not exists public.scheduler_device_changes (
+    device_id text not null,
+    local_date date not null,
+    changed_at timestamptz not null default now(),
+    primary key (device_id, local_date)
+);
+
+create index if not exists scheduler_device_changes_changed_at_idx
+    on public.scheduler_device_changes (changed_at, local_date);
+
+create or replace function public.record_scheduler_device_change()
+returns trigger
+language plpgsql
+as $$
+declare
+    new_row jsonb := to_jsonb(NEW);
+    old_row jsonb := case when TG_OP = 'UPDATE' then to_jsonb(OLD) else '{}'::jsonb end;
+    change_date text;
+begin
+    if TG_TABLE_NAME = 'audio_files' then
+        change_date := new_row->>'local_date';
+        if TG_OP = 'UPDATE' and not exists (
+            select 1
+            from jsonb_each_text(new_row) n
+            where n.key like '%\_status'
+              and n.value in ('completed', 'failed')
+              and (old_row->>n.key) is distinct from n.value
+        ) then
+            return NEW;
+        end if;
+    else
+        change_date := new_row->>'date';
+        if TG_OP = 'UPDATE' and (new_row - 'status') = (old_row - 'status') then
+            return NEW;
+        end if;
+    end if;
+
+    if (new_row->>'device_id') is null or change_date is null then
+        return NEW;
+    end if;
+
+    insert into public.scheduler_device_changes (device_id, local_date, changed_at)
+    values (new_row->>'device_id', change_date::date, clock_timestamp())
+    on conflict (device_id, local_date) do update
+        set changed_at = excluded.changed_at;
+    return NEW;
+end;
+$$;
+
+drop trigger if exists scheduler_device_change on public.audio_files;
+create trigger scheduler_device_change
+    after insert or update on public.audio_files
+    for each row execute function public.record_scheduler_device_change();
+
+drop trigger if exists scheduler_device_change on public.vibe_whisper;
+create trigger scheduler_device_change
+    after insert or update on public.vibe_whisper
+    for each row execute function public.record_scheduler_device_change();
+
+drop trigger if exists scheduler_device_change on public.behavior_yamnet;
+create trigger scheduler_device_change
+    after insert or update on public.behavior_yamnet
+    for each row execute function public.record_scheduler_device_change();
+
+drop trigger if exists scheduler_device_change on public.emotion_opensmile;
+create trigger scheduler_device_change
+    after insert or update on public.emotion_opensmile
+    for each row execute function public.record_scheduler_device_change();
+
+-- 適用前の変更を取りこぼさないように、直近の日付は一度だけ変更ありとして記録する
+insert into public.scheduler_device_changes (device_id, local_date, changed_at)
+select distinct a.device_id::text, a.local_date, now()
+from public.audio_files a
+where a.local_date >= current_date - 2
+  and a.device_id is not null
+on conflict (device_id, local_date) do nothing;
+
+drop function if exists public.get_dirty_device_dates(timestamptz, date);
+
+create or replace function public.get_dirty_device_dates(p_since timestamptz, p_min_date date)
+returns table (device_id text, local_date date, changed_at timestamptz)
+language sql
+stable
+as $$
+    select c.device_id, c.local_date, c.changed_at
+    from public.scheduler_device_changes c
+    where c.changed_at >= p_since
+      and c.local_date >= p_min_date
+    order by c.local_date, c.device_id;
+$$;
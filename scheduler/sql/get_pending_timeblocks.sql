@@ -0,0 +1,41 @@
+-- スケジューラー: 未処理（pending）のタイムブロックを3テーブル横断で重複なしに取得
+-- run-api-process-docker.py の get_pending_timeblocks から RPC で呼び出される
+-- （テーブルごとに limit して Python側でマージする方式は、テーブル間の順序が失われ
+--   1テーブルだけpendingのタイムブロックがバックログ中に処理されないことがあったため廃止）
+--
+-- 並び順は (date, time_block, device_id)。p_after_* に前ページの最後のキーを渡すと続きを返す
+
+create index if not exists vibe_whisper_pending_block_idx
+    on public.vibe_whisper (date, time_block, device_id) where status = 'pending';
+create index if not exists behavior_yamnet_pending_block_idx
+    on public.behavior_yamnet (date, time_block, device_id) where status = 'pending';
+create index if not exists emotion_opensmile_pending_block_idx
+    on public.emotion_opensmile (date, time_block, device_id) where status = 'pending';
+
+create or replace view public.pending_timeblocks as
+    select device_id::text as device_id, date, time_block::text as time_block
+    from public.vibe_whisper where status = 'pending'
+    union
+    select device_id::text, date, time_block::text
+    from public.behavior_yamnet where status = 'pending'
+    union
+    select device_id::text, date, time_block::text
+    from public.emotion_opensmile where status = 'pending';
+
+create or replace function public.get_pending_timeblocks(
+    p_limit integer,
+    p_after_date date default null,
+    p_after_time_block text default null,
+    p_after_device_id text default null
+)
+returns table (device_id text, date date, time_block text)
+language sql
+stable
+as $$
+    select p.device_id, p.date, p.time_block
+    from public.pending_timeblocks p
+    where p_after_date is null
+       or (p.date, p.time_block, p.device_id) > (p_after_date, p_after_time_block, p_after_device_id)
+    order by p.date, p.time_block, p.device_id
+    limit p_limit;
+$$;
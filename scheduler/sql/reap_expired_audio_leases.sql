@@ -0,0 +1,73 @@
+-- スケジューラー: リース期限切れで processing のまま残ったファイルの回収
+-- run-api-process-docker.py の reap_expired_leases から RPC で呼び出される
+-- （claim_pending_audio_files.sql の scheduler_leases テーブルが必要）
+--
+-- 1. リースのない processing の行（旧方式・フォールバック取得）には p_lease_seconds のリースを付与する
+--    → 次回以降、期限が切れても processing のままなら回収対象になる
+-- 2. リース期限が切れた processing の行を pending に戻し、attempts を1増やす
+--    （p_max_attempts に達した行は dead_letter にする。dead_letter_audio_files.sql を参照）
+
+drop function if exists public.reap_expired_audio_leases(text, integer);
+
+create or replace function public.reap_expired_audio_leases(
+    p_status_column text,
+    p_lease_seconds integer,
+    p_max_attempts integer default null
+)
+returns table (file_path text, attempts integer, status text)
+language plpgsql
+as $$
+begin
+    if not exists (
+        select 1 from information_schema.columns
+        where table_schema = 'public'
+          and table_name = 'audio_files'
+          and column_name = p_status_column
+          and column_name like '%\_status'
+    ) then
+        raise exception 'unsupported status column: %', p_status_column;
+    end if;
+
+    execute format($q$
+        insert into public.scheduler_leases (file_path, status_column, lease_owner, lease_expires_at, claimed_at)
+        select a.file_path, %2$L, 'unknown', now() + make_interval(secs => $1), now()
+        from public.audio_files a
+        where a.%1$I = 'processing'
+        on conflict (file_path, status_column) do update
+            set lease_owner = excluded.lease_owner,
+                lease_expires_at = excluded.lease_expires_at,
+                claimed_at = excluded.claimed_at
+            where public.scheduler_leases.lease_expires_at is null
+    $q$, p_status_column, p_status_column)
+    using p_lease_seconds;
+
+    return query execute format($q$
+        with expired as (
+            select a.file_path, l.attempts + 1 as next_attempts
+            from public.scheduler_leases l
+            join public.audio_files a on a.file_path = l.file_path
+            where l.status_column = %2$L
+              and l.lease_expires_at < now()
+              and a.%1$I = 'processing'
+            for update of a skip locked
+        ), reset as (
+            update public.audio_files a
+            set %1$I = case when $1 is not null and e.next_attempts >= $1 then 'dead_letter' else 'pending' end
+            from expired e
+            where a.file_path = e.file_path
+            returning a.file_path, a.%1$I as status
+        )
+        update public.scheduler_leases l
+        set attempts = l.attempts + 1,
+            lease_owner = null,
+            lease_expires_at = null,
+            last_error = 'lease expired',
+            dead_lettered_at = case when r.status = 'dead_letter' then now() else l.dead_lettered_at end
+        from reset r
+        where l.file_path = r.file_path
+          and l.status_column = %2$L
+        returning l.file_path, l.attempts, r.status
+    $q$, p_status_column, p_status_column)
+    using p_max_attempts;
+end;
+$$;
@@ -0,0 +1,90 @@
+-- スケジューラー: スケジューリング方針（scheduling.py）用の候補取得とパス指定の取得
+-- run-api-process-docker.py の list_pending_candidates / claim_files_by_path から RPC で呼び出される
+-- （claim_pending_audio_files.sql の scheduler_leases テーブルが必要）
+--
+-- get_pending_audio_heads: デバイスごとに古い順の先頭 p_per_device 件を返す（fair_share 用）
+--   1デバイスのバックログが大きくても、他のデバイスのファイルが候補に含まれる
+-- claim_audio_files: 方針で選んだファイルのうち、まだpendingの行だけをprocessingにしてリースを記録する
+
+create or replace function public.get_pending_audio_heads(
+    p_status_column text,
+    p_per_device integer,
+    p_limit integer
+)
+returns setof jsonb
+language plpgsql
+stable
+as $$
+begin
+    if not exists (
+        select 1 from information_schema.columns
+        where table_schema = 'public'
+          and table_name = 'audio_files'
+          and column_name = p_status_column
+          and column_name like '%\_status'
+    ) then
+        raise exception 'unsupported status column: %', p_status_column;
+    end if;
+
+    return query execute format($q$
+        select to_jsonb(h) - 'rn'
+        from (
+            select a.*, row_number() over (partition by a.device_id order by a.created_at, a.file_path) as rn
+            from public.audio_files a
+            where a.%1$I = 'pending'
+        ) h
+        where h.rn <= $1
+        order by h.rn, h.created_at, h.file_path
+        limit $2
+    $q$, p_status_column)
+    using p_per_device, p_limit;
+end;
+$$;
+
+create or replace function public.claim_audio_files(
+    p_status_column text,
+    p_file_paths text[],
+    p_lease_owner text,
+    p_lease_seconds integer
+)
+returns setof public.audio_files
+language plpgsql
+as $$
+begin
+    if not exists (
+        select 1 from information_schema.columns
+        where table_schema = 'public'
+          and table_name = 'audio_files'
+          and column_name = p_status_column
+          and column_name like '%\_status'
+    ) then
+        raise exception 'unsupported status column: %', p_status_column;
+    end if;
+
+    return query execute format($q$
+        with candidates as (
+            select a.file_path
+            from public.audio_files a
+            where a.file_path = any($1)
+              and a.%1$I = 'pending'
+            for update skip locked
+        ), claimed as (
+            update public.audio_files a
+            set %1$I = 'processing'
+            from candidates c
+            where a.file_path = c.file_path
+            returning a.*
+        ), leased as (
+            insert into public.scheduler_leases (file_path, status_column, lease_owner, lease_expires_at, claimed_at)
+            select file_path, %2$L, $2, now() + make_interval(secs => $3), now()
+            from claimed
+            on conflict (file_path, status_column) do update
+                set lease_owner = excluded.lease_owner,
+                    lease_expires_at = excluded.lease_expires_at,
+                    claimed_at = excluded.claimed_at
+        )
+        select * from claimed
+    $q$, p_status_column, p_status_column)
+    using p_file_paths, p_lease_owner, p_lease_seconds;
+end;
+$$;
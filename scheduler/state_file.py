@@ -0,0 +1,143 @@
+"""
+スケジューラーの状態ファイル（JSON）の排他付き読み書き
+CLI実行と常駐エンジンなど、複数プロセスから同時に更新される状態の保存に使う
+設定ファイル（config.json）はキャッシュ付き読み込み・アトミック書き込みの AtomicJsonFile を使う
+"""
+
+import copy
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def locked_json_state(path: str) -> Iterator[Dict]:
+    """
+    状態ファイルを排他ロックして読み込み、ブロック終了時に書き戻す
+    ファイルが存在しない・壊れている場合は空のdictから始める
+
+        with locked_json_state(path) as state:
+            state["key"] = value
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            content = f.read()
+            try:
+                state = json.loads(content) if content else {}
+            except ValueError:
+                logger.warning(f"状態ファイルが壊れているため初期化します: {path}")
+                state = {}
+
+            yield state
+
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class AtomicJsonFile:
+    """
+    設定ファイル（JSON）のキャッシュ付き読み込みと、ロック付きのアトミックな書き込み
+    複数のリクエスト・スレッドから参照される設定（スケジューラーAPIの config.json）に使う
+
+    - 読み込みはファイルの inode / mtime / サイズが変わったときだけ解析し直す（それ以外はキャッシュのコピーを返す）
+    - 書き込みはロックファイルの排他ロック中に一時ファイルへ書き出し、fsync してから rename で置き換える
+      （読み込み側が書きかけのファイルを読むことはない）
+    """
+
+    def __init__(self, path: str, default_factory):
+        self.path = path
+        self.default_factory = default_factory
+        self._cache = None
+        self._cache_key = None
+        self._lock = threading.Lock()
+
+    @property
+    def lock_path(self) -> str:
+        directory, name = os.path.split(self.path)
+        return os.path.join(directory, f".{name}.lock")
+
+    def _file_key(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load(self) -> Dict:
+        """キャッシュが古ければ読み直す（呼び出し側で self._lock を取得済み）"""
+        key = self._file_key()
+        if key is None:
+            self._cache, self._cache_key = None, None
+            return self.default_factory()
+        if key != self._cache_key:
+            with open(self.path, 'r') as f:
+                self._cache = json.load(f)
+            self._cache_key = key
+        return copy.deepcopy(self._cache)
+
+    def read(self) -> Dict:
+        """現在の内容（変更してもキャッシュには影響しない）"""
+        with self._lock:
+            return self._load()
+
+    def _write(self, data: Dict):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(self.path)}.")
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # renameを永続化
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self._cache = copy.deepcopy(data)
+        self._cache_key = self._file_key()
+
+    @contextmanager
+    def update(self) -> Iterator[Dict]:
+        """
+        排他ロック中に最新の内容を読み込み、ブロック終了時にアトミックに書き込む（同時更新で変更が失われない）
+
+            with store.update() as config:
+                config["apis"][api_name] = settings
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._lock, open(self.lock_path, 'a+') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                data = self._load()
+                yield data
+                self._write(data)
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def write(self, data: Dict):
+        """内容全体を置き換える"""
+        with self.update() as current:
+            current.clear()
+            current.update(data)
@@ -0,0 +1,141 @@
+"""
+ステータス更新の書き込みバッファ（write-behind）
+1行ごとの update ... eq() をやめ、同じ更新内容の行をまとめて in_() フィルタで一括更新する
+
+- 更新内容（ステータス等）ごとにグループ化し、URL長の上限に収まるようにチャンク分割する
+- バッチの区切りとプロセス終了時にflushする
+- 一括更新が失敗したチャンクは1行ずつ更新し直し、失敗した行を特定して報告する
+"""
+
+import atexit
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# in_()フィルタに詰めるキーのURLエンコード後の合計長の上限（PostgRESTのURL長制限対策）
+MAX_FILTER_URL_LENGTH = 4000
+# 1チャンクあたりの最大行数
+MAX_CHUNK_ROWS = 200
+
+
+def chunk_keys(keys: Sequence[str], max_url_length: int = MAX_FILTER_URL_LENGTH,
+               max_rows: int = MAX_CHUNK_ROWS) -> List[List[str]]:
+    """in_()フィルタ用にキーをURL長・行数の上限内のチャンクに分割"""
+    chunks, current, current_length = [], [], 0
+    for key in keys:
+        # 引用符とカンマ分を加算
+        key_length = len(quote(str(key), safe='')) + 3
+        if current and (current_length + key_length > max_url_length or len(current) >= max_rows):
+            chunks.append(current)
+            current, current_length = [], 0
+        current.append(key)
+        current_length += key_length
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class StatusWriteBuffer:
+    """
+    ステータス更新をバッファし、flush時にまとめて書き込む
+
+    key_columns: 行を特定するカラム。最後のカラムをin_()で、それ以外をeq()で絞り込む
+                 例: ('file_path',) / ('device_id', 'date', 'time_block')
+    stamp: flush時に全行へ付与する追加カラムを返す関数（例: processed_at）
+    flush_at_exit: プロセス終了時にflushする（呼び出しごとに作ってその場でflushするバッファはFalse）
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable,
+        table: str,
+        key_columns: Tuple[str, ...],
+        stamp: Optional[Callable[[], Dict]] = None,
+        api_logger=None,
+        flush_at_exit: bool = True
+    ):
+        self._client_factory = client_factory
+        self.table = table
+        self.key_columns = key_columns
+        self._stamp = stamp
+        self._log = api_logger or logger
+        self._pending: Dict[Tuple, Dict] = {}  # キー -> 更新内容（同じキーは後勝ち）
+        self._lock = threading.Lock()
+        if flush_at_exit:
+            atexit.register(self.flush)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def set(self, row: Dict, values: Dict):
+        """行の更新内容をバッファに追加"""
+        key = tuple(row[column] for column in self.key_columns)
+        with self._lock:
+            self._pending[key] = dict(values)
+
+    def flush(self, api_logger=None) -> Dict:
+        """
+        バッファ内容を一括更新する
+        戻り値: {"updated": 更新行数, "failed": 失敗した行のキー一覧, "requests": 発行したリクエスト数}
+        """
+        log = api_logger or self._log
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        result = {"updated": 0, "failed": [], "requests": 0}
+        if not pending:
+            return result
+
+        extra = self._stamp() if self._stamp else {}
+
+        # 更新内容 + 固定カラム（eq対象）ごとにグループ化
+        groups: Dict[Tuple, List] = {}
+        for key, values in pending.items():
+            group_key = (tuple(sorted(values.items())), key[:-1])
+            groups.setdefault(group_key, []).append(key[-1])
+
+        client = self._client_factory()
+        for (values_items, fixed_values), in_keys in groups.items():
+            values = {**dict(values_items), **extra}
+            for chunk in chunk_keys(in_keys):
+                self._write_chunk(client, values, fixed_values, chunk, result, log)
+
+        if result["failed"]:
+            log.error(f"{self.table}: 一括ステータス更新 - {result['updated']}件成功, {len(result['failed'])}件失敗 ({result['requests']}リクエスト)")
+        else:
+            log.info(f"{self.table}: 一括ステータス更新 - {result['updated']}件 ({result['requests']}リクエスト)")
+        return result
+
+    def _base_query(self, client, values: Dict, fixed_values: Tuple):
+        query = client.table(self.table).update(values)
+        for column, value in zip(self.key_columns[:-1], fixed_values):
+            query = query.eq(column, value)
+        return query
+
+    def _write_chunk(self, client, values: Dict, fixed_values: Tuple, chunk: List, result: Dict, log):
+        in_column = self.key_columns[-1]
+        try:
+            result["requests"] += 1
+            response = self._base_query(client, values, fixed_values).in_(in_column, chunk).execute()
+            updated = {row.get(in_column) for row in (response.data or [])}
+            result["updated"] += len(updated)
+            # 一致する行がなかったキーは失敗として報告
+            for key in chunk:
+                if key not in updated:
+                    result["failed"].append(fixed_values + (key,))
+                    log.error(f"  - {key}: 更新対象の行が見つかりません")
+        except Exception as e:
+            # チャンク全体が失敗した場合は1行ずつ更新して失敗行を特定
+            log.warning(f"{self.table}: 一括更新エラーのため1行ずつ再試行 ({len(chunk)}件): {e}")
+            for key in chunk:
+                try:
+                    result["requests"] += 1
+                    self._base_query(client, values, fixed_values).eq(in_column, key).execute()
+                    result["updated"] += 1
+                except Exception as row_error:
+                    result["failed"].append(fixed_values + (key,))
+                    log.error(f"  - {key}: ステータス更新エラー: {row_error}")
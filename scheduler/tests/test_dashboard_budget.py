@@ -0,0 +1,126 @@
+"""
+timeblock-analysis（dashboard_based）の予算見積もりを run_api の実行経路で確認する
+Supabaseクライアント・下流API呼び出しは偽物に差し替える
+"""
+
+import asyncio
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SCHEDULER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCHEDULER_DIR)
+
+from budget import BudgetGovernor, estimate_tokens  # noqa: E402
+from run_history import RunHistory  # noqa: E402
+
+
+def load_runner():
+    spec = importlib.util.spec_from_file_location(
+        "run_api_process_docker_test", os.path.join(SCHEDULER_DIR, "run-api-process-docker.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """PostgRESTのクエリビルダーの代わり（呼び出しは全て自身を返し、executeで行を返す）"""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.columns = None
+
+    @property
+    def not_(self):
+        return self
+
+    def select(self, columns, **kwargs):
+        self.columns = columns
+        return self
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        self.client.selected.append((self.table, self.columns))
+        if self.columns is None:
+            return FakeResponse([])
+        missing = [c.strip() for c in self.columns.split(',') if c.strip() not in self.client.available_columns]
+        if missing:
+            raise Exception(f"column dashboard.{missing[0]} does not exist")
+        return FakeResponse([{c.strip(): row[c.strip()] for c in self.columns.split(',')} for row in self.client.rows])
+
+
+class FakeSupabase:
+    def __init__(self, rows, available_columns):
+        self.rows = rows
+        self.available_columns = available_columns
+        self.selected = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+ROW = {"device_id": "d1", "date": "2026-10-18", "time_block": "10-00",
+       "prompt_chars": 2000, "prompt_ascii_chars": 1600}
+ALL_COLUMNS = set(ROW)
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    module = load_runner()
+    monkeypatch.setattr(module, "LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(module, "check_endpoint", lambda api_name, api_logger=None: True)
+    monkeypatch.setattr(module, "budget_governor", BudgetGovernor(state_file=str(tmp_path / "budget.json")))
+    monkeypatch.setattr(module, "run_history", RunHistory(str(tmp_path / "history.db")))
+    monkeypatch.setattr(module.dashboard_status_writer, "flush", lambda api_logger=None: {"failed": []})
+    sent = []
+
+    async def fake_call(client, item, api_logger=None, unsent=None):
+        sent.append(item)
+        return True
+
+    monkeypatch.setattr(module, "call_dashboard_analysis_api", fake_call)
+    module.sent_items = sent
+    return module
+
+
+def run_timeblock_analysis(runner, monkeypatch, available_columns):
+    supabase = FakeSupabase([dict(ROW)], available_columns)
+    monkeypatch.setattr(runner, "get_supabase_client", lambda: supabase)
+    assert runner.run_api("timeblock-analysis", mode="manual") is True
+    return supabase
+
+
+def test_budget_is_estimated_from_prompt_and_ascii_chars(runner, monkeypatch):
+    supabase = run_timeblock_analysis(runner, monkeypatch, ALL_COLUMNS)
+
+    assert len(runner.sent_items) == 1
+    assert ("dashboard", runner.DASHBOARD_LISTING_COLUMNS) in supabase.selected
+    usage = runner.budget_governor.usage()["hour"]
+    assert usage["requests"] == 1
+    assert usage["tokens"] == estimate_tokens(ROW["prompt_chars"], ROW["prompt_ascii_chars"])
+
+
+def test_listing_falls_back_to_prompt_chars_only(runner, monkeypatch):
+    run_timeblock_analysis(runner, monkeypatch, ALL_COLUMNS - {"prompt_ascii_chars"})
+
+    assert len(runner.sent_items) == 1
+    usage = runner.budget_governor.usage()["hour"]
+    assert usage["tokens"] == estimate_tokens(ROW["prompt_chars"])
+
+
+def test_listing_falls_back_to_keys_only(runner, monkeypatch):
+    run_timeblock_analysis(runner, monkeypatch, ALL_COLUMNS - {"prompt_chars", "prompt_ascii_chars"})
+
+    assert len(runner.sent_items) == 1
+    usage = runner.budget_governor.usage()["hour"]
+    assert usage["tokens"] == runner.API_CONFIGS["timeblock-analysis"]["estimated_prompt_tokens"]
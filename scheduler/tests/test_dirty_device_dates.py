@@ -0,0 +1,122 @@
+"""
+get_dirty_device_dates のフォールバック（RPCなし）が (local_date, device_id) のキーセットで全件走査することを確認する
+"""
+
+import importlib.util
+import logging
+import os
+import re
+import sys
+from datetime import datetime
+
+import pytest
+
+SCHEDULER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCHEDULER_DIR)
+
+
+def load_runner():
+    spec = importlib.util.spec_from_file_location(
+        "run_api_process_docker_dirty_test", os.path.join(SCHEDULER_DIR, "run-api-process-docker.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeChangesQuery:
+    """scheduler_device_changes の select / gte / or_(キーセット) / order / limit だけを解釈する"""
+
+    def __init__(self, client):
+        self.client = client
+        self.after = None
+        self.limit_rows = None
+
+    def select(self, columns):
+        return self
+
+    def gte(self, column, value):
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def or_(self, filters):
+        values = re.findall(r'"((?:[^"\\]|\\.)*)"', filters)
+        # local_date.gt."日付",and(local_date.eq."日付",device_id.gt."ID")
+        self.after = (values[0], values[2].replace('\\"', '"').replace('\\\\', '\\'))
+        return self
+
+    def limit(self, count):
+        self.limit_rows = count
+        return self
+
+    def execute(self):
+        self.client.pages_requested += 1
+        rows = sorted(self.client.rows, key=lambda row: (row['local_date'], row['device_id']))
+        if self.after:
+            rows = [row for row in rows if (row['local_date'], row['device_id']) > self.after]
+        # サーバー側の最大行数で1ページが短くなる場合
+        page = rows[:min(self.limit_rows, self.client.max_rows)]
+        if self.client.on_page:
+            self.client.on_page(self.client)
+        return FakeResponse(page)
+
+
+class FakeSupabase:
+    def __init__(self, rows, max_rows, on_page=None):
+        self.rows = rows
+        self.max_rows = max_rows
+        self.on_page = on_page
+        self.pages_requested = 0
+
+    def rpc(self, name, params):
+        raise Exception("function get_dirty_device_dates does not exist")
+
+    def table(self, name):
+        return FakeChangesQuery(self)
+
+
+@pytest.fixture
+def runner():
+    return load_runner()
+
+
+def collect(runner, monkeypatch, supabase):
+    monkeypatch.setattr(runner, "get_supabase_client", lambda: supabase)
+    return runner.get_dirty_device_dates(datetime(2026, 10, 17), "2026-10-16", logging.getLogger("test"))
+
+
+def test_fallback_reads_every_row_even_when_pages_are_capped(runner, monkeypatch):
+    rows = [{"device_id": f"d{i:03d}", "local_date": date} for date in ("2026-10-16", "2026-10-17") for i in range(25)]
+    supabase = FakeSupabase(rows, max_rows=7)
+
+    pairs = collect(runner, monkeypatch, supabase)
+
+    assert pairs == [(row["device_id"], row["local_date"]) for row in rows]
+    assert supabase.pages_requested == 50 // 7 + 2
+
+
+def test_fallback_does_not_skip_or_repeat_rows_when_earlier_rows_are_added(runner, monkeypatch):
+    rows = [{"device_id": f"d{i:03d}", "local_date": "2026-10-17"} for i in range(10)]
+
+    def insert_earlier_row(client):
+        # 走査中に、読み終わった範囲より前に行が追加される（オフセットでは後続の行がずれる）
+        if client.pages_requested == 1:
+            client.rows.append({"device_id": "a000", "local_date": "2026-10-16"})
+
+    supabase = FakeSupabase(rows, max_rows=4, on_page=insert_earlier_row)
+
+    pairs = collect(runner, monkeypatch, supabase)
+
+    assert pairs == [(f"d{i:03d}", "2026-10-17") for i in range(10)]
+
+
+def test_keyset_filter_quotes_values(runner):
+    assert runner.device_change_keyset_after("2026-10-17", 'dev,1."x"') == (
+        'local_date.gt."2026-10-17",and(local_date.eq."2026-10-17",device_id.gt."dev,1.\\"x\\"")'
+    )
@@ -0,0 +1,82 @@
+"""
+request_endpoint の再試行の範囲（冪等なGETと、冪等でないPOSTの違い）を確認する
+下流APIは httpx.MockTransport で置き換える
+"""
+
+import asyncio
+import importlib.util
+import os
+import sys
+
+import httpx
+import pytest
+
+SCHEDULER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCHEDULER_DIR)
+
+import circuit_breaker  # noqa: E402
+
+
+def load_runner():
+    spec = importlib.util.spec_from_file_location(
+        "run_api_process_docker_retry_test", os.path.join(SCHEDULER_DIR, "run-api-process-docker.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    module = load_runner()
+    monkeypatch.setattr(module, "backoff_delay", lambda attempt: 0)
+    # サーキットブレーカーはテストごとに新しくする
+    monkeypatch.setattr(circuit_breaker, "_breakers", {})
+    return module
+
+
+def send(runner, api_name, method, statuses):
+    """statuses の順に応答する下流APIへ1回リクエストし、(最終ステータス, リクエスト回数) を返す"""
+    runner.reset_retry_budget(api_name)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        status = statuses[min(len(calls), len(statuses)) - 1]
+        if isinstance(status, Exception):
+            raise status
+        return httpx.Response(status, json={})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            response = await runner.request_endpoint(client, api_name, method, json={})
+            return response.status_code
+
+    return asyncio.run(run()), len(calls)
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_post_is_not_resent_on_5xx_that_may_still_be_processing(runner, status):
+    assert send(runner, "behavior-features", "POST", [status, 200]) == (status, 1)
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_post_is_resent_when_the_request_was_not_accepted(runner, status):
+    assert send(runner, "behavior-features", "POST", [status, 200]) == (200, 2)
+
+
+def test_post_is_resent_on_connect_error(runner):
+    assert send(runner, "behavior-features", "POST", [httpx.ConnectError("refused"), 200]) == (200, 2)
+
+
+def test_post_is_not_resent_on_read_timeout(runner):
+    with pytest.raises(httpx.ReadTimeout):
+        send(runner, "behavior-features", "POST", [httpx.ReadTimeout("slow"), 200])
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_get_is_resent_on_5xx(runner, status):
+    assert send(runner, "vibe-aggregator", "GET", [status, 200]) == (200, 2)
+
+
+def test_get_is_resent_on_read_timeout(runner):
+    assert send(runner, "vibe-aggregator", "GET", [httpx.ReadTimeout("slow"), 200]) == (200, 2)
@@ -0,0 +1,46 @@
+"""
+デバイスベースステージの差分処理用ウォーターマーク
+ステージごとに「どの時点までの変更を処理したか」と、失敗して再実行が必要な (device_id, date) を保存する
+
+- 状態はJSONファイルに保存し、CLI実行・常駐エンジンの両方で引き継ぐ
+- ウォーターマークがまだない場合はNoneを返し、呼び出し側で初期範囲を決める
+"""
+
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from state_file import locked_json_state
+
+logger = logging.getLogger(__name__)
+
+# ウォーターマークの保存先（scheduler-configボリューム）
+WATERMARK_STATE_FILE = os.environ.get('WATERMARK_STATE_FILE', '/app/config/device-watermarks.json')
+
+# (device_id, date)
+DevicePair = Tuple[str, str]
+
+
+class WatermarkStore:
+    """ステージごとのウォーターマークと再実行待ちの (device_id, date)"""
+
+    def __init__(self, state_file: str = WATERMARK_STATE_FILE):
+        self.state_file = state_file
+
+    def get(self, api_name: str) -> Tuple[Optional[str], List[DevicePair]]:
+        """戻り値: (ウォーターマーク（ISO形式）またはNone, 再実行待ちの (device_id, date) のリスト)"""
+        with locked_json_state(self.state_file) as state:
+            entry = state.get(api_name) or {}
+        return entry.get("since"), [tuple(pair) for pair in entry.get("retry", [])]
+
+    def advance(self, api_name: str, since: str, retry: List[DevicePair]):
+        """ウォーターマークを進め、失敗した (device_id, date) を次回の再実行待ちとして保存"""
+        with locked_json_state(self.state_file) as state:
+            state[api_name] = {
+                "since": since,
+                "retry": [list(pair) for pair in sorted(set(retry))]
+            }
+
+    def snapshot(self) -> Dict:
+        with locked_json_state(self.state_file) as state:
+            return dict(state)